@@ -0,0 +1,57 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the closed-form computation of the cycle dates with the rrule based
+one it replaced, for subscriptions started years ago.
+
+Run it from the repository's root: python benchmarks/cycle_dates.py
+"""
+
+import datetime as dt
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings_test')
+
+import django  # noqa: E402
+django.setup()
+
+from silver.tests.unit.test_cycle_dates import rrule_last_cycle_start_date  # noqa: E402
+from silver.utils.dates import last_cycle_start_date  # noqa: E402
+
+
+def main(repeat=20):
+    start_date = dt.date(2010, 1, 1)
+    reference_date = dt.date(2018, 1, 1)
+
+    for interval in ('day', 'week', 'month'):
+        rrule_duration = timeit.timeit(
+            lambda: rrule_last_cycle_start_date(start_date, reference_date, interval, 1),
+            number=repeat
+        )
+        duration = timeit.timeit(
+            lambda: last_cycle_start_date(start_date, reference_date, interval, 1),
+            number=repeat
+        )
+
+        sys.stdout.write('%s intervals since %s: rrule %.5fs, closed-form %.5fs\n' % (
+            interval, start_date, rrule_duration, duration
+        ))
+
+
+if __name__ == '__main__':
+    main()
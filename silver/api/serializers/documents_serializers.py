@@ -1,9 +1,11 @@
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 
 # from silver.api.serializers import PDFUrl
 from silver.api.serializers.common import CustomerUrl, PDFUrl
 from silver.api.serializers.transaction_serializers import TransactionSerializer
 from silver.models import DocumentEntry, Customer, Invoice, Proforma, BillingDocumentBase
+from silver.models.documents import DocumentEntryAccumulator
 
 
 class DocumentEntrySerializer(serializers.HyperlinkedModelSerializer):
@@ -80,7 +82,9 @@ class DocumentSerializer(serializers.HyperlinkedModelSerializer):
                   'customer', 'due_date', 'issue_date', 'paid_date',
                   'cancel_date', 'sales_tax_name', 'sales_tax_percent',
                   'transaction_currency', 'currency', 'state', 'total',
-                  'total_in_transaction_currency', 'pdf_url', 'transactions')
+                  'total_in_transaction_currency', 'amount_paid_in_transaction_currency',
+                  'amount_pending_in_transaction_currency',
+                  'amount_to_be_charged_in_transaction_currency', 'pdf_url', 'transactions')
         read_only_fields = fields
 
 
@@ -114,13 +118,16 @@ class InvoiceSerializer(serializers.HyperlinkedModelSerializer):
         invoice = Invoice.objects.create(**validated_data)
 
         # Add the invoice entries
+        document_entries = DocumentEntryAccumulator()
         for entry in entries:
             entry_dict = dict()
             entry_dict['invoice'] = invoice
             for field in entry.items():
                 entry_dict[field[0]] = field[1]
 
-            DocumentEntry.objects.create(**entry_dict)
+            document_entries.add(**entry_dict)
+
+        document_entries.flush()
 
         return invoice
 
@@ -141,6 +148,14 @@ class InvoiceSerializer(serializers.HyperlinkedModelSerializer):
 
         return instance
 
+    def to_representation(self, instance):
+        # The entries' amounts are evaluated against the serialized invoice
+        # instance, instead of fetching it again for each entry
+        prefetch_related_objects([instance], 'invoice_entries__product_code')
+        instance.evaluate_entries(instance.entries)
+
+        return super(InvoiceSerializer, self).to_representation(instance)
+
     def validate(self, data):
         data = super(InvoiceSerializer, self).validate(data)
 
@@ -182,13 +197,16 @@ class ProformaSerializer(serializers.HyperlinkedModelSerializer):
 
         proforma = Proforma.objects.create(**validated_data)
 
+        document_entries = DocumentEntryAccumulator()
         for entry in entries:
             entry_dict = dict()
             entry_dict['proforma'] = proforma
             for field in entry.items():
                 entry_dict[field[0]] = field[1]
 
-            DocumentEntry.objects.create(**entry_dict)
+            document_entries.add(**entry_dict)
+
+        document_entries.flush()
 
         return proforma
 
@@ -209,6 +227,14 @@ class ProformaSerializer(serializers.HyperlinkedModelSerializer):
 
         return instance
 
+    def to_representation(self, instance):
+        # The entries' amounts are evaluated against the serialized proforma
+        # instance, instead of fetching it again for each entry
+        prefetch_related_objects([instance], 'proforma_entries__product_code')
+        instance.evaluate_entries(instance.entries)
+
+        return super(ProformaSerializer, self).to_representation(instance)
+
     def validate(self, data):
         data = super(ProformaSerializer, self).validate(data)
 
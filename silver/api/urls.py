@@ -87,6 +87,8 @@ urlpatterns = [
         documents_views.InvoiceEntryCreate.as_view(), name='invoice-entry-create'),
     url(r'^invoices/(?P<document_pk>[0-9]+)/entries/(?P<entry_pk>[0-9]+)/$',
         documents_views.InvoiceEntryUpdateDestroy.as_view(), name='invoice-entry-update'),
+    url(r'^invoices/state/$',
+        documents_views.InvoiceBulkStateHandler.as_view(), name='invoice-bulk-state'),
     url(r'^invoices/(?P<pk>[0-9]+)/state/$',
         documents_views.InvoiceStateHandler.as_view(), name='invoice-state'),
     url(r'^invoices/(?P<invoice_id>\d+).pdf$',
@@ -101,6 +103,8 @@ urlpatterns = [
     url(r'^proformas/(?P<document_pk>[0-9]+)/entries/(?P<entry_pk>[0-9]+)/$',
         documents_views.ProformaEntryUpdateDestroy.as_view(),
         name='proforma-entry-update'),
+    url(r'^proformas/state/$',
+        documents_views.ProformaBulkStateHandler.as_view(), name='proforma-bulk-state'),
     url(r'^proformas/(?P<pk>[0-9]+)/state/$',
         documents_views.ProformaStateHandler.as_view(), name='proforma-state'),
     url(r'^proformas/(?P<pk>[0-9]+)/invoice/$',
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import django
 from django.db.models import Q
 from django.http import HttpResponseRedirect
@@ -12,12 +14,13 @@ from silver.api.filters import InvoiceFilter, ProformaFilter, BillingDocumentFil
 from silver.api.serializers.documents_serializers import InvoiceSerializer, \
     DocumentEntrySerializer, ProformaSerializer, DocumentSerializer
 from silver.models import Invoice, BillingDocumentBase, DocumentEntry, Proforma, PDF
+from silver.models.documents import DocumentEntryAccumulator
 
 
 class InvoiceListCreate(generics.ListCreateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = InvoiceSerializer
-    queryset = Invoice.objects.all()\
+    queryset = Invoice.objects.with_totals()\
         .select_related('related_document')\
         .prefetch_related('invoice_transactions')
     filter_backends = (DjangoFilterBackend,)
@@ -54,7 +57,9 @@ class DocEntryCreate(generics.CreateAPIView):
                                             model_lower=model_name.lower())
             return Response({"detail": msg}, status=status.HTTP_403_FORBIDDEN)
 
-        serializer = DocumentEntrySerializer(data=request.data,
+        # A list of entries can be added at once
+        many = isinstance(request.data, list)
+        serializer = DocumentEntrySerializer(data=request.data, many=many,
                                              context={'request': request})
 
         if serializer.is_valid(raise_exception=True):
@@ -62,8 +67,23 @@ class DocEntryCreate(generics.CreateAPIView):
             # {proforma: <proforma_object>} as a DocumentEntry can have a
             # foreign key to either an invoice or a proforma
             extra_context = {model_name.lower(): document}
-            serializer.save(**extra_context)
 
+            if not many:
+                serializer.save(**extra_context)
+
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+            # The entries are inserted using a single query and the document's
+            # totals are updated once
+            entries = DocumentEntryAccumulator()
+            for entry_data in serializer.validated_data:
+                entries.add(**dict(entry_data, **extra_context))
+
+            created_entries = entries.entries
+            entries.flush()
+
+            serializer = DocumentEntrySerializer(created_entries, many=True,
+                                                 context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
@@ -205,10 +225,76 @@ class InvoiceStateHandler(APIView):
         return Response(serializer.data)
 
 
+class DocumentsBulkStateHandler(APIView):
+    """
+    Transitions many documents at once (see
+    BillingDocumentBase.bulk_transition), given their `ids`.
+    """
+
+    def put(self, request, *args, **kwargs):
+        Model = self.get_model()
+
+        state = request.data.get('state', None)
+        if not state:
+            msg = "You have to provide a value for the state field."
+            return Response({"detail": msg}, status=status.HTTP_403_FORBIDDEN)
+        elif state not in Model.BULK_TRANSITIONS:
+            msg = "Illegal state value."
+            return Response({"detail": msg}, status=status.HTTP_403_FORBIDDEN)
+
+        document_ids = request.data.get('ids', None)
+        try:
+            document_ids = [int(document_id) for document_id in document_ids]
+        except (TypeError, ValueError):
+            document_ids = None
+
+        if not document_ids:
+            msg = "You have to provide a list of {model_name} ids.".format(
+                model_name=self.get_model_name().lower()
+            )
+            return Response({"detail": msg}, status=status.HTTP_400_BAD_REQUEST)
+
+        transition_kwargs = {
+            argument: request.data.get(argument, None)
+            for argument in Model.BULK_TRANSITIONS[state][2]
+        }
+
+        # The transitions' arguments are all dates
+        for argument, value in transition_kwargs.items():
+            if value is None:
+                continue
+
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except (TypeError, ValueError):
+                msg = "Invalid {argument} value, a YYYY-MM-DD date is expected.".format(
+                    argument=argument
+                )
+                return Response({"detail": msg}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = Model.bulk_transition(document_ids, state, **transition_kwargs)
+
+        return Response([
+            {'id': document_id, 'state': result['document'].state} if 'document' in result
+            else {'id': document_id, 'detail': result['error']}
+            for document_id, result in results.items()
+        ])
+
+
+class InvoiceBulkStateHandler(DocumentsBulkStateHandler):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_model(self):
+        return Invoice
+
+    def get_model_name(self):
+        return "Invoice"
+
+
 class ProformaListCreate(generics.ListCreateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = ProformaSerializer
-    queryset = Proforma.objects.all()\
+    queryset = Proforma.objects.with_totals()\
         .select_related('related_document')\
         .prefetch_related('proforma_transactions')
     filter_backends = (DjangoFilterBackend,)
@@ -340,6 +426,16 @@ class ProformaStateHandler(APIView):
         return Response(serializer.data)
 
 
+class ProformaBulkStateHandler(DocumentsBulkStateHandler):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_model(self):
+        return Proforma
+
+    def get_model_name(self):
+        return "Proforma"
+
+
 class DocumentList(ListAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = DocumentSerializer
@@ -353,7 +449,8 @@ class DocumentList(ListAPIView):
         if django_version[0] == '1' and int(django_version[1]) < 11:
             return BillingDocumentBase.objects.filter(
                 Q(kind='invoice') | Q(kind='proforma', related_document=None)
-            ).select_related('customer', 'provider', 'pdf')
+            ).select_related('customer', 'provider', 'pdf').with_totals() \
+                .with_transactions_amounts()
 
         invoices = BillingDocumentBase.objects \
             .filter(kind='invoice') \
@@ -362,7 +459,8 @@ class DocumentList(ListAPIView):
             .filter(kind='proforma', related_document=None) \
             .prefetch_related('proforma_transactions__payment_method')
 
-        return (invoices | proformas).select_related('customer', 'provider', 'pdf')
+        return (invoices | proformas).select_related('customer', 'provider', 'pdf') \
+            .with_totals().with_transactions_amounts()
 
 
 class PDFRetrieve(generics.RetrieveAPIView):
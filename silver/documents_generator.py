@@ -15,16 +15,76 @@
 
 import datetime as dt
 import logging
+from collections import OrderedDict
 from decimal import Decimal
 
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import OuterRef, Prefetch, QuerySet, Subquery
 from django.utils import timezone
 
-from silver.models import Customer, Subscription, Proforma, Invoice, Provider, BillingLog
+from silver.models import (Customer, Subscription, Proforma, Invoice, Provider, BillingLog,
+                           BillingRun)
+from silver.models.documents import DocumentEntryAccumulator
 from silver.utils.dates import ONE_DAY
+from silver.utils.iterables import chunks, queryset_chunks
+from silver.utils.profiling import (CUSTOMER_PHASE, BillingProfiler, profile_phase,
+                                    profiled)
 
 logger = logging.getLogger(__name__)
 
 
+DOCS_GENERATION_BATCH_SIZE = getattr(settings, 'DOCS_GENERATION_BATCH_SIZE',
+                                     100)  # default 100 customers
+
+
+def merge_billing_summaries(summaries):
+    """
+    Merges the summaries returned by `DocumentsGenerator.generate_for_customers`
+    (e.g. one for each shard of a billing run) into a single run summary.
+    """
+    run_summary = {
+        'shards': 0,
+        'customers': 0,
+        'documents': 0,
+        'failed_customers': []
+    }
+
+    for summary in summaries:
+        run_summary['shards'] += 1
+        run_summary['customers'] += summary['customers']
+        run_summary['documents'] += summary['documents']
+        run_summary['failed_customers'].extend(summary['failed_customers'])
+
+    return run_summary
+
+
+def summarize_billing_preview(document_previews):
+    """
+    Sums up the documents yielded by `DocumentsGenerator.preview` per provider
+    and currency.
+
+    :returns: a dict mapping the providers ids to dicts which map currencies to
+        the number of documents and their total.
+    """
+
+    totals = {}
+
+    for document_preview in document_previews:
+        document = document_preview['document']
+
+        provider_totals = totals.setdefault(document.provider_id, {})
+        currency_totals = provider_totals.setdefault(document.currency, {
+            'documents': 0,
+            'total': Decimal('0.00')
+        })
+
+        currency_totals['documents'] += 1
+        currency_totals['total'] += document_preview['total']
+
+    return totals
+
+
 class DocumentsGenerator(object):
     def generate(self, subscription=None, billing_date=None, customers=None,
                  force_generate=False):
@@ -53,7 +113,12 @@ class DocumentsGenerator(object):
         """
 
         if not subscription:
-            customers = customers or Customer.objects.all()
+            billing_date = billing_date or timezone.now().date()
+
+            if customers is None:
+                customers = (Customer.objects.all() if force_generate else
+                             self.get_customers_due_for_billing(billing_date))
+
             self._generate_all(billing_date=billing_date,
                                customers=customers,
                                force_generate=force_generate)
@@ -72,16 +137,238 @@ class DocumentsGenerator(object):
         billing_date = billing_date or timezone.now().date()
         # billing_date -> the date when the billing documents are issued.
 
-        for customer in customers:
+        for customers_batch in self._customers_batches(customers):
+            subscriptions = self.prefetch_subscriptions(
+                customers_batch, billing_date=None if force_generate else billing_date
+            )
+
+            for customer in customers_batch:
+                self._generate_for_customer(customer, billing_date, force_generate,
+                                            subscriptions=subscriptions[customer.pk])
+
+    def generate_for_customers(self, customer_ids, billing_date=None,
+                               force_generate=False):
+        """
+        Generates the billing documents for the given customers (usually a
+        shard of a bigger billing run).
+
+        Each customer is billed within its own transaction, so that a failure
+        only rolls back the documents of the customer that caused it, which is
+        then reported in the returned summary instead of aborting the shard.
+
+        :param customer_ids: the ids of the customers to be billed.
+        :param billing_date: the date used as billing date
+        :param force_generate: see `generate`.
+        :returns: a dict containing the number of billed customers, the number
+            of generated documents and the ids of the customers which failed.
+        """
+
+        billing_date = billing_date or timezone.now().date()
+
+        customers = Customer.objects.filter(pk__in=customer_ids).order_by('pk')
+
+        return self._generate_for_customers_atomically(customers, billing_date,
+                                                       force_generate)
+
+    def get_billing_run(self, billing_date, force_generate=False):
+        """
+        :returns: the unfinished billing run for the given billing date, which
+            is to be resumed, or a new billing run if there is none.
+        """
+
+        billing_run = BillingRun.objects.filter(
+            billing_date=billing_date, force_generate=force_generate,
+            state=BillingRun.STATES.RUNNING, sharded=False, parent=None
+        ).order_by('-pk').first()
+
+        return billing_run or BillingRun.objects.create(billing_date=billing_date,
+                                                        force_generate=force_generate)
+
+    def create_sharded_billing_run(self, billing_date, shard_size):
+        """
+        Creates a sharded billing run, splitting the customers having
+        subscriptions due for billing into shards of `shard_size` customers.
+
+        :returns: the sharded billing run, or None if there are no customers
+            to be billed.
+        """
+
+        customer_ids = self.get_customers_due_for_billing(
+            billing_date
+        ).order_by('pk').values_list('pk', flat=True)
+
+        with db_transaction.atomic():
+            billing_run = BillingRun.objects.create(billing_date=billing_date, sharded=True)
+
+            shards = BillingRun.objects.bulk_create(
+                BillingRun(billing_date=billing_date, parent=billing_run,
+                           customer_ids=shard_customer_ids)
+                for shard_customer_ids in chunks(customer_ids.iterator(), shard_size)
+            )
+            if not shards:
+                billing_run.delete()
+                return None
+
+        return billing_run
+
+    def generate_for_billing_run(self, billing_run, profile=False):
+        """
+        Generates the billing documents of a billing run, starting right after
+        the last customer processed by it, so that an interrupted run can be
+        resumed without billing its customers twice.
+
+        :param profile: if True, the run is profiled and the profiling report
+            is stored with the billing run (see `BillingProfiler.report`).
+        :returns: the summary of the whole billing run.
+        """
+
+        if profile:
+            with BillingProfiler() as profiler:
+                summary = self.generate_for_billing_run(billing_run)
+
+            billing_run.report = profiler.report()
+            billing_run.save(update_fields=['report', 'updated_at'])
+
+            return summary
+
+        if billing_run.parent_id:
+            # The shard's customers were selected when the run was sharded
+            customers = Customer.objects.filter(pk__in=billing_run.customer_ids)
+        elif billing_run.force_generate:
+            customers = Customer.objects.all()
+        else:
+            customers = self.get_customers_due_for_billing(billing_run.billing_date)
+
+        if billing_run.last_customer_id is not None:
+            customers = customers.filter(pk__gt=billing_run.last_customer_id)
+
+        self._generate_for_customers_atomically(
+            customers.order_by('pk'), billing_run.billing_date,
+            billing_run.force_generate, billing_run=billing_run
+        )
+
+        billing_run.complete()
+
+        return billing_run.summary
+
+    def _generate_for_customers_atomically(self, customers, billing_date, force_generate,
+                                           billing_run=None):
+        summary = {
+            'customers': 0,
+            'documents': 0,
+            'failed_customers': []
+        }
+
+        for customers_batch in self._customers_batches(customers):
+            subscriptions = self.prefetch_subscriptions(
+                customers_batch, billing_date=None if force_generate else billing_date
+            )
+
+            for customer in customers_batch:
+                try:
+                    with db_transaction.atomic():
+                        documents = self._generate_for_customer(
+                            customer, billing_date, force_generate,
+                            subscriptions=subscriptions[customer.pk]
+                        )
+
+                        # The checkpoint is committed along with the documents
+                        if billing_run:
+                            billing_run.checkpoint(customer, documents)
+                except Exception:
+                    logger.exception('Encountered exception while generating billing documents '
+                                     'for customer with id=%s.', customer.id)
+                    summary['failed_customers'].append(customer.id)
+
+                    if billing_run:
+                        billing_run.refresh_from_db()
+                        billing_run.checkpoint(customer, failed=True)
+                    continue
+
+                summary['customers'] += 1
+                summary['documents'] += len(documents)
+
+        return summary
+
+    def _customers_batches(self, customers):
+        """
+        Splits the customers into batches of DOCS_GENERATION_BATCH_SIZE. The
+        querysets are walked in keyset ordered chunks, so that the customers of
+        a batch are released once the batch is processed, instead of being
+        kept alive by the queryset's result cache for the whole run.
+        """
+
+        if isinstance(customers, QuerySet):
+            return queryset_chunks(customers, DOCS_GENERATION_BATCH_SIZE)
+
+        return chunks(customers, DOCS_GENERATION_BATCH_SIZE)
+
+    def get_customers_due_for_billing(self, billing_date):
+        """
+        :returns: the customers having subscriptions which may have to be billed
+            at the given date (see `Subscription.objects.due_for_billing`).
+        """
+
+        return Customer.objects.filter(
+            pk__in=Subscription.objects.due_for_billing(billing_date).values('customer')
+        )
+
+    @profiled('subscriptions_selection')
+    def prefetch_subscriptions(self, customers, billing_date=None):
+        """
+        Loads the active and canceled subscriptions of the given customers,
+        along with their plans, providers, metered features and latest billing
+        logs, using a fixed number of queries, regardless of the number of
+        customers or subscriptions.
+
+        If a `billing_date` is given, only the subscriptions which are due for
+        billing at that date are loaded.
+
+        :returns: a dict mapping the customers ids to their subscriptions.
+        """
+
+        latest_billing_log = BillingLog.objects.filter(
+            subscription=OuterRef('subscription')
+        ).order_by('-billing_date', '-pk').values('pk')[:1]
+
+        if billing_date:
+            subscriptions = Subscription.objects.due_for_billing(billing_date)
+        else:
+            subscriptions = Subscription.objects.filter(
+                state__in=[Subscription.STATES.ACTIVE, Subscription.STATES.CANCELED]
+            )
+
+        subscriptions = subscriptions.filter(
+            customer__in=customers
+        ).select_related(
+            'plan__provider', 'plan__product_code'
+        ).prefetch_related(
+            'plan__metered_features__product_code',
+            Prefetch('billing_logs',
+                     queryset=BillingLog.objects.filter(pk=Subquery(latest_billing_log)),
+                     to_attr='_prefetched_last_billing_logs')
+        ).order_by('pk')
+
+        customers_subscriptions = {customer.pk: [] for customer in customers}
+        customers_by_pk = {customer.pk: customer for customer in customers}
+        for subscription in subscriptions:
+            subscription.customer = customers_by_pk[subscription.customer_id]
+            customers_subscriptions[subscription.customer_id].append(subscription)
+
+        return customers_subscriptions
+
+    def _generate_for_customer(self, customer, billing_date, force_generate,
+                               subscriptions=None):
+        with profile_phase(CUSTOMER_PHASE, key=customer.pk):
             if customer.consolidated_billing:
-                self._generate_for_user_with_consolidated_billing(
-                    customer, billing_date, force_generate
-                )
-            else:
-                self._generate_for_user_without_consolidated_billing(
-                    customer, billing_date, force_generate
+                return self._generate_for_user_with_consolidated_billing(
+                    customer, billing_date, force_generate, subscriptions
                 )
 
+            return self._generate_for_user_without_consolidated_billing(
+                customer, billing_date, force_generate, subscriptions
+            )
+
     def _log_subscription_billing(self, document, subscription):
         logger.debug('Billing subscription: %s', {
             'subscription': subscription.id,
@@ -92,18 +379,28 @@ class DocumentsGenerator(object):
             'customer': document.customer.id
         })
 
-    def get_subscriptions_prepared_for_billing(self, customer, billing_date, force_generate):
-        # Select all the active or canceled subscriptions
+    @profiled('subscriptions_selection')
+    def get_subscriptions_prepared_for_billing(self, customer, billing_date, force_generate,
+                                              subscriptions=None):
+        # Select all the active or canceled subscriptions, unless they were prefetched
+        if subscriptions is None:
+            criteria = {'state__in': [Subscription.STATES.ACTIVE,
+                                      Subscription.STATES.CANCELED]}
+            subscriptions = customer.subscriptions.filter(**criteria)
+
         subs_to_bill = []
-        criteria = {'state__in': [Subscription.STATES.ACTIVE,
-                                  Subscription.STATES.CANCELED]}
-        for subscription in customer.subscriptions.filter(**criteria):
+        for subscription in subscriptions:
             if subscription.should_be_billed(billing_date) or force_generate:
                 subs_to_bill.append(subscription)
+            elif subscription.next_billing_date is None:
+                # e.g. subscriptions which haven't been saved since next billing
+                # dates are tracked; it spares them from being visited again
+                subscription.update_next_billing_date()
 
         return subs_to_bill
 
-    def _bill_subscription_into_document(self, subscription, billing_date, document=None):
+    def _bill_subscription_into_document(self, subscription, billing_date, document=None,
+                                         entries=None):
         if not document:
             document = self._create_document(subscription, billing_date)
 
@@ -114,6 +411,7 @@ class DocumentsGenerator(object):
         kwargs.update({
             'billing_date': billing_date,
             'subscription': subscription,
+            'entries': entries,
             subscription.provider.flow: document,
         })
         self.add_subscription_cycles_to_document(**kwargs)
@@ -124,7 +422,8 @@ class DocumentsGenerator(object):
 
         return document
 
-    def _generate_for_user_with_consolidated_billing(self, customer, billing_date, force_generate):
+    def _generate_for_user_with_consolidated_billing(self, customer, billing_date, force_generate,
+                                                     subscriptions=None):
         """
         Generates the billing documents for all the subscriptions of a customer
         who uses consolidated billing.
@@ -135,36 +434,55 @@ class DocumentsGenerator(object):
         # => all the subscriptions belonging to the same provider will be added to the same document
 
         existing_provider_documents = {}
+        provider_documents_entries = {}
         for subscription in self.get_subscriptions_prepared_for_billing(customer, billing_date,
-                                                                        force_generate):
+                                                                        force_generate,
+                                                                        subscriptions):
             provider = subscription.plan.provider
 
             existing_document = existing_provider_documents.get(provider)
+            entries = provider_documents_entries.setdefault(provider,
+                                                            DocumentEntryAccumulator())
 
             existing_provider_documents[provider] = self._bill_subscription_into_document(
-                subscription, billing_date, document=existing_document
+                subscription, billing_date, document=existing_document, entries=entries
             )
 
         for provider, document in existing_provider_documents.items():
+            provider_documents_entries[provider].flush()
+
             if provider.default_document_state == Provider.DEFAULT_DOC_STATE.ISSUED:
-                document.issue()
+                with profile_phase('document_issue'):
+                    document.issue()
+
+        return existing_provider_documents.values()
 
     def _generate_for_user_without_consolidated_billing(self, customer, billing_date,
-                                                        force_generate):
+                                                        force_generate, subscriptions=None):
         """
         Generates the billing documents for all the subscriptions of a customer
         who does not use consolidated billing.
         """
 
         # The user does not use consolidated_billing => add each subscription to a separate document
+        documents = []
         for subscription in self.get_subscriptions_prepared_for_billing(customer, billing_date,
-                                                                        force_generate):
+                                                                        force_generate,
+                                                                        subscriptions):
             provider = subscription.plan.provider
 
-            document = self._bill_subscription_into_document(subscription, billing_date)
+            entries = DocumentEntryAccumulator()
+            document = self._bill_subscription_into_document(subscription, billing_date,
+                                                             entries=entries)
+            entries.flush()
 
             if provider.default_document_state == Provider.DEFAULT_DOC_STATE.ISSUED:
-                document.issue()
+                with profile_phase('document_issue'):
+                    document.issue()
+
+            documents.append(document)
+
+        return documents
 
     def _generate_for_single_subscription(self, subscription=None, billing_date=None,
                                           force_generate=False):
@@ -180,22 +498,71 @@ class DocumentsGenerator(object):
         if not subscription.should_be_billed(billing_date) or force_generate:
             return
 
-        document = self._bill_subscription_into_document(subscription, billing_date)
+        entries = DocumentEntryAccumulator()
+        document = self._bill_subscription_into_document(subscription, billing_date,
+                                                         entries=entries)
+        entries.flush()
 
         if provider.default_document_state == Provider.DEFAULT_DOC_STATE.ISSUED:
-            document.issue()
+            with profile_phase('document_issue'):
+                document.issue()
 
+    @profiled('entries_creation')
     def add_subscription_cycles_to_document(self, billing_date, metered_features_billed_up_to,
                                             plan_billed_up_to, subscription,
-                                            proforma=None, invoice=None):
+                                            proforma=None, invoice=None, entries=None):
+        """
+        Adds the entries of the subscription's cycles which haven't been billed
+        yet to the given document.
+
+        .. note:: If an `entries` accumulator is passed, the entries are only
+            added to it and it's up to the caller to flush it, so that all the
+            entries of a document can be inserted at once. Otherwise, they are
+            inserted before returning.
+        """
+
+        flush_entries = entries is None
+        if flush_entries:
+            entries = DocumentEntryAccumulator()
+        total_before_cycles = entries.total
+
+        plan_now_billed_up_to, metered_features_now_billed_up_to = self._add_subscription_cycles(
+            billing_date, metered_features_billed_up_to, plan_billed_up_to, subscription,
+            proforma=proforma, invoice=invoice, entries=entries
+        )
+
+        total = entries.total - total_before_cycles
+        if flush_entries:
+            entries.flush()
+
+        BillingLog.objects.create(subscription=subscription,
+                                  invoice=invoice, proforma=proforma,
+                                  total=total,
+                                  billing_date=billing_date,
+                                  metered_features_billed_up_to=metered_features_now_billed_up_to,
+                                  plan_billed_up_to=plan_now_billed_up_to)
+
+        # The prefetched last billing log, if any, is now stale
+        subscription.clear_prefetched_billing_logs()
+
+    @profiled('entries_creation')
+    def _add_subscription_cycles(self, billing_date, metered_features_billed_up_to,
+                                 plan_billed_up_to, subscription, entries,
+                                 proforma=None, invoice=None):
+        """
+        Adds the entries of the subscription's cycles which haven't been billed
+        yet to the given entries accumulator, without writing anything.
+
+        :returns: a tuple containing the dates up to which the plan and the
+            metered features are billed after adding the entries.
+        """
+
         relative_start_date = metered_features_billed_up_to + ONE_DAY
         plan_now_billed_up_to = plan_billed_up_to
         metered_features_now_billed_up_to = metered_features_billed_up_to
 
         prebill_plan = subscription.prebill_plan
 
-        total = Decimal("0.00")
-
         last_cycle_end_date = subscription.cycle_end_date(billing_date)
 
         # We iterate through each cycle (multiple bucket cycles can be contained within a billing
@@ -231,12 +598,14 @@ class DocumentsGenerator(object):
             # Bill the plan amount
             if should_bill_plan:
                 if subscription.on_trial(relative_start_date):
-                    total += subscription._add_plan_trial(start_date=relative_start_date,
-                                                          end_date=relative_end_date,
-                                                          invoice=invoice, proforma=proforma)
+                    subscription._add_plan_trial(start_date=relative_start_date,
+                                                 end_date=relative_end_date,
+                                                 invoice=invoice, proforma=proforma,
+                                                 entries=entries)
                 else:
-                    total += subscription._add_plan_value(relative_start_date, relative_end_date,
-                                                          proforma=proforma, invoice=invoice)
+                    subscription._add_plan_value(relative_start_date, relative_end_date,
+                                                 proforma=proforma, invoice=invoice,
+                                                 entries=entries)
                 plan_now_billed_up_to = relative_end_date
 
             # Only bill metered features if the cycle the metered features belong to has ended
@@ -246,12 +615,14 @@ class DocumentsGenerator(object):
             # Bill the metered features
             if should_bill_metered_features:
                 if subscription.on_trial(relative_start_date):
-                    total += subscription._add_mfs_for_trial(start_date=relative_start_date,
-                                                             end_date=relative_end_date,
-                                                             invoice=invoice, proforma=proforma)
+                    subscription._add_mfs_for_trial(start_date=relative_start_date,
+                                                    end_date=relative_end_date,
+                                                    invoice=invoice, proforma=proforma,
+                                                    entries=entries)
                 else:
-                    total += subscription._add_mfs(relative_start_date, relative_end_date,
-                                                   proforma=proforma, invoice=invoice)
+                    subscription._add_mfs(relative_start_date, relative_end_date,
+                                          proforma=proforma, invoice=invoice,
+                                          entries=entries)
 
                 metered_features_now_billed_up_to = relative_end_date
 
@@ -261,14 +632,9 @@ class DocumentsGenerator(object):
             if relative_end_date == subscription.cancel_date:
                 break
 
-        BillingLog.objects.create(subscription=subscription,
-                                  invoice=invoice, proforma=proforma,
-                                  total=total,
-                                  billing_date=billing_date,
-                                  metered_features_billed_up_to=metered_features_now_billed_up_to,
-                                  plan_billed_up_to=plan_now_billed_up_to)
+        return plan_now_billed_up_to, metered_features_now_billed_up_to
 
-    def _create_document(self, subscription, billing_date):
+    def _build_document(self, subscription, billing_date):
         provider = subscription.provider
         customer = subscription.customer
 
@@ -277,8 +643,79 @@ class DocumentsGenerator(object):
 
         payment_due_days = dt.timedelta(days=customer.payment_due_days)
         due_date = billing_date + payment_due_days
-        document = DocumentModel.objects.create(provider=provider,
-                                                customer=customer,
-                                                due_date=due_date)
+
+        return DocumentModel(provider=provider, customer=customer, due_date=due_date)
+
+    def _create_document(self, subscription, billing_date):
+        document = self._build_document(subscription, billing_date)
+        document.save(force_insert=True)
 
         return document
+
+    def preview(self, billing_date=None, customers=None):
+        """
+        Previews the billing documents that would be generated for the given
+        billing date, without writing anything to the database.
+
+        The documents are computed using the same billing logic, but they are
+        built in memory, along with their entries, and yielded one at a time,
+        as dicts containing the unsaved `document`, its unsaved `entries`, the
+        billed `subscriptions` and the document's `total`.
+
+        :param customers: the customers to preview the documents for. Defaults
+            to the customers having subscriptions due for billing.
+        """
+
+        billing_date = billing_date or timezone.now().date()
+
+        if customers is None:
+            customers = self.get_customers_due_for_billing(billing_date).order_by('pk')
+
+        for customers_batch in self._customers_batches(customers):
+            subscriptions = self.prefetch_subscriptions(customers_batch,
+                                                        billing_date=billing_date)
+
+            for customer in customers_batch:
+                for document_preview in self._preview_for_customer(
+                    customer, billing_date, subscriptions[customer.pk]
+                ):
+                    yield document_preview
+
+    def _preview_for_customer(self, customer, billing_date, subscriptions):
+        # Mimics the grouping of the subscriptions into documents done by
+        # `_generate_for_customer`
+        documents = OrderedDict()
+
+        for subscription in subscriptions:
+            if not subscription.should_be_billed(billing_date):
+                continue
+
+            provider = subscription.plan.provider
+            key = provider if customer.consolidated_billing else subscription
+
+            if key not in documents:
+                document = self._build_document(subscription, billing_date)
+                document.set_default_values()
+
+                documents[key] = (document, DocumentEntryAccumulator(), [])
+
+            document, entries, billed_subscriptions = documents[key]
+
+            kwargs = subscription.billed_up_to_dates
+            kwargs.update({
+                'billing_date': billing_date,
+                'subscription': subscription,
+                'entries': entries,
+                provider.flow: document,
+            })
+            self._add_subscription_cycles(**kwargs)
+
+            billed_subscriptions.append(subscription)
+
+        for document, entries, billed_subscriptions in documents.values():
+            yield {
+                'document': document,
+                'entries': entries.entries,
+                'subscriptions': billed_subscriptions,
+                'total': entries.total
+            }
@@ -0,0 +1,45 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand
+
+from silver.models import Subscription
+from silver.utils.iterables import queryset_chunks
+
+
+class Command(BaseCommand):
+    help = ("Populates the subscriptions' billing state (billed up to dates, latest billing "
+            "date and billing logs count) from their billing logs.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all',
+                            action='store_true', dest='all', default=False,
+                            help='Repopulate the billing state of all the subscriptions, '
+                                 'not only of those for which it is missing.')
+        parser.add_argument('--batch-size',
+                            action='store', dest='batch_size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        subscriptions = Subscription.objects.select_related('plan__provider')
+        if not options['all']:
+            subscriptions = subscriptions.filter(billing_logs_count__isnull=True)
+
+        count = 0
+        for batch in queryset_chunks(subscriptions, options['batch_size']):
+            for subscription in batch:
+                subscription.update_billing_state()
+
+            count += len(batch)
+
+        self.stdout.write('Populated the billing state of %d subscriptions.' % count)
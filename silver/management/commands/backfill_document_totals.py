@@ -0,0 +1,49 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand
+
+from silver.models import BillingDocumentBase
+from silver.models.documents.entries import DOCUMENT_TOTALS_FIELDS
+from silver.utils.iterables import queryset_chunks
+
+
+class Command(BaseCommand):
+    help = ("Populates the missing persisted totals of the billing documents (Invoices, "
+            "Proformas) from their entries.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size',
+                            action='store', dest='batch_size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        documents = BillingDocumentBase.objects.filter(_total_before_tax__isnull=True)
+
+        count = 0
+        for batch in queryset_chunks(documents, options['batch_size']):
+            for document in batch:
+                # The totals which were frozen when the document was issued are kept
+                frozen_totals = {field: getattr(document, field)
+                                 for field in DOCUMENT_TOTALS_FIELDS
+                                 if getattr(document, field) is not None}
+
+                document.compute_totals()
+
+                totals = {field: getattr(document, field) for field in DOCUMENT_TOTALS_FIELDS}
+                totals.update(frozen_totals)
+                BillingDocumentBase.objects.filter(pk=document.pk).update(**totals)
+
+            count += len(batch)
+
+        self.stdout.write('Populated the totals of %d documents.' % count)
@@ -16,13 +16,18 @@
 import logging
 import argparse
 from datetime import datetime as dt
+from multiprocessing import Pool
 from types import StringType
 
-from django.core.management.base import BaseCommand
-from django.utils import translation
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone, translation
 
-from silver.documents_generator import DocumentsGenerator
-from silver.models import Subscription
+from silver.documents_generator import (DOCS_GENERATION_BATCH_SIZE, DocumentsGenerator,
+                                        merge_billing_summaries)
+from silver.models import BillingRun, Subscription
+from silver.utils.iterables import chunks
+from silver.utils.profiling import format_report
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +41,45 @@ def date(date_str):
         raise argparse.ArgumentTypeError(msg)
 
 
+def positive_int(value):
+    try:
+        value = int(value)
+    except ValueError:
+        value = 0
+
+    if value < 1:
+        msg = "Not a valid number of workers: '{value}'.".format(value=value)
+        raise argparse.ArgumentTypeError(msg)
+
+    return value
+
+
+def _init_worker():
+    # The connections inherited from the parent process must not be reused,
+    # so each worker opens its own
+    connections.close_all()
+    translation.activate('en-us')
+
+
+def _generate_for_customers(customer_ids, billing_date):
+    try:
+        return DocumentsGenerator().generate_for_customers(customer_ids,
+                                                           billing_date=billing_date)
+    except Exception:
+        logger.exception('Encountered exception while generating billing documents '
+                         'for customers with ids=%s.', customer_ids)
+
+        return {
+            'customers': 0,
+            'documents': 0,
+            'failed_customers': list(customer_ids)
+        }
+
+
+def _generate_for_customers_star(args):
+    return _generate_for_customers(*args)
+
+
 class Command(BaseCommand):
     help = 'Generates the billing documents (Invoices, Proformas).'
 
@@ -46,10 +90,25 @@ class Command(BaseCommand):
         parser.add_argument('--date',
                             action='store', dest='billing_date', type=date,
                             help='The billing date (format YYYY-MM-DD).')
+        parser.add_argument('--resume',
+                            action='store', dest='billing_run_id', type=int,
+                            help='The id of the interrupted billing run to be resumed.')
+        parser.add_argument('--profile',
+                            action='store_true', dest='profile', default=False,
+                            help='Profile the billing run and output the report.')
+        parser.add_argument('--workers',
+                            action='store', dest='workers', type=positive_int,
+                            help='The number of processes the customers are billed in.')
 
     def handle(self, *args, **options):
         translation.activate('en-us')
 
+        if options['workers']:
+            if options['profile']:
+                raise CommandError('The --profile option is not supported with --workers.')
+            if options['billing_run_id']:
+                raise CommandError('The --resume option is not supported with --workers.')
+
         billing_date = options['billing_date']
 
         docs_generator = DocumentsGenerator()
@@ -67,9 +126,73 @@ class Command(BaseCommand):
             except Subscription.DoesNotExist:
                 msg = 'The subscription with the provided id does not exist.'
                 self.stdout.write(msg)
+        elif options['workers']:
+            billing_date = billing_date or timezone.now().date()
+
+            logger.info('Generating for all the available subscriptions using %s workers; '
+                        'billing_date=%s.', options['workers'], billing_date)
+
+            summary = self._generate_in_workers(docs_generator, billing_date,
+                                                options['workers'])
+
+            self.stdout.write('Done. You can have a Club-Mate now. :)')
+            self.stdout.write(
+                'Billed customers: {customers}, generated documents: {documents}, '
+                'failed customers: {failed_customers}.'.format(**summary)
+            )
+        elif options['billing_run_id']:
+            try:
+                billing_run = BillingRun.objects.get(id=options['billing_run_id'])
+            except BillingRun.DoesNotExist:
+                msg = 'The billing run with the provided id does not exist.'
+                self.stdout.write(msg)
+                return
+
+            if billing_run.state == BillingRun.STATES.COMPLETED:
+                self.stdout.write('The billing run has already been completed.')
+                return
+
+            logger.info('Resuming billing run with id=%s; billing_date=%s.',
+                        billing_run.id, billing_run.billing_date)
+
+            self._generate_for_billing_run(docs_generator, billing_run, options['profile'])
         else:
+            billing_run = docs_generator.get_billing_run(
+                billing_date or timezone.now().date()
+            )
+
             logger.info('Generating for all the available subscriptions; '
-                        'billing_date=%s.', billing_date)
+                        'billing_date=%s; billing_run=%s.', billing_run.billing_date,
+                        billing_run.id)
 
-            docs_generator.generate(billing_date=billing_date)
-            self.stdout.write('Done. You can have a Club-Mate now. :)')
+            self._generate_for_billing_run(docs_generator, billing_run, options['profile'])
+
+    def _generate_for_billing_run(self, docs_generator, billing_run, profile):
+        docs_generator.generate_for_billing_run(billing_run, profile=profile)
+        self.stdout.write('Done. You can have a Club-Mate now. :)')
+
+        if profile:
+            self.stdout.write(format_report(billing_run.report))
+
+    def _generate_in_workers(self, docs_generator, billing_date, workers):
+        customer_ids = docs_generator.get_customers_due_for_billing(
+            billing_date
+        ).order_by('pk').values_list('pk', flat=True)
+
+        shards = [(shard_customer_ids, billing_date) for shard_customer_ids
+                  in chunks(customer_ids.iterator(), DOCS_GENERATION_BATCH_SIZE)]
+
+        # The workers must not inherit the open connections
+        connections.close_all()
+
+        pool = Pool(processes=workers, initializer=_init_worker)
+        try:
+            summaries = pool.map(_generate_for_customers_star, shards)
+        finally:
+            pool.close()
+            pool.join()
+
+        summary = merge_billing_summaries(summaries)
+        summary['failed_customers'].sort()
+
+        return summary
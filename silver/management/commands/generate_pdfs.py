@@ -14,11 +14,14 @@
 
 
 import logging
+import multiprocessing
 from itertools import chain
 
 from django.core.management.base import BaseCommand
 
 from silver.models import Invoice, Proforma
+from silver.utils.iterables import chunks
+from silver.utils.pdf import PDF_RENDERING_PROCESSES, PDFRenderer
 
 logger = logging.getLogger(__name__)
 
@@ -26,11 +29,42 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     help = 'Generates the billing documents (Invoices, Proformas).'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=PDF_RENDERING_PROCESSES or None,
+                            help='The number of processes rendering the PDFs. Defaults to '
+                                 'the SILVER_PDF_RENDERING_PROCESSES setting, or to the '
+                                 'number of CPUs. Use 0 to render within this process.')
+        parser.add_argument('--timeout', type=int, default=None,
+                            help='The number of seconds after which a PDF rendering is '
+                                 'stopped. Defaults to the SILVER_PDF_RENDERING_TIMEOUT '
+                                 'setting.')
+
     def handle(self, *args, **options):
-        for document in chain(Invoice.objects.filter(pdf__dirty__gt=0),
-                              Proforma.objects.filter(pdf__dirty__gt=0)):
-            try:
-                document.generate_pdf()
-            except:
-                logger.exception('Encountered exception while generating PDF for document '
-                                 'with id=%s.', document.id)
+        dirty_documents = chain(Invoice.objects.filter(pdf__dirty__gt=0),
+                                Proforma.objects.filter(pdf__dirty__gt=0))
+
+        processes = options['processes']
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        with PDFRenderer(processes=processes, timeout=options['timeout']) as renderer:
+            # Enough documents are rendered at once to keep all the processes busy
+            for documents in chunks(dirty_documents, max(processes * 2, 1)):
+                renderings = []
+                for document in documents:
+                    try:
+                        renderings.append(
+                            (document, document.generate_pdf_async(renderer=renderer))
+                        )
+                    except:
+                        self.log_exception(document)
+
+                for document, finish_rendering in renderings:
+                    try:
+                        finish_rendering()
+                    except:
+                        self.log_exception(document)
+
+    def log_exception(self, document):
+        logger.exception('Encountered exception while generating PDF for document '
+                         'with id=%s.', document.id)
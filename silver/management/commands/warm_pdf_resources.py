@@ -0,0 +1,35 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from silver.utils.pdf import resources_cache
+
+
+class Command(BaseCommand):
+    help = ("Loads the static resources used by the PDFs (the SILVER_PDF_PRELOADED_RESOURCES, "
+            "unless URIs are given) into the resources cache, reporting the missing ones. "
+            "Each process rendering PDFs warms up its own cache the same way.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('uris', nargs='*')
+
+    def handle(self, *args, **options):
+        missing_uris = resources_cache.warm_up(options['uris'] or None)
+
+        self.stdout.write('Cached %d resources (%d bytes).' % (len(resources_cache),
+                                                              resources_cache.size))
+
+        if missing_uris:
+            raise CommandError('Missing resources: %s' % ', '.join(missing_uris))
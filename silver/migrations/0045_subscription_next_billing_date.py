@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 06:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('silver', '0044_auto_20171115_1809'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='next_billing_date',
+            field=models.DateField(blank=True, db_index=True, editable=False, help_text=b'The earliest date at which the subscription may have to be billed again.', null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 06:45
+from __future__ import unicode_literals
+
+import annoying.fields
+from django.db import migrations, models
+import json
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('silver', '0045_subscription_next_billing_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('billing_date', models.DateField(help_text=b'The date used as billing date for the generated documents.')),
+                ('force_generate', models.BooleanField(default=False)),
+                ('state', models.CharField(choices=[(b'running', 'Running'), (b'completed', 'Completed')], default=b'running', max_length=12)),
+                ('last_customer_id', models.PositiveIntegerField(blank=True, help_text=b'The id of the last customer processed by the run.', null=True)),
+                ('customers', models.PositiveIntegerField(default=0, help_text=b'The number of billed customers.')),
+                ('documents', models.PositiveIntegerField(default=0, help_text=b'The number of generated documents.')),
+                ('failed_customers', annoying.fields.JSONField(blank=True, default=list, deserializer=json.loads, serializer=annoying.fields.dumps)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 06:49
+from __future__ import unicode_literals
+
+import annoying.fields
+from django.db import migrations
+import json
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('silver', '0046_billingrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billingrun',
+            name='report',
+            field=annoying.fields.JSONField(blank=True, deserializer=json.loads, help_text=b'The profiling report of the run, if the run was profiled.', null=True, serializer=annoying.fields.dumps),
+        ),
+    ]
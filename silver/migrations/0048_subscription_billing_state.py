@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 07:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('silver', '0047_billingrun_report'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='billing_logs_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text=b'The number of billing logs of the subscription. If not set, the billing state fields have not been populated yet.', null=True),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='latest_billing_date',
+            field=models.DateField(blank=True, editable=False, help_text=b'The billing date of the latest billing log.', null=True),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='metered_features_billed_up_to',
+            field=models.DateField(blank=True, editable=False, help_text=b'The date up to which the metered features have been billed, as given by the latest billing log.', null=True),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='plan_billed_up_to',
+            field=models.DateField(blank=True, editable=False, help_text=b'The date up to which the plan has been billed, as given by the latest billing log.', null=True),
+        ),
+    ]
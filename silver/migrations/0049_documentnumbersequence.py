@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 07:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('silver', '0048_subscription_billing_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentNumberSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=8)),
+                ('series', models.CharField(blank=True, max_length=20)),
+                ('next_number', models.PositiveIntegerField(default=1)),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_number_sequences', to='silver.Provider')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentnumbersequence',
+            unique_together=set([('kind', 'provider', 'series')]),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 08:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def enqueue_dirty_pdfs(apps, schema_editor):
+    PDF = apps.get_model('silver', 'PDF')
+    QueuedPDF = apps.get_model('silver', 'QueuedPDF')
+
+    db_alias = schema_editor.connection.alias
+
+    QueuedPDF.objects.using(db_alias).bulk_create(
+        QueuedPDF(pdf_id=pdf_id)
+        for pdf_id in PDF.objects.using(db_alias).filter(dirty__gt=0).values_list('id', flat=True)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('silver', '0051_pdf_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedPDF',
+            fields=[
+                ('pdf', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='queued', serialize=False, to='silver.PDF')),
+                ('queued_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(enqueue_dirty_pdfs, migrations.RunPython.noop),
+    ]
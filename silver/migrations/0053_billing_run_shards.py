@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 08:36
+from __future__ import unicode_literals
+
+import annoying.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import json
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('silver', '0052_queuedpdf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billingrun',
+            name='customer_ids',
+            field=annoying.fields.JSONField(blank=True, deserializer=json.loads, help_text=b"The ids of the shard's customers, if the run is a shard.", null=True, serializer=annoying.fields.dumps),
+        ),
+        migrations.AddField(
+            model_name='billingrun',
+            name='parent',
+            field=models.ForeignKey(blank=True, help_text=b'The sharded run this run is a shard of.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='silver.BillingRun'),
+        ),
+        migrations.AddField(
+            model_name='billingrun',
+            name='sharded',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -13,9 +13,11 @@
 # limitations under the License.
 
 from billing_entities import Customer, Provider
-from documents import Proforma, Invoice, BillingDocumentBase, DocumentEntry, PDF
+from documents import (Proforma, Invoice, BillingDocumentBase, DocumentEntry, PDF,
+                       QueuedPDF, DocumentNumberSequence)
 from plans import Plan, MeteredFeature
 from product_codes import ProductCode
 from subscriptions import Subscription, MeteredFeatureUnitsLog, BillingLog
+from billing_runs import BillingRun
 from payment_methods import PaymentMethod
 from transactions import Transaction
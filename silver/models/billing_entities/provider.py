@@ -23,6 +23,8 @@ from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 
+from silver.utils.models import loaded_field_values
+
 from .base import BaseBillingEntity
 
 
@@ -105,11 +107,18 @@ class Provider(BaseBillingEntity):
                   "date will appear to be the end of the cycle billing duration."
     )
 
+    # The fields overriding the plans' ones the subscriptions' billing dates
+    # depend on
+    BILLING_FIELDS = ('prebill_plan', 'cycle_billing_duration', 'separate_cycles_during_trial',
+                      'generate_documents_on_trial_end')
+
     def __init__(self, *args, **kwargs):
         super(Provider, self).__init__(*args, **kwargs)
         company_field = self._meta.get_field("company")
         company_field.help_text = "The provider issuing the invoice."
 
+        self._last_billing_values = loaded_field_values(self, self.BILLING_FIELDS)
+
     def clean(self):
         if self.flow == self.FLOWS.PROFORMA:
             if not self.proforma_starting_number and\
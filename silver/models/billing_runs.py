@@ -0,0 +1,129 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from annoying.fields import JSONField
+from model_utils import Choices
+
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+
+class BillingRun(models.Model):
+    """
+    Keeps track of a billing documents generation run.
+
+    The customers are billed in the order of their ids and the run is
+    checkpointed after each customer, within the same transaction as the
+    customer's documents, so that an interrupted run can be resumed right
+    after the last billed customer.
+
+    A sharded run is split into shards, which are billing runs themselves,
+    each one billing its own `customer_ids`.
+    """
+
+    class STATES(object):
+        RUNNING = 'running'
+        COMPLETED = 'completed'
+
+    STATE_CHOICES = Choices(
+        (STATES.RUNNING, _('Running')),
+        (STATES.COMPLETED, _('Completed'))
+    )
+
+    billing_date = models.DateField(
+        help_text='The date used as billing date for the generated documents.'
+    )
+    force_generate = models.BooleanField(default=False)
+    sharded = models.BooleanField(default=False)
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='shards',
+                               help_text='The sharded run this run is a shard of.')
+    customer_ids = JSONField(
+        null=True, blank=True,
+        help_text="The ids of the shard's customers, if the run is a shard."
+    )
+    state = models.CharField(choices=STATE_CHOICES, max_length=12,
+                             default=STATES.RUNNING)
+    last_customer_id = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text='The id of the last customer processed by the run.'
+    )
+    customers = models.PositiveIntegerField(
+        default=0, help_text='The number of billed customers.'
+    )
+    documents = models.PositiveIntegerField(
+        default=0, help_text='The number of generated documents.'
+    )
+    failed_customers = JSONField(default=list, blank=True)
+    report = JSONField(
+        null=True, blank=True,
+        help_text='The profiling report of the run, if the run was profiled.'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def checkpoint(self, customer, documents=None, failed=False):
+        """
+        Marks the given customer as processed by the run.
+
+        :param documents: the documents generated for the customer.
+        :param failed: whether the documents generation failed for the customer.
+        """
+
+        self.last_customer_id = customer.pk
+
+        if failed:
+            self.failed_customers.append(customer.pk)
+        else:
+            self.customers += 1
+            self.documents += len(documents or [])
+
+        self.save(update_fields=['last_customer_id', 'customers', 'documents',
+                                 'failed_customers', 'updated_at'])
+
+    def complete_shards(self):
+        """
+        Completes a sharded run, whose shards have all been completed, summing
+        up their results.
+        """
+
+        shards = list(self.shards.order_by('pk'))
+
+        self.customers = sum(shard.customers for shard in shards)
+        self.documents = sum(shard.documents for shard in shards)
+        self.failed_customers = [customer_id for shard in shards
+                                 for customer_id in shard.failed_customers]
+        self.save(update_fields=['customers', 'documents', 'failed_customers', 'updated_at'])
+
+        self.complete()
+
+    def complete(self):
+        self.state = self.STATES.COMPLETED
+        self.finished_at = timezone.now()
+        self.save(update_fields=['state', 'finished_at', 'updated_at'])
+
+    @property
+    def summary(self):
+        return {
+            'customers': self.customers,
+            'documents': self.documents,
+            'failed_customers': self.failed_customers
+        }
+
+    def __unicode__(self):
+        return u'{date} - {state}'.format(date=self.billing_date, state=self.state)
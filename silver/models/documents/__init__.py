@@ -14,7 +14,8 @@
 
 
 from .base import BillingDocumentBase
-from .entries import DocumentEntry
+from .entries import DocumentEntry, DocumentEntryAccumulator
 from .invoice import Invoice
 from .proforma import Proforma
-from .pdf import PDF
+from .pdf import PDF, QueuedPDF
+from .sequences import DocumentNumberSequence
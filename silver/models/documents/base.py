@@ -14,6 +14,7 @@
 
 
 import logging
+from collections import OrderedDict
 from decimal import Decimal
 from datetime import datetime, timedelta
 
@@ -31,7 +32,9 @@ from django.core.urlresolvers import reverse
 from django.core.validators import MinValueValidator
 from django.db import models
 from django.db import transaction as db_transaction
-from django.db.models import Max, ForeignKey, F
+from django.db.models import (BigIntegerField, Case, DecimalField, F, ForeignKey, OuterRef,
+                              Subquery, Sum, Value, When)
+from django.db.models.functions import Coalesce
 from django.template.loader import select_template
 from django.utils import timezone
 from django.utils.text import slugify
@@ -41,9 +44,11 @@ from django.utils.module_loading import import_string
 from silver.models.billing_entities import Customer, Provider
 from silver.currencies import CurrencyConverter, RateNotFound
 from silver.models.documents.pdf import PDF
+from silver.models.documents.sequences import DocumentNumberSequence
 from silver.utils.international import currencies
+from silver.utils.iterables import chunks
 
-from .entries import DocumentEntry
+from .entries import DOCUMENT_TOTALS_FIELDS, DocumentEntry, entries_total_cents
 
 
 _storage = getattr(settings, 'SILVER_DOCUMENT_STORAGE', None)
@@ -54,9 +59,47 @@ if _storage:
 
 PAYMENT_DUE_DAYS = getattr(settings, 'SILVER_DEFAULT_DUE_DAYS', 5)
 
+DOCUMENTS_TRANSITION_BATCH_SIZE = getattr(settings, 'SILVER_DOCUMENTS_TRANSITION_BATCH_SIZE',
+                                          100)
+
 logger = logging.getLogger(__name__)
 
 
+def transactions_amounts_states():
+    """
+    :returns: the states of the transactions summed up by each of the
+        documents' transactions amounts.
+    """
+
+    Transaction = apps.get_model('silver.Transaction')
+
+    return OrderedDict([
+        ('paid', [Transaction.States.Settled]),
+        ('pending', [Transaction.States.Pending]),
+        # The transactions which are or might become settled
+        ('charged', [Transaction.States.Initial, Transaction.States.Pending,
+                     Transaction.States.Settled])
+    ])
+
+
+def transactions_amount(document_field, states):
+    """
+    :returns: an SQL subquery of the sum of the amounts of the outer
+        document's transactions which are in one of the given states.
+
+    :param document_field: the transactions' field pointing to the outer
+        document (`invoice` or `proforma`).
+    """
+
+    Transaction = apps.get_model('silver.Transaction')
+
+    transactions = Transaction.objects.filter(
+        state__in=states, **{document_field: OuterRef('pk')}
+    ).order_by().values(document_field).annotate(amount_sum=Sum('amount')).values('amount_sum')
+
+    return Subquery(transactions, output_field=DecimalField(max_digits=19, decimal_places=2))
+
+
 def documents_pdf_path(document, filename):
     path = '{prefix}{company}/{doc_name}/{date}/{filename}'.format(
         company=slugify(unicode(
@@ -93,6 +136,49 @@ class BillingDocumentQuerySet(models.QuerySet):
             due_date__lt=datetime.now(pytz.utc).date().replace(day=1)
         )
 
+    def with_totals(self):
+        """
+        Annotates the `total` and `total_in_transaction_currency` of the
+        documents whose totals aren't persisted (see the
+        `backfill_document_totals` command), computed in SQL from their
+        entries, so that they don't have to be loaded.
+        """
+
+        annotations = {}
+        for field in ('total', 'total_in_transaction_currency'):
+            in_transaction_currency = field == 'total_in_transaction_currency'
+            entries_total = Case(
+                When(kind='invoice',
+                     then=entries_total_cents('invoice', in_transaction_currency)),
+                default=entries_total_cents('proforma', in_transaction_currency),
+                output_field=BigIntegerField()
+            )
+
+            annotations['_annotated_%s_cents' % field] = Case(
+                When(**{'_%s__isnull' % field: True,
+                        'then': Coalesce(entries_total, Value(0))}),
+                output_field=BigIntegerField()
+            )
+
+        return self.annotate(**annotations)
+
+    def with_transactions_amounts(self):
+        """
+        Annotates the paid, pending and charged amounts of the documents (see
+        `BillingDocumentBase.get_transactions_amounts`), so that their
+        transactions don't have to be queried for each document.
+        """
+
+        annotations = {}
+        for amount, states in transactions_amounts_states().items():
+            annotations['_annotated_%s_amount' % amount] = Case(
+                When(kind='invoice', then=transactions_amount('invoice', states)),
+                default=transactions_amount('proforma', states),
+                output_field=DecimalField(max_digits=19, decimal_places=2)
+            )
+
+        return self.annotate(**annotations)
+
 
 class BillingDocumentManager(models.Manager):
     def get_queryset(self):
@@ -122,6 +208,14 @@ class BillingDocumentBase(models.Model):
         (STATES.CANCELED, _('Canceled'))
     )
 
+    # The transitions which can be run in bulk (see bulk_transition), by the
+    # state they lead to: (transition name, source state, transition arguments)
+    BULK_TRANSITIONS = {
+        STATES.ISSUED: ('issue', STATES.DRAFT, ('issue_date', 'due_date')),
+        STATES.PAID: ('pay', STATES.ISSUED, ('paid_date', )),
+        STATES.CANCELED: ('cancel', STATES.ISSUED, ('cancel_date', ))
+    }
+
     kind = models.CharField(get_billing_documents_kinds, max_length=8, db_index=True)
     related_document = models.ForeignKey('self', blank=True, null=True,
                                          related_name='reverse_related_document')
@@ -164,14 +258,30 @@ class BillingDocumentBase(models.Model):
                      verbose_name="State",
                      help_text='The state the invoice is in.')
 
+    # The totals are maintained while the document is a draft and are frozen
+    # once the document is issued
+    _total_before_tax = models.DecimalField(max_digits=19, decimal_places=2,
+                                            null=True, blank=True)
+    _tax_value = models.DecimalField(max_digits=19, decimal_places=2,
+                                     null=True, blank=True)
     _total = models.DecimalField(max_digits=19, decimal_places=2,
                                  null=True, blank=True)
+    _total_before_tax_in_transaction_currency = models.DecimalField(
+        max_digits=19, decimal_places=2, null=True, blank=True
+    )
+    _tax_value_in_transaction_currency = models.DecimalField(
+        max_digits=19, decimal_places=2, null=True, blank=True
+    )
     _total_in_transaction_currency = models.DecimalField(max_digits=19,
                                                          decimal_places=2,
                                                          null=True, blank=True)
 
     _last_state = None
+    _last_number = None
+    _totals_computed = False
+    _reserved_number = None
     _document_entries = None
+    _transactions_amounts = None
 
     class Meta:
         unique_together = ('kind', 'provider', 'series', 'number')
@@ -188,6 +298,11 @@ class BillingDocumentBase(models.Model):
                     self.__class__ = subclass
 
         self._last_state = self.state
+        self._last_number = self.number
+        self._last_totals_rates = self._get_totals_rates()
+
+    def _get_totals_rates(self):
+        return self.sales_tax_percent, self.transaction_xe_rate
 
     def _get_entries(self):
         if not self._document_entries:
@@ -195,13 +310,92 @@ class BillingDocumentBase(models.Model):
 
         return self._document_entries
 
+    def evaluate_entries(self, entries=None):
+        """
+        :returns: a list of (entry, amounts) pairs, for each of the document's
+            entries (or the given ones), where the amounts are those returned
+            by `DocumentEntry.get_amounts`.
+
+        The entries are bound to this document instance (and to its related
+        invoice, if the entries were invoiced), so that neither the
+        evaluation, nor the entries' amounts properties fetch the documents
+        again for each entry.
+        """
+
+        if entries is None:
+            entries = self._get_entries()
+
+        evaluated_entries = []
+        for entry in entries:
+            setattr(entry, self.kind, self)
+
+            if (self.related_document_id and
+                    entry.invoice_id == self.related_document_id):
+                entry.invoice = self.related_document
+
+            evaluated_entries.append((entry, entry.get_amounts()))
+
+        return evaluated_entries
+
     def compute_total_in_transaction_currency(self):
-        return sum([Decimal(entry.total_in_transaction_currency)
-                    for entry in self._get_entries()])
+        return sum([amounts['total_in_transaction_currency']
+                    for entry, amounts in self.evaluate_entries()])
 
     def compute_total(self):
-        return sum([Decimal(entry.total)
-                    for entry in self._get_entries()])
+        return sum([amounts['total'] for entry, amounts in self.evaluate_entries()])
+
+    def compute_totals(self):
+        """
+        Sets the persisted totals of the document, computed from its entries.
+        """
+
+        totals = dict.fromkeys(DOCUMENT_TOTALS_FIELDS, Decimal('0.00'))
+        if not self.transaction_xe_rate:
+            for field in DOCUMENT_TOTALS_FIELDS:
+                if field.endswith('_in_transaction_currency'):
+                    totals[field] = None
+
+        if self.pk:
+            entries = getattr(self, self.kind + '_entries').all()
+            for entry, amounts in self.evaluate_entries(entries):
+                for field, amount in entry.get_totals().items():
+                    totals[field] += amount
+
+        for field, amount in totals.items():
+            setattr(self, field, amount)
+
+        self._last_totals_rates = self._get_totals_rates()
+        self._totals_computed = True
+
+    def update_totals(self):
+        """
+        Recomputes and stores the persisted totals of the document. Needed only
+        if the entries were changed without being saved one by one (e.g. they
+        were added using `QuerySet.update`).
+        """
+
+        self.compute_totals()
+
+        BillingDocumentBase.objects.filter(pk=self.pk).update(
+            **{field: getattr(self, field) for field in DOCUMENT_TOTALS_FIELDS}
+        )
+
+    def increment_totals(self, totals):
+        """
+        Adds the given amounts to the persisted totals of a draft document.
+        """
+
+        if self.state != self.STATES.DRAFT:
+            return
+
+        for field, amount in totals.items():
+            if getattr(self, field) is not None:
+                setattr(self, field, getattr(self, field) + amount)
+
+        # The missing totals stay missing (NULL + amount is NULL)
+        BillingDocumentBase.objects.filter(pk=self.pk, state=self.STATES.DRAFT).update(
+            **{field: F(field) + amount for field, amount in totals.items()}
+        )
 
     def mark_for_generation(self):
         self.pdf.mark_as_dirty()
@@ -237,12 +431,10 @@ class BillingDocumentBase(models.Model):
         if not self.sales_tax_percent:
             self.sales_tax_percent = self.customer.sales_tax_percent
 
-        if not self.number:
-            self.number = self._generate_number()
+        # The number is generated when the document is saved
 
         self.archived_customer = self.customer.get_archivable_field_values()
-        self._total = self.compute_total()
-        self._total_in_transaction_currency = self.compute_total_in_transaction_currency()
+        self.compute_totals()
 
     @transition(field=state, source=STATES.DRAFT, target=STATES.ISSUED)
     def issue(self, issue_date=None, due_date=None):
@@ -333,57 +525,199 @@ class BillingDocumentBase(models.Model):
                       'different currency.'
             raise ValidationError({'transaction_currency': message})
 
-    def save(self, *args, **kwargs):
+    def set_default_values(self):
+        """
+        Fills in the currency, series and tax info which were not explicitly
+        set, based on the document's customer and provider.
+        """
+
         if not self.transaction_currency:
             self.transaction_currency = self.customer.currency or self.currency
 
         if not self.series:
             self.series = self.default_series
 
-        # Generate the number
-        if not self.number and self.state != BillingDocumentBase.STATES.DRAFT:
-            self.number = self._generate_number()
-
         # Add tax info
         if not self.sales_tax_name:
             self.sales_tax_name = self.customer.sales_tax_name
         if not self.sales_tax_percent:
             self.sales_tax_percent = self.customer.sales_tax_percent
 
+    def save(self, *args, **kwargs):
+        self.set_default_values()
+
+        if self._state.adding:
+            if all(getattr(self, field) is None for field in DOCUMENT_TOTALS_FIELDS):
+                self.compute_totals()
+        elif (self.state == self.STATES.DRAFT and
+              self._get_totals_rates() != self._last_totals_rates):
+            # The entries' amounts depend on the tax and exchange rates
+            self.compute_totals()
+
         self._last_state = self.state
 
-        with db_transaction.atomic():
-            # Create pdf object
-            if not self.pdf and self.state != self.STATES.DRAFT:
-                self.pdf = PDF.objects.create(upload_path=self.get_pdf_upload_path(), dirty=1)
+        # The number was explicitly set if it wasn't reserved through the sequence
+        explicit_number = (self.number and self.number != self._reserved_number and
+                           (self._state.adding or self.number != self._last_number))
+        generate_number = not self.number and self.state != BillingDocumentBase.STATES.DRAFT
+        create_pdf = not self.pdf and self.state != self.STATES.DRAFT
+
+        if (kwargs.get('update_fields') is None and not kwargs.get('force_insert') and
+                not self._state.adding and not self._totals_computed):
+            # The totals are maintained by the entries, so they must not be
+            # overwritten by a possibly stale instance
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in DOCUMENT_TOTALS_FIELDS
+            ]
+
+        try:
+            with db_transaction.atomic():
+                # The number is reserved within the same transaction as the
+                # save, so that a failed save gives it back to the sequence
+                if generate_number:
+                    self.number = self._generate_number()
+
+                # Create pdf object
+                if create_pdf:
+                    self.pdf = PDF.objects.create(upload_path=self.get_pdf_upload_path(),
+                                                  dirty=1)
+                    self.pdf.enqueue()
+
+                super(BillingDocumentBase, self).save(*args, **kwargs)
+
+                if explicit_number:
+                    DocumentNumberSequence.objects.advance_past(self)
+        except Exception:
+            # Whatever was created within the transaction has been rolled back
+            if generate_number:
+                self.number = self._reserved_number = None
+            if create_pdf:
+                self.pdf = None
+            raise
 
-            super(BillingDocumentBase, self).save(*args, **kwargs)
+        self._totals_computed = False
+
+        self._last_number = self.number
+
+    def _get_starting_number(self, default_starting_number=1):
+        if self._starting_number and self.series == self.default_series:
+            return self._starting_number
+
+        return default_starting_number
 
     def _generate_number(self, default_starting_number=1):
         """Generates the number for a proforma/invoice."""
-        default_starting_number = max(default_starting_number, 1)
-
-        documents = self.__class__._default_manager.filter(
-            provider=self.provider, series=self.series
+        self._reserved_number = DocumentNumberSequence.objects.reserve(
+            self, starting_number=self._get_starting_number(default_starting_number)
         )
-        if not documents.exists():
-            # An invoice/proforma with this provider and series does not exist
-            if self.series == self.default_series:
-                return self._starting_number
-            else:
-                return default_starting_number
-        else:
-            # An invoice with this provider and series already exists
-            max_existing_number = documents.aggregate(
-                Max('number')
-            )['number__max']
-            if max_existing_number:
-                if self._starting_number and self.series == self.default_series:
-                    return max(max_existing_number + 1, self._starting_number)
-                else:
-                    return max_existing_number + 1
-            else:
-                return default_starting_number
+
+        return self._reserved_number
+
+    @classmethod
+    def reserve_numbers(cls, documents):
+        """
+        Numbers the given documents (which are about to be issued), reserving
+        a single block of numbers for each kind, provider and series, instead
+        of one number per document.
+
+        The documents which are already numbered are skipped. The sequences
+        stay locked until the end of the current transaction, so the documents
+        should be issued within it, for a failed issuing to give the numbers
+        back.
+        """
+
+        documents_by_sequence = OrderedDict()
+        for document in documents:
+            if document.number:
+                continue
+
+            if not document.series:
+                document.series = document.default_series
+
+            sequence_key = (document.kind, document.provider_id, document.series)
+            documents_by_sequence.setdefault(sequence_key, []).append(document)
+
+        with db_transaction.atomic():
+            # The sequences are always locked in the same order, to avoid deadlocks
+            for sequence_key in sorted(documents_by_sequence):
+                sequence_documents = documents_by_sequence[sequence_key]
+
+                number = DocumentNumberSequence.objects.reserve(
+                    sequence_documents[0], count=len(sequence_documents),
+                    starting_number=sequence_documents[0]._get_starting_number()
+                )
+                for document in sequence_documents:
+                    document.number = document._reserved_number = number
+                    number += 1
+
+    @classmethod
+    def bulk_transition(cls, document_ids, state, batch_size=None, **kwargs):
+        """
+        Transitions the documents with the given ids to the given state (see
+        BULK_TRANSITIONS), in batches of `batch_size` documents.
+
+        Each batch runs within a transaction, which locks the batch's
+        documents, while each document is transitioned within a savepoint, so
+        that a failed transition rolls back only its own document.
+
+        :param kwargs: the transition's arguments (e.g. `issue_date`).
+        :returns: an OrderedDict mapping each of the given ids to a dict
+            containing either the transitioned `document`, or the `error`
+            which prevented its transition.
+        """
+
+        transition_name, source_state = cls.BULK_TRANSITIONS[state][:2]
+        batch_size = batch_size or DOCUMENTS_TRANSITION_BATCH_SIZE
+
+        results = OrderedDict()
+        for batch_ids in chunks(list(OrderedDict.fromkeys(document_ids)), batch_size):
+            with db_transaction.atomic():
+                # The documents are locked in the order of their ids, to avoid deadlocks
+                locked_ids = list(
+                    cls.objects.select_for_update().filter(pk__in=batch_ids)
+                    .prefetch_related(None).order_by('pk').values_list('pk', flat=True)
+                )
+                documents = cls.objects.select_related(
+                    'customer', 'provider', 'related_document'
+                ).in_bulk(locked_ids)
+
+                for document_id in batch_ids:
+                    document = documents.get(document_id)
+                    if not document:
+                        results[document_id] = {
+                            'error': '{} not found.'.format(cls.__name__)
+                        }
+                        continue
+
+                    if document.state != source_state:
+                        results[document_id] = {
+                            'error': '{article} {kind} can be {state} only if it is in '
+                                     '{source_state} state.'.format(
+                                         article='An' if document.kind == 'invoice' else 'A',
+                                         kind=document.kind, state=state,
+                                         source_state=source_state
+                                     )
+                        }
+                        continue
+
+                    try:
+                        with db_transaction.atomic():
+                            getattr(document, transition_name)(**kwargs)
+                    except TransitionNotAllowed as error:
+                        results[document_id] = {'error': str(error)}
+                    except Exception:
+                        logger.exception('Encountered exception while transitioning %s '
+                                         'with id=%s to %s.', document.kind, document_id, state)
+                        results[document_id] = {
+                            'error': 'The {kind} could not be {state}.'.format(
+                                kind=document.kind, state=state
+                            )
+                        }
+                    else:
+                        results[document_id] = {'document': document}
+
+        return results
 
     def series_number(self):
         if self.series:
@@ -428,14 +762,8 @@ class BillingDocumentBase(models.Model):
         # invoice.issue_date != entry.invoice.issue_date
         #
         # which is obviously false.
-        document_type_name = self.__class__.__name__  # Invoice or Proforma
-        kwargs = {document_type_name.lower(): self}
-        entries = DocumentEntry.objects.filter(**kwargs)
-        for entry in entries:
-            if document_type_name.lower() == 'invoice':
-                entry.invoice = self
-            if document_type_name.lower() == 'proforma':
-                entry.proforma = self
+        entries = DocumentEntry.objects.filter(**{self.kind: self})
+        for entry, amounts in self.evaluate_entries(entries):
             yield(entry)
 
     def get_template_context(self, state=None):
@@ -452,7 +780,12 @@ class BillingDocumentBase(models.Model):
             'state': state
         }
 
-    def get_template(self, state=None):
+    def get_template(self, state=None, cache=None):
+        """
+        :param cache: an optional dict in which the resolved templates are kept,
+            for the documents sharing the same templates.
+        """
+
         provider_state_template = '{provider}/{kind}_{state}_pdf.html'.format(
             kind=self.kind, provider=self.provider.slug, state=state).lower()
         provider_template = '{provider}/{kind}_pdf.html'.format(
@@ -468,7 +801,14 @@ class BillingDocumentBase(models.Model):
         for t in _templates:
             templates.append('billing_documents/' + t)
 
-        return select_template(templates)
+        if cache is None:
+            return select_template(templates)
+
+        key = tuple(templates)
+        if key not in cache:
+            cache[key] = select_template(templates)
+
+        return cache[key]
 
     def get_pdf_filename(self):
         return '{doc_type}_{series}-{number}.pdf'.format(
@@ -493,17 +833,27 @@ class BillingDocumentBase(models.Model):
 
         return path_template.format(**context)
 
-    def generate_pdf(self, state=None, upload=True):
+    def generate_pdf(self, state=None, upload=True, renderer=None):
         # !!! ensure this is not called concurrently for the same document
 
+        return self.generate_pdf_async(state=state, upload=upload, renderer=renderer)()
+
+    def generate_pdf_async(self, state=None, upload=True, renderer=None, templates_cache=None):
+        """
+        Starts rendering the document's PDF (see PDF.generate_async).
+        `templates_cache` is passed to `get_template`.
+
+        :returns: a callable which waits for the rendering to finish, uploads
+            the PDF and returns its content.
+        """
+
         context = self.get_template_context(state)
         context['filename'] = self.get_pdf_filename()
 
-        pdf_file_object = self.pdf.generate(template=self.get_template(state),
-                                            context=context,
-                                            upload=upload)
-
-        return pdf_file_object
+        return self.pdf.generate_async(template=self.get_template(state, templates_cache),
+                                       context=context,
+                                       upload=upload,
+                                       renderer=renderer)
 
     def generate_html(self, state=None, request=None):
         context = self.get_template_context(state)
@@ -527,65 +877,96 @@ class BillingDocumentBase(models.Model):
     def entries(self):
         raise NotImplementedError
 
+    def _get_persisted_total(self, field):
+        persisted_total = getattr(self, '_' + field)
+        if persisted_total is not None:
+            return persisted_total
+
+        # The total might have been annotated (see BillingDocumentQuerySet.with_totals)
+        annotated_total_cents = getattr(self, '_annotated_%s_cents' % field, None)
+        if annotated_total_cents is not None:
+            return (Decimal(annotated_total_cents) / 100).quantize(Decimal('0.00'))
+
+        # The persisted total is missing for the documents created before the
+        # totals were persisted (see the backfill_document_totals command)
+        return sum([amounts[field] for entry, amounts in self.evaluate_entries(self.entries)])
+
     @property
     def total(self):
-        if self._total is not None:
-            return self._total
-
-        return sum([entry.total for entry in self.entries])
+        return self._get_persisted_total('total')
 
     @property
     def total_before_tax(self):
-        return sum([entry.total_before_tax for entry in self.entries])
+        return self._get_persisted_total('total_before_tax')
 
     @property
     def tax_value(self):
-        return sum([entry.tax_value for entry in self.entries])
+        return self._get_persisted_total('tax_value')
 
     @property
     def total_in_transaction_currency(self):
-        if self._total_in_transaction_currency is not None:
-            return self._total_in_transaction_currency
-
-        return sum([entry.total_in_transaction_currency
-                    for entry in self.entries])
+        return self._get_persisted_total('total_in_transaction_currency')
 
     @property
     def total_before_tax_in_transaction_currency(self):
-        return sum([entry.total_before_tax_in_transaction_currency
-                    for entry in self.entries])
+        return self._get_persisted_total('total_before_tax_in_transaction_currency')
 
     @property
     def tax_value_in_transaction_currency(self):
-        return sum([entry.tax_value_in_transaction_currency
-                    for entry in self.entries])
+        return self._get_persisted_total('tax_value_in_transaction_currency')
+
+    def get_transactions_amounts(self):
+        """
+        :returns: a dict containing the `paid` (settled), `pending` and
+            `charged` (initial, pending or settled) amounts of the document's
+            transactions, in transaction currency.
+
+        The amounts are aggregated using a single query, unless they were
+        annotated (see `BillingDocumentQuerySet.with_transactions_amounts`),
+        and are memoized until `clear_transactions_amounts` is called.
+        """
+
+        if self._transactions_amounts is not None:
+            return self._transactions_amounts
+
+        amounts_states = transactions_amounts_states()
+
+        if hasattr(self, '_annotated_paid_amount'):
+            amounts = {amount: getattr(self, '_annotated_%s_amount' % amount)
+                       for amount in amounts_states}
+        else:
+            amounts = self.transactions.aggregate(**{
+                amount: Sum(Case(When(state__in=states, then=F('amount')),
+                                 output_field=DecimalField(max_digits=19, decimal_places=2)))
+                for amount, states in amounts_states.items()
+            })
+
+        self._transactions_amounts = {amount: value or Decimal('0.00')
+                                      for amount, value in amounts.items()}
+
+        return self._transactions_amounts
+
+    def clear_transactions_amounts(self):
+        """
+        Discards the memoized (or annotated) transactions amounts, which are
+        aggregated again when needed (e.g. after a transaction is saved).
+        """
+
+        self._transactions_amounts = None
+        for amount in transactions_amounts_states():
+            self.__dict__.pop('_annotated_%s_amount' % amount, None)
 
     @property
     def amount_paid_in_transaction_currency(self):
-        Transaction = apps.get_model('silver.Transaction')
-
-        return sum([transaction.amount
-                    for transaction in self.transactions.filter(state=Transaction.States.Settled)])
+        return self.get_transactions_amounts()['paid']
 
     @property
     def amount_pending_in_transaction_currency(self):
-        Transaction = apps.get_model('silver.Transaction')
-
-        return sum([transaction.amount
-                    for transaction in self.transactions.filter(state=Transaction.States.Pending)])
+        return self.get_transactions_amounts()['pending']
 
     @property
     def amount_to_be_charged_in_transaction_currency(self):
-        Transaction = apps.get_model('silver.Transaction')
-
-        return self.total_in_transaction_currency - sum([
-            transaction.amount
-            for transaction in self.transactions.filter(state__in=[
-                Transaction.States.Initial,
-                Transaction.States.Pending,
-                Transaction.States.Settled
-            ])
-        ])
+        return self.total_in_transaction_currency - self.get_transactions_amounts()['charged']
 
 
 def create_transaction_for_document(document):
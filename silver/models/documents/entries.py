@@ -13,10 +13,30 @@
 # limitations under the License.
 
 
+from collections import OrderedDict
 from decimal import Decimal
 
+from django.apps import apps
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import BigIntegerField, Case, F, OuterRef, Subquery, Sum, When
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from silver.utils.models import RoundedDivision, scaled_integer
+from silver.utils.profiling import profiled
+
+
+# The persisted totals of a document, which are the sums of its entries'
+# amounts (see DocumentEntry.get_totals)
+DOCUMENT_TOTALS_FIELDS = ('_total_before_tax', '_tax_value', '_total',
+                          '_total_before_tax_in_transaction_currency',
+                          '_tax_value_in_transaction_currency',
+                          '_total_in_transaction_currency')
+
+# The entry fields its documents' totals depend on
+TOTALS_VALUES_FIELDS = ('quantity', 'unit_price', 'invoice_id', 'proforma_id')
 
 
 class DocumentEntry(models.Model):
@@ -39,13 +59,101 @@ class DocumentEntry(models.Model):
         verbose_name = 'Entry'
         verbose_name_plural = 'Entries'
 
+    _amounts = None
+    _amounts_key = None
+
+    def __init__(self, *args, **kwargs):
+        super(DocumentEntry, self).__init__(*args, **kwargs)
+
+        self._last_totals_values = self._get_totals_values()
+
+    def _get_totals_values(self):
+        # The deferred fields aren't loaded, since loading them instantiates
+        # the entry again; the values are unknown (None) in that case
+        if self.get_deferred_fields().intersection(TOTALS_VALUES_FIELDS):
+            return None
+
+        return tuple(getattr(self, field) for field in TOTALS_VALUES_FIELDS)
+
     @property
     def document(self):
         return self.invoice or self.proforma
 
+    @property
+    def documents(self):
+        return [document for document in (self.invoice, self.proforma) if document]
+
+    def get_amounts(self, document=None):
+        """
+        :returns: a dict containing the amounts of the entry, computed using
+            the tax and exchange rates of the given document (the entry's
+            document, by default). The transaction currency amounts are None if
+            the document has no transaction exchange rate yet.
+
+        The amounts are memoized until the entry or the rates change.
+        """
+
+        if document is None:
+            document = self.document
+
+        sales_tax_percent = document.sales_tax_percent if document else None
+        transaction_xe_rate = document.transaction_xe_rate if document else None
+
+        amounts_key = (self.quantity, self.unit_price, sales_tax_percent, transaction_xe_rate)
+        if self._amounts_key == amounts_key:
+            return self._amounts
+
+        total_before_tax = self.total_before_tax
+        tax_value = Decimal('0.00')
+        if sales_tax_percent:
+            tax_value = (total_before_tax * sales_tax_percent / 100).quantize(Decimal('0.00'))
+
+        amounts = {
+            'total_before_tax': total_before_tax,
+            'tax_value': tax_value,
+            'total': total_before_tax + tax_value,
+            'unit_price_in_transaction_currency': None,
+            'total_before_tax_in_transaction_currency': None,
+            'tax_value_in_transaction_currency': None,
+            'total_in_transaction_currency': None
+        }
+
+        if transaction_xe_rate:
+            amounts['unit_price_in_transaction_currency'] = (
+                Decimal(self.unit_price) * transaction_xe_rate
+            ).quantize(Decimal('0.0000'))
+
+            for amount in ('total_before_tax', 'tax_value'):
+                amounts[amount + '_in_transaction_currency'] = (
+                    amounts[amount] * transaction_xe_rate
+                ).quantize(Decimal('0.00'))
+
+            amounts['total_in_transaction_currency'] = (
+                amounts['total_before_tax_in_transaction_currency'] +
+                amounts['tax_value_in_transaction_currency']
+            )
+
+        self._amounts, self._amounts_key = amounts, amounts_key
+
+        return amounts
+
+    def get_totals(self, document=None):
+        """
+        :returns: a dict containing the amounts the entry adds to each of its
+            documents' persisted totals. The transaction currency amounts are
+            missing if the document has no transaction exchange rate yet.
+        """
+
+        amounts = self.get_amounts(document)
+
+        return {
+            '_' + field: amount for field, amount in amounts.items()
+            if '_' + field in DOCUMENT_TOTALS_FIELDS and amount is not None
+        }
+
     @property
     def total(self):
-        return self.total_before_tax + self.tax_value
+        return self.get_amounts()['total']
 
     @property
     def total_before_tax(self):
@@ -54,38 +162,23 @@ class DocumentEntry(models.Model):
 
     @property
     def tax_value(self):
-        if self.invoice:
-            sales_tax_percent = self.invoice.sales_tax_percent
-        elif self.proforma:
-            sales_tax_percent = self.proforma.sales_tax_percent
-        else:
-            sales_tax_percent = None
-
-        if not sales_tax_percent:
-            return Decimal('0.00')
-
-        result = self.total_before_tax * sales_tax_percent / 100
-        return result.quantize(Decimal('0.00'))
+        return self.get_amounts()['tax_value']
 
     @property
     def total_in_transaction_currency(self):
-        return (self.total_before_tax_in_transaction_currency +
-                self.tax_value_in_transaction_currency)
+        return self.get_amounts()['total_in_transaction_currency']
 
     @property
     def total_before_tax_in_transaction_currency(self):
-        result = self.total_before_tax * self.document.transaction_xe_rate
-        return result.quantize(Decimal('0.00'))
+        return self.get_amounts()['total_before_tax_in_transaction_currency']
 
     @property
     def unit_price_in_transaction_currency(self):
-        result = Decimal(self.unit_price) * self.document.transaction_xe_rate
-        return result.quantize(Decimal('0.0000'))
+        return self.get_amounts()['unit_price_in_transaction_currency']
 
     @property
     def tax_value_in_transaction_currency(self):
-        result = self.tax_value * self.document.transaction_xe_rate
-        return result.quantize(Decimal('0.00'))
+        return self.get_amounts()['tax_value_in_transaction_currency']
 
     def clone(self):
         return DocumentEntry(
@@ -108,3 +201,148 @@ class DocumentEntry(models.Model):
             quantity=self.quantity,
             product_code=self.product_code
         )
+
+
+def _entry_document_field(field):
+    # An entry's amounts are computed using its invoice, if it has one (see
+    # DocumentEntry.document)
+    return Case(When(invoice__isnull=False, then=F('invoice__' + field)),
+                default=F('proforma__' + field))
+
+
+def entries_total_cents(document_field, in_transaction_currency=False):
+    """
+    :returns: an SQL subquery of the sum of the `total` (or the
+        `total_in_transaction_currency`) of the entries of the outer document,
+        in cents, rounded the same way as the DocumentEntry amounts are.
+
+    :param document_field: the entries' field pointing to the outer document
+        (`invoice` or `proforma`).
+    """
+
+    total_before_tax = RoundedDivision(
+        scaled_integer(F('quantity'), 4) * scaled_integer(F('unit_price'), 4), 10 ** 6
+    )
+    tax_value = RoundedDivision(
+        total_before_tax * scaled_integer(_entry_document_field('sales_tax_percent'), 2),
+        10 ** 4
+    )
+
+    if in_transaction_currency:
+        xe_rate = scaled_integer(_entry_document_field('transaction_xe_rate'), 4)
+        total = (RoundedDivision(total_before_tax * xe_rate, 10 ** 4) +
+                 RoundedDivision(tax_value * xe_rate, 10 ** 4))
+    else:
+        total = total_before_tax + tax_value
+
+    entries = DocumentEntry.objects.filter(
+        **{document_field: OuterRef('pk')}
+    ).order_by().values(document_field).annotate(total_cents=Sum(total)).values('total_cents')
+
+    return Subquery(entries, output_field=BigIntegerField())
+
+
+class DocumentEntryAccumulator(object):
+    """
+    Collects unsaved document entries, so that they can be inserted using a
+    single query once the document is complete.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, **kwargs):
+        entry = DocumentEntry(**kwargs)
+        self.entries.append(entry)
+
+        return entry
+
+    @property
+    def total(self):
+        return sum([entry.total for entry in self.entries], Decimal('0.00'))
+
+    @profiled('entries_creation')
+    def flush(self):
+        DocumentEntry.objects.bulk_create(self.entries)
+
+        # bulk_create doesn't send signals, so the documents' totals are
+        # incremented here, once for each document
+        documents_totals = OrderedDict()
+        for entry in self.entries:
+            entry_totals = entry.get_totals()
+
+            for document in entry.documents:
+                document_totals = documents_totals.setdefault(document, {})
+                for field, amount in entry_totals.items():
+                    document_totals[field] = document_totals.get(field, 0) + amount
+
+        for document, totals in documents_totals.items():
+            document.increment_totals(totals)
+
+        self.entries = []
+
+
+@receiver(pre_save, sender=DocumentEntry)
+def load_entry_totals_values(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    entry = instance
+    if entry.pk and entry._last_totals_values is None:
+        # The entry was loaded with deferred fields, so the values the
+        # documents' totals were computed with are read from the database
+        entry._last_totals_values = DocumentEntry.objects.filter(
+            pk=entry.pk
+        ).values_list(*TOTALS_VALUES_FIELDS).first()
+
+
+@receiver(post_save, sender=DocumentEntry)
+def update_documents_totals_on_entry_save(sender, instance, created=False, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    entry = instance
+    last_totals_values = entry._last_totals_values
+    entry._last_totals_values = entry._get_totals_values()
+
+    if created:
+        for document in entry.documents:
+            document.increment_totals(entry.get_totals())
+        return
+
+    last_quantity, last_unit_price, last_invoice_id, last_proforma_id = last_totals_values
+
+    if (last_invoice_id, last_proforma_id) != (entry.invoice_id, entry.proforma_id):
+        # The entry was moved, so the involved draft documents are recomputed
+        # (the totals of the issued documents stay as they were when issued)
+        BillingDocumentBase = apps.get_model('silver', 'BillingDocumentBase')
+
+        documents_ids = {last_invoice_id, last_proforma_id, entry.invoice_id, entry.proforma_id}
+        for document in BillingDocumentBase.objects.filter(
+            pk__in=documents_ids, state=BillingDocumentBase.STATES.DRAFT
+        ):
+            document.update_totals()
+    elif (last_quantity, last_unit_price) != (entry.quantity, entry.unit_price):
+        last_entry = DocumentEntry(quantity=last_quantity, unit_price=last_unit_price,
+                                   invoice=entry.invoice, proforma=entry.proforma)
+        last_totals = last_entry.get_totals()
+
+        totals = {field: amount - last_totals[field]
+                  for field, amount in entry.get_totals().items()}
+        for document in entry.documents:
+            document.increment_totals(totals)
+
+
+@receiver(post_delete, sender=DocumentEntry)
+def update_documents_totals_on_entry_delete(sender, instance, **kwargs):
+    entry = instance
+
+    try:
+        documents = entry.documents
+        totals = {field: -amount for field, amount in entry.get_totals().items()}
+    except ObjectDoesNotExist:
+        # The documents are being deleted too
+        return
+
+    for document in documents:
+        document.increment_totals(totals)
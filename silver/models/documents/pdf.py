@@ -1,15 +1,17 @@
+import hashlib
 import uuid
 
-from xhtml2pdf import pisa
-
 from django.conf import settings
 from django.core.files.base import ContentFile
 from django.db import transaction
-from django.db.models import Model, FileField, TextField, UUIDField, PositiveIntegerField, F
-from django.http import HttpResponse
+from django.db.models import (
+    Model, CharField, DateTimeField, FileField, OneToOneField, TextField, UUIDField,
+    PositiveIntegerField, F, CASCADE
+)
+from django.utils import timezone
 from django.utils.module_loading import import_string
 
-from silver.utils.pdf import fetch_resources
+from silver.utils.pdf import get_pdf_renderer
 
 
 def get_storage():
@@ -31,29 +33,57 @@ class PDF(Model):
                          storage=get_storage(), upload_to=get_upload_path)
     dirty = PositiveIntegerField(default=0)
     upload_path = TextField(null=True, blank=True)
+    content_hash = CharField(max_length=64, null=True, blank=True, editable=False)
 
     @property
     def url(self):
         return self.pdf_file.url if self.pdf_file else None
 
-    def generate(self, template, context, upload=True):
-        pdf_file_object = HttpResponse(content_type='application/pdf')
+    def generate(self, template, context, upload=True, renderer=None):
+        return self.generate_async(template, context, upload=upload, renderer=renderer)()
+
+    def generate_async(self, template, context, upload=True, renderer=None):
+        """
+        Starts rendering the PDF, using the given renderer (by default, the
+        one returned by `get_pdf_renderer`).
+
+        If the PDF is to be uploaded and its HTML is the same as the last
+        uploaded one's (see `get_content_hash`), the rendering and the upload
+        are skipped and the PDF is only marked as clean.
+
+        :returns: a callable which waits for the rendering to finish, uploads
+            the PDF and returns its content (None if the rendering was skipped).
+        """
 
         html = template.render(context)
-        pisa.pisaDocument(src=html.encode("UTF-8"),
-                          dest=pdf_file_object,
-                          encoding='UTF-8',
-                          link_callback=fetch_resources)
+        content_hash = self.get_content_hash(html, context['filename'])
+
+        if upload and self.pdf_file and content_hash == self.content_hash:
+            def skip():
+                self.mark_as_clean()
+
+            return skip
+
+        get_pdf_content = (renderer or get_pdf_renderer()).render_async(html)
+
+        def finish():
+            pdf_content = get_pdf_content()
 
-        if not pdf_file_object:
-            return
+            if upload:
+                self.content_hash = content_hash
+                self.upload(pdf_file_object=pdf_content, filename=context['filename'])
 
-        if upload:
-            self.upload(pdf_file_object=pdf_file_object, filename=context['filename'])
+            self.mark_as_clean()
 
-        self.mark_as_clean()
+            return pdf_content
 
-        return pdf_file_object
+        return finish
+
+    @staticmethod
+    def get_content_hash(html, filename):
+        content = u'{filename}\n{html}'.format(filename=filename, html=html)
+
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
 
     def upload(self, pdf_file_object, filename):
         # the PDF's upload_path attribute needs to be set before calling this method
@@ -67,5 +97,24 @@ class PDF(Model):
             PDF.objects.filter(id=self.id).update(dirty=F('dirty') + 1)
             self.refresh_from_db(fields=['dirty'])
 
+            self.enqueue()
+
     def mark_as_clean(self):
         PDF.objects.filter(id=self.id).update(dirty=F('dirty') - self.dirty)
+
+        # A PDF marked as dirty meanwhile stays queued
+        QueuedPDF.objects.filter(pdf_id=self.id, pdf__dirty=0).delete()
+
+    def enqueue(self):
+        # Must be called after the dirty counter is incremented, so that a
+        # concurrent mark_as_clean can't dequeue the PDF afterwards.
+        QueuedPDF.objects.get_or_create(pdf_id=self.id)
+
+
+class QueuedPDF(Model):
+    """
+    A dirty PDF, waiting to be generated by the `generate_pdfs` task.
+    """
+
+    pdf = OneToOneField(PDF, primary_key=True, on_delete=CASCADE, related_name='queued')
+    queued_at = DateTimeField(default=timezone.now, db_index=True)
@@ -0,0 +1,99 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Max
+
+
+class DocumentNumberSequenceManager(models.Manager):
+    def _sequence_lookup(self, document):
+        return {
+            'kind': document.kind,
+            'provider_id': document.provider_id,
+            'series': document.series or ''
+        }
+
+    def _get_locked_sequence(self, document):
+        lookup = self._sequence_lookup(document)
+
+        sequence = self.select_for_update().filter(**lookup).first()
+        if sequence:
+            return sequence
+
+        # The sequence is initialized once, from the already numbered documents
+        max_existing_number = document.__class__._default_manager.filter(
+            provider_id=document.provider_id, series=document.series
+        ).aggregate(Max('number'))['number__max']
+
+        try:
+            with transaction.atomic():
+                return self.create(next_number=(max_existing_number or 0) + 1, **lookup)
+        except IntegrityError:
+            # The sequence has been created concurrently
+            return self.select_for_update().get(**lookup)
+
+    def reserve(self, document, count=1, starting_number=1):
+        """
+        Reserves a block of `count` consecutive numbers for documents having
+        the same kind, provider and series as the given document.
+
+        The sequence is locked until the end of the current transaction, so
+        that the reserved numbers are given back if the transaction is rolled
+        back, while concurrent reservations wait for it.
+
+        :param starting_number: the lowest number that can be reserved.
+        :returns: the first reserved number.
+        """
+
+        with transaction.atomic():
+            sequence = self._get_locked_sequence(document)
+
+            number = max(sequence.next_number, starting_number, 1)
+            sequence.next_number = number + count
+            sequence.save(update_fields=['next_number'])
+
+        return number
+
+    def advance_past(self, document):
+        """
+        Makes sure that the number of the given document, which wasn't
+        reserved through the sequence (e.g. it was explicitly set), won't be
+        reserved later.
+        """
+
+        self.filter(
+            next_number__lte=document.number, **self._sequence_lookup(document)
+        ).update(next_number=document.number + 1)
+
+
+class DocumentNumberSequence(models.Model):
+    """
+    Keeps the next number of the documents having the same kind, provider and
+    series, so that numbering a document doesn't require scanning the
+    existing ones.
+    """
+
+    objects = DocumentNumberSequenceManager()
+
+    kind = models.CharField(max_length=8)
+    provider = models.ForeignKey('Provider', related_name='document_number_sequences')
+    series = models.CharField(max_length=20, blank=True)
+    next_number = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('kind', 'provider', 'series')
+
+    def __unicode__(self):
+        return u'{kind} {series} - {number}'.format(kind=self.kind, series=self.series,
+                                                    number=self.next_number)
@@ -20,7 +20,7 @@ from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
 from silver.utils.international import currencies
-from silver.utils.models import UnsavedForeignKey
+from silver.utils.models import UnsavedForeignKey, loaded_field_values
 
 
 class PlanManager(models.Manager):
@@ -112,9 +112,19 @@ class Plan(models.Model):
         help_text='The provider which provides the plan.'
     )
 
+    # The fields the subscriptions' billing dates depend on
+    BILLING_FIELDS = ('interval', 'interval_count', 'generate_after', 'prebill_plan',
+                      'cycle_billing_duration', 'separate_cycles_during_trial',
+                      'generate_documents_on_trial_end', 'trial_period_days')
+
     class Meta:
         ordering = ('name',)
 
+    def __init__(self, *args, **kwargs):
+        super(Plan, self).__init__(*args, **kwargs)
+
+        self._last_billing_values = loaded_field_values(self, self.BILLING_FIELDS)
+
     @staticmethod
     def validate_metered_features(metered_features):
         product_codes = dict()
@@ -19,7 +19,6 @@ from datetime import date, datetime, timedelta
 from decimal import Decimal
 
 from annoying.functions import get_object_or_None
-from dateutil import rrule
 from django.conf import settings
 from django.utils.timezone import utc
 from django_fsm import FSMField, transition, TransitionNotAllowed
@@ -28,36 +27,102 @@ from model_utils import Choices
 
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models.signals import pre_delete
+from django.db import models, transaction
+from django.db.models import Q, Sum
+from django.db.models.signals import pre_delete, post_save, post_delete
 from django.dispatch import receiver
-from django.template import TemplateDoesNotExist
-from django.template.loader import get_template, render_to_string
+from django.template.loader import select_template
+from django.test.signals import setting_changed
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
-from .billing_entities import Customer
+from .billing_entities import Customer, Provider
 from .documents import DocumentEntry
-from silver.utils.dates import ONE_DAY, relativedelta, first_day_of_month
+from .plans import Plan
+from silver.utils.dates import (ONE_DAY, relativedelta, first_day_of_month,
+                                last_cycle_start_date)
+from silver.utils.models import loaded_field_values
+from silver.utils.profiling import profiled
 from silver.validators import validate_reference
 
 
 logger = logging.getLogger(__name__)
 
+# The maximum number of cycle dates memoized for a subscription instance
+CYCLE_DATES_CACHE_SIZE = 128
 
-def field_template_path(field, provider=None):
-    if provider:
-        provider_template_path = 'billing_documents/{provider}/{field}.html'.\
-            format(provider=provider, field=field)
-        try:
-            get_template(provider_template_path)
-            return provider_template_path
-        except TemplateDoesNotExist:
-            pass
-    return 'billing_documents/{field}.html'.format(field=field)
+# The subscription fields mirroring its billing logs (see
+# Subscription.update_billing_state)
+BILLING_STATE_FIELDS = ('plan_billed_up_to', 'metered_features_billed_up_to',
+                        'latest_billing_date', 'billing_logs_count')
+
+
+# Compiled field templates, cached per (provider slug, field)
+_field_templates = {}
+
+
+def get_field_template(field, provider=None):
+    """
+    Returns the compiled template of a document entry field, preferring the
+    provider's own template over the default one.
+
+    The templates are cached for the lifetime of the process, so if templates
+    are added or changed, `clear_field_templates_cache` must be called.
+    """
+
+    key = (provider, field)
+
+    template = _field_templates.get(key)
+    if template is None:
+        template_names = ['billing_documents/{field}.html'.format(field=field)]
+        if provider:
+            template_names.insert(0, 'billing_documents/{provider}/{field}.html'.format(
+                provider=provider, field=field
+            ))
+
+        template = _field_templates[key] = select_template(template_names)
+
+    return template
+
+
+def render_field_template(field, context, provider=None):
+    return get_field_template(field, provider).render(context)
+
+
+def clear_field_templates_cache():
+    _field_templates.clear()
+
+
+@receiver(setting_changed)
+def clear_field_templates_cache_on_templates_change(sender, setting, **kwargs):
+    if setting == 'TEMPLATES':
+        clear_field_templates_cache()
+
+
+class MeteredFeatureUnitsLogQuerySet(models.QuerySet):
+    def consumed_units_per_metered_feature(self, start_date, end_date):
+        """
+        Sums up, in the database, the units consumed within the given interval.
+
+        :returns: a dict mapping (subscription id, metered feature id) pairs to
+            the units consumed for that subscription and metered feature.
+        """
+
+        consumed_units = self.filter(
+            start_date__gte=start_date, end_date__lte=end_date
+        ).order_by().values(
+            'subscription', 'metered_feature'
+        ).annotate(total_consumed_units=Sum('consumed_units'))
+
+        return {
+            (item['subscription'], item['metered_feature']): item['total_consumed_units']
+            for item in consumed_units
+        }
 
 
 class MeteredFeatureUnitsLog(models.Model):
+    objects = MeteredFeatureUnitsLogQuerySet.as_manager()
+
     metered_feature = models.ForeignKey('MeteredFeature', related_name='consumed')
     subscription = models.ForeignKey('Subscription', related_name='mf_log_entries')
     consumed_units = models.DecimalField(max_digits=19, decimal_places=4,
@@ -114,7 +179,23 @@ class MeteredFeatureUnitsLog(models.Model):
         return unicode(self.metered_feature.name)
 
 
+class SubscriptionQuerySet(models.QuerySet):
+    def due_for_billing(self, billing_date):
+        """
+        Filters the active and canceled subscriptions that may have to be billed
+        at the given date, according to their next billing date. Subscriptions
+        whose next billing date is not known are included as well.
+        """
+
+        return self.filter(
+            Q(next_billing_date__isnull=True) | Q(next_billing_date__lte=billing_date),
+            state__in=[Subscription.STATES.ACTIVE, Subscription.STATES.CANCELED]
+        )
+
+
 class Subscription(models.Model):
+    objects = SubscriptionQuerySet.as_manager()
+
     class STATES(object):
         ACTIVE = 'active'
         INACTIVE = 'inactive'
@@ -132,13 +213,6 @@ class Subscription(models.Model):
         NOW = 'now'
         END_OF_BILLING_CYCLE = 'end_of_billing_cycle'
 
-    _INTERVALS_CODES = {
-        'year': rrule.YEARLY,
-        'month': rrule.MONTHLY,
-        'week': rrule.WEEKLY,
-        'day': rrule.DAILY
-    }
-
     plan = models.ForeignKey(
         'Plan',
         help_text='The plan the customer is subscribed to.'
@@ -174,6 +248,29 @@ class Subscription(models.Model):
         protected=True, help_text='The state the subscription is in.'
     )
     meta = JSONField(blank=True, null=True)
+    next_billing_date = models.DateField(
+        blank=True, null=True, editable=False, db_index=True,
+        help_text='The earliest date at which the subscription may have to be billed again.'
+    )
+    plan_billed_up_to = models.DateField(
+        blank=True, null=True, editable=False,
+        help_text='The date up to which the plan has been billed, as given by the latest '
+                  'billing log.'
+    )
+    metered_features_billed_up_to = models.DateField(
+        blank=True, null=True, editable=False,
+        help_text='The date up to which the metered features have been billed, as given by '
+                  'the latest billing log.'
+    )
+    latest_billing_date = models.DateField(
+        blank=True, null=True, editable=False,
+        help_text='The billing date of the latest billing log.'
+    )
+    billing_logs_count = models.PositiveIntegerField(
+        blank=True, null=True, editable=False,
+        help_text='The number of billing logs of the subscription. If not set, the billing '
+                  'state fields have not been populated yet.'
+    )
 
     def clean(self):
         errors = dict()
@@ -202,70 +299,51 @@ class Subscription(models.Model):
     def provider(self):
         return self.plan.provider
 
-    def _get_aligned_start_date_after_date(self, reference_date, interval_type,
-                                           bymonth=None, byweekday=None, bymonthday=None):
-        return list(
-            rrule.rrule(interval_type,
-                        count=1,  # align the cycle to the given rules as quickly as possible
-                        bymonth=bymonth,
-                        bymonthday=bymonthday,
-                        byweekday=byweekday,
-                        dtstart=reference_date)
-        )[-1].date()
-
-    def _get_last_start_date_within_range(self, range_start, range_end,
-                                          interval_type, interval_count,
-                                          bymonth=None, byweekday=None, bymonthday=None):
-        # we try to obtain a start date aligned to the given rules
-        aligned_start_date = self._get_aligned_start_date_after_date(
-            reference_date=range_start,
-            interval_type=interval_type,
-            bymonth=bymonth,
-            bymonthday=bymonthday,
-            byweekday=byweekday,
-        )
+    def _cycle_dates_cache_key(self, function, reference_date, ignore_trial, granulate):
+        """
+        The cycle dates depend only on the values below, which makes them safe to
+        be memoized per subscription instance, even if the subscription changes.
+        """
 
-        relative_start_date = range_start if aligned_start_date > range_end else aligned_start_date
+        return (function, reference_date, bool(ignore_trial), bool(granulate),
+                self.start_date, self.trial_end, self.ended_at,
+                self.plan.interval, self.plan.interval_count,
+                self.separate_cycles_during_trial if self.trial_end else None)
 
-        dates = list(
-            rrule.rrule(interval_type,
-                        dtstart=relative_start_date,
-                        interval=interval_count,
-                        until=range_end)
-        )
+    def _memoized_cycle_date(self, function, reference_date, ignore_trial, granulate):
+        if reference_date is None:
+            reference_date = timezone.now().date()
 
-        return aligned_start_date if not dates else dates[-1].date()
+        cache = self.__dict__.setdefault('_cycle_dates_cache', {})
+        key = self._cycle_dates_cache_key(function.__name__, reference_date,
+                                          ignore_trial, granulate)
+        if key not in cache:
+            if len(cache) >= CYCLE_DATES_CACHE_SIZE:
+                cache.clear()
 
-    def _cycle_start_date(self, reference_date=None, ignore_trial=None, granulate=None):
-        ignore_trial_default = False
-        granulate_default = False
+            cache[key] = function(self, reference_date, ignore_trial, granulate)
 
-        ignore_trial = ignore_trial_default or ignore_trial
-        granulate = granulate_default or granulate
+        return cache[key]
 
-        if reference_date is None:
-            reference_date = timezone.now().date()
+    @profiled('cycle_computation')
+    def _cycle_start_date(self, reference_date=None, ignore_trial=None, granulate=None):
+        return self._memoized_cycle_date(Subscription._compute_cycle_start_date,
+                                         reference_date, ignore_trial, granulate)
 
+    @profiled('cycle_computation')
+    def _cycle_end_date(self, reference_date=None, ignore_trial=None, granulate=None):
+        return self._memoized_cycle_date(Subscription._compute_cycle_end_date,
+                                         reference_date, ignore_trial, granulate)
+
+    def _compute_cycle_start_date(self, reference_date, ignore_trial, granulate):
         if not self.start_date or reference_date < self.start_date:
             return None
 
-        rules = {
-            'interval_type': self._INTERVALS_CODES[self.plan.interval],
-            'interval_count': 1 if granulate else self.plan.interval_count,
-        }
-        if self.plan.interval == self.plan.INTERVALS.MONTH:
-            rules['bymonthday'] = 1  # first day of the month
-        elif self.plan.interval == self.plan.INTERVALS.WEEK:
-            rules['byweekday'] = 0  # first day of the week (Monday)
-        elif self.plan.interval == self.plan.INTERVALS.YEAR:
-            # first day of the first month (1 Jan)
-            rules['bymonth'] = 1
-            rules['bymonthday'] = 1
-
-        start_date_ignoring_trial = self._get_last_start_date_within_range(
+        start_date_ignoring_trial = last_cycle_start_date(
             range_start=self.start_date,
             range_end=reference_date,
-            **rules
+            interval=self.plan.interval,
+            interval_count=1 if granulate else self.plan.interval_count
         )
 
         if ignore_trial or not self.trial_end:
@@ -284,16 +362,7 @@ class Subscription(models.Model):
                     # Otherwise, the start date of the trial period is the subscription start date
                     return self.start_date
 
-    def _cycle_end_date(self, reference_date=None, ignore_trial=None, granulate=None):
-        ignore_trial_default = False
-        granulate_default = False
-
-        ignore_trial = ignore_trial or ignore_trial_default
-        granulate = granulate or granulate_default
-
-        if reference_date is None:
-            reference_date = timezone.now().date()
-
+    def _compute_cycle_end_date(self, reference_date, ignore_trial, granulate):
         real_cycle_start_date = self._cycle_start_date(reference_date, ignore_trial, granulate)
 
         # we need a current start date in order to compute a current end date
@@ -443,9 +512,24 @@ class Subscription(models.Model):
             'interval_end': interval_end.strftime('%Y-%m-%d')
         })
 
+    @property
+    def has_billing_state(self):
+        """
+        Whether the billing state fields (see `update_billing_state`) are
+        populated, meaning that they can be used instead of querying the
+        billing logs.
+        """
+        return self.billing_logs_count is not None
+
     @property
     def billed_up_to_dates(self):
-        last_billing_log = self.last_billing_log
+        if self.has_billing_state and self.billing_logs_count:
+            return {
+                'metered_features_billed_up_to': self.metered_features_billed_up_to,
+                'plan_billed_up_to': self.plan_billed_up_to
+            }
+
+        last_billing_log = None if self.has_billing_state else self.last_billing_log
 
         return {
             'metered_features_billed_up_to': last_billing_log.metered_features_billed_up_to,
@@ -519,20 +603,121 @@ class Subscription(models.Model):
 
     @property
     def is_billed_first_time(self):
-        return self.billing_logs.all().count() == 0
+        if self.has_billing_state:
+            return self.billing_logs_count == 0
+
+        return self.last_billing_log is None
 
     @property
     def last_billing_log(self):
-        return self.billing_logs.order_by('billing_date').last()
+        # The latest billing log might have been prefetched (see
+        # DocumentsGenerator.prefetch_subscriptions)
+        if hasattr(self, '_prefetched_last_billing_logs'):
+            return next(iter(self._prefetched_last_billing_logs), None)
+
+        return self.billing_logs.order_by('billing_date', 'pk').last()
+
+    def clear_prefetched_billing_logs(self):
+        self.__dict__.pop('_prefetched_last_billing_logs', None)
+
+    def update_billing_state(self):
+        """
+        Populates the billing state fields from the subscription's billing logs
+        and updates the next billing date accordingly.
+
+        The subscription row is locked while doing so, meaning that concurrent
+        billing logs changes are applied one after another.
+        """
+
+        with transaction.atomic():
+            list(Subscription.objects.select_for_update().filter(pk=self.pk).values_list('pk'))
+
+            billing_logs = BillingLog.objects.filter(subscription_id=self.pk)
+            last_billing_log = billing_logs.order_by('-billing_date', '-pk').first()
+
+            self.clear_prefetched_billing_logs()
+            self.billing_logs_count = billing_logs.count()
+            self.plan_billed_up_to = getattr(last_billing_log, 'plan_billed_up_to', None)
+            self.metered_features_billed_up_to = getattr(
+                last_billing_log, 'metered_features_billed_up_to', None
+            )
+            self.latest_billing_date = getattr(last_billing_log, 'billing_date', None)
+            self.next_billing_date = self._compute_next_billing_date()
+
+            Subscription.objects.filter(pk=self.pk).update(
+                next_billing_date=self.next_billing_date,
+                **{field: getattr(self, field) for field in BILLING_STATE_FIELDS}
+            )
+
+    def _compute_next_billing_date(self):
+        """
+        Computes the earliest billing date for which `should_be_billed` can
+        return True, given the current billing logs, or None if there is no
+        such date (the subscription is not billable) or it can't be computed.
+
+        The returned date is a lower bound, meaning that the subscription is not
+        necessarily billed on that date, but it is never billed before it.
+        """
+
+        if (self.state not in [self.STATES.ACTIVE, self.STATES.CANCELED] or
+                not self.start_date):
+            return None
+
+        if self.pk:
+            plan_billed_up_to = self.billed_up_to_dates['plan_billed_up_to']
+        else:
+            plan_billed_up_to = self.start_date - ONE_DAY
+
+        if self.state == self.STATES.CANCELED:
+            if not self.cancel_date:
+                return None
+
+            return max(plan_billed_up_to, self.cancel_date) + ONE_DAY
+
+        if self.prebill_plan:
+            return plan_billed_up_to + ONE_DAY
+
+        billed_cycle_end_date = self.cycle_end_date(plan_billed_up_to + ONE_DAY)
+        if not billed_cycle_end_date:
+            return None
+
+        return billed_cycle_end_date + ONE_DAY
+
+    def update_next_billing_date(self):
+        self.next_billing_date = self._compute_next_billing_date()
+
+        Subscription.objects.filter(pk=self.pk).update(
+            next_billing_date=self.next_billing_date
+        )
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.billing_logs_count is None:
+            # A new subscription has no billing logs
+            self.billing_logs_count = 0
+
+        self.next_billing_date = self._compute_next_billing_date()
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'next_billing_date'}
+        elif not self._state.adding and not kwargs.get('force_insert'):
+            # The billing state is maintained by the billing logs, so it must
+            # not be overwritten by a possibly stale instance
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in BILLING_STATE_FIELDS
+            ]
+
+        super(Subscription, self).save(*args, **kwargs)
 
     @property
     def last_billing_date(self):
-        # ToDo: Improve this when dropping Django 1.8 support
-        try:
-            return self.billing_logs.all()[0].billing_date
-        except (BillingLog.DoesNotExist, IndexError):
-            # It should never get here.
-            return None
+        if self.has_billing_state:
+            return self.latest_billing_date
+
+        last_billing_log = self.last_billing_log
+
+        return last_billing_log.billing_date if last_billing_log else None
 
     def _should_activate_with_free_trial(self):
         return Subscription.objects.filter(
@@ -605,11 +790,11 @@ class Subscription(models.Model):
         self.cancel(when=self.CANCEL_OPTIONS.END_OF_BILLING_CYCLE)
 
     def _add_trial_value(self, start_date, end_date, invoice=None,
-                         proforma=None):
+                         proforma=None, entries=None):
         self._add_plan_trial(start_date=start_date, end_date=end_date,
-                             invoice=invoice, proforma=proforma)
+                             invoice=invoice, proforma=proforma, entries=entries)
         self._add_mfs_for_trial(start_date=start_date, end_date=end_date,
-                                invoice=invoice, proforma=proforma)
+                                invoice=invoice, proforma=proforma, entries=entries)
 
     def _get_interval_end_date(self, date=None):
         """
@@ -636,8 +821,19 @@ class Subscription(models.Model):
             'value_state': value_state
         })
 
+    def _add_entry(self, entries, **kwargs):
+        """
+        Creates a document entry, or just adds it to the `entries` accumulator
+        (a DocumentEntryAccumulator) if one is given.
+        """
+
+        if entries is None:
+            return DocumentEntry.objects.create(**kwargs)
+
+        return entries.add(**kwargs)
+
     def _add_plan_trial(self, start_date, end_date, invoice=None,
-                        proforma=None):
+                        proforma=None, entries=None):
         """
         Adds the plan trial to the document, by adding an entry with positive
         prorated value and one with prorated, negative value which represents
@@ -664,8 +860,8 @@ class Subscription(models.Model):
         description = self._entry_description(context)
 
         # Add plan with positive value
-        DocumentEntry.objects.create(
-            invoice=invoice, proforma=proforma, description=description,
+        self._add_entry(
+            entries, invoice=invoice, proforma=proforma, description=description,
             unit=unit, unit_price=plan_price, quantity=Decimal('1.00'),
             product_code=self.plan.product_code, prorated=prorated,
             start_date=start_date, end_date=end_date
@@ -678,8 +874,8 @@ class Subscription(models.Model):
         description = self._entry_description(context)
 
         # Add plan with negative value
-        DocumentEntry.objects.create(
-            invoice=invoice, proforma=proforma, description=description,
+        self._add_entry(
+            entries, invoice=invoice, proforma=proforma, description=description,
             unit=unit, unit_price=-plan_price, quantity=Decimal('1.00'),
             product_code=self.plan.product_code, prorated=prorated,
             start_date=start_date, end_date=end_date
@@ -724,7 +920,7 @@ class Subscription(models.Model):
             # spans over 2 months and the subscription has been already billed
             # once => this month it is still on trial but it only
             # has remaining = consumed_last_cycle - included_during_trial
-            last_log_entry = self.billing_logs.all()[0]
+            last_log_entry = self.last_billing_log
             if last_log_entry.proforma:
                 qs = last_log_entry.proforma.proforma_entries.filter(
                     product_code=metered_feature.product_code)
@@ -753,7 +949,7 @@ class Subscription(models.Model):
             return 0, consumed_units
 
     def _add_mfs_for_trial(self, start_date, end_date, invoice=None,
-                           proforma=None):
+                           proforma=None, entries=None):
         prorated, percent = self._get_proration_status_and_percent(start_date,
                                                                    end_date)
         context = self._build_entry_context({
@@ -767,6 +963,8 @@ class Subscription(models.Model):
 
         total = Decimal("0.00")
 
+        consumed_units = self._get_consumed_units_per_metered_feature(start_date, end_date)
+
         # Add all the metered features consumed during the trial period
         for metered_feature in self.plan.metered_features.all():
             context.update({'metered_feature': metered_feature,
@@ -776,11 +974,7 @@ class Subscription(models.Model):
 
             unit = self._entry_unit(context)
 
-            qs = self.mf_log_entries.filter(metered_feature=metered_feature,
-                                            start_date__gte=start_date,
-                                            end_date__lte=end_date)
-            log = [qs_item.consumed_units for qs_item in qs]
-            total_consumed_units = sum(log)
+            total_consumed_units = consumed_units.get(metered_feature.pk, 0)
 
             extra_consumed, free = self._get_extra_consumed_units_during_trial(
                 metered_feature, total_consumed_units)
@@ -796,8 +990,8 @@ class Subscription(models.Model):
                 description = self._entry_description(context)
 
                 # Positive value for the consumed items.
-                DocumentEntry.objects.create(
-                    invoice=invoice, proforma=proforma, description=description,
+                self._add_entry(
+                    entries, invoice=invoice, proforma=proforma, description=description,
                     unit=unit, quantity=free_units,
                     unit_price=metered_feature.price_per_unit,
                     product_code=metered_feature.product_code,
@@ -812,8 +1006,8 @@ class Subscription(models.Model):
                 description = self._entry_description(context)
 
                 # Negative value for the consumed items.
-                DocumentEntry.objects.create(
-                    invoice=invoice, proforma=proforma, description=description,
+                self._add_entry(
+                    entries, invoice=invoice, proforma=proforma, description=description,
                     unit=unit, quantity=free_units,
                     unit_price=-metered_feature.price_per_unit,
                     product_code=metered_feature.product_code,
@@ -827,15 +1021,10 @@ class Subscription(models.Model):
                     'context': 'metered-feature-trial-not-discounted'
                 })
 
-                description_template_path = field_template_path(
-                    field='entry_description',
-                    provider=self.plan.provider.slug)
-                description = render_to_string(
-                    description_template_path, context
-                )
+                description = self._entry_description(context)
 
-                total += DocumentEntry.objects.create(
-                    invoice=invoice, proforma=proforma,
+                total += self._add_entry(
+                    entries, invoice=invoice, proforma=proforma,
                     description=description, unit=unit,
                     quantity=charged_units, prorated=prorated,
                     unit_price=metered_feature.price_per_unit,
@@ -846,7 +1035,7 @@ class Subscription(models.Model):
         return total
 
     def _add_plan_value(self, start_date, end_date, invoice=None,
-                        proforma=None):
+                        proforma=None, entries=None):
         """
         Adds to the document the value of the plan.
         """
@@ -871,28 +1060,38 @@ class Subscription(models.Model):
 
         unit = self._entry_unit(context)
 
-        return DocumentEntry.objects.create(
-            invoice=invoice, proforma=proforma, description=description,
+        return self._add_entry(
+            entries, invoice=invoice, proforma=proforma, description=description,
             unit=unit, unit_price=plan_price, quantity=Decimal('1.00'),
             product_code=self.plan.product_code, prorated=prorated,
             start_date=start_date, end_date=end_date
         ).total
 
+    def _get_consumed_units_per_metered_feature(self, start_date, end_date):
+        """
+        :returns: a dict mapping the metered features ids to the units consumed
+            between start_date and end_date, computed using a single query.
+        """
+
+        consumed_units = self.mf_log_entries.consumed_units_per_metered_feature(
+            start_date, end_date
+        )
+
+        return {
+            metered_feature_id: units
+            for (_, metered_feature_id), units in consumed_units.items()
+        }
+
     def _get_consumed_units(self, metered_feature, proration_percent,
-                            start_date, end_date):
+                            total_consumed_units):
         included_units = (proration_percent * metered_feature.included_units)
 
-        qs = self.mf_log_entries.filter(metered_feature=metered_feature,
-                                        start_date__gte=start_date,
-                                        end_date__lte=end_date)
-        log = [qs_item.consumed_units for qs_item in qs]
-        total_consumed_units = reduce(lambda x, y: x + y, log, 0)
-
         if total_consumed_units > included_units:
             return total_consumed_units - included_units
         return 0
 
-    def _add_mfs(self, start_date, end_date, invoice=None, proforma=None):
+    def _add_mfs(self, start_date, end_date, invoice=None, proforma=None,
+                 entries=None):
         prorated, percent = self._get_proration_status_and_percent(start_date,
                                                                    end_date)
 
@@ -908,9 +1107,15 @@ class Subscription(models.Model):
         })
 
         mfs_total = Decimal('0.00')
+
+        total_consumed_units = self._get_consumed_units_per_metered_feature(
+            start_date, end_date
+        )
         for metered_feature in self.plan.metered_features.all():
             consumed_units = self._get_consumed_units(
-                metered_feature, percent, start_date, end_date)
+                metered_feature, percent,
+                total_consumed_units.get(metered_feature.pk, 0)
+            )
 
             context.update({'metered_feature': metered_feature,
                             'unit': metered_feature.unit,
@@ -920,8 +1125,8 @@ class Subscription(models.Model):
             description = self._entry_description(context)
             unit = self._entry_unit(context)
 
-            mf = DocumentEntry.objects.create(
-                invoice=invoice, proforma=proforma,
+            mf = self._add_entry(
+                entries, invoice=invoice, proforma=proforma,
                 description=description, unit=unit,
                 quantity=consumed_units, prorated=prorated,
                 unit_price=metered_feature.price_per_unit,
@@ -960,16 +1165,15 @@ class Subscription(models.Model):
 
             return True, percent
 
+    @profiled('template_rendering')
     def _entry_unit(self, context):
-        unit_template_path = field_template_path(
-            field='entry_unit', provider=self.plan.provider.slug)
-        return render_to_string(unit_template_path, context)
+        return render_field_template('entry_unit', context,
+                                     provider=self.plan.provider.slug)
 
+    @profiled('template_rendering')
     def _entry_description(self, context):
-        description_template_path = field_template_path(
-            field='entry_description', provider=self.plan.provider.slug
-        )
-        return render_to_string(description_template_path, context)
+        return render_field_template('entry_description', context,
+                                     provider=self.plan.provider.slug)
 
     @property
     def _base_entry_context(self):
@@ -1047,3 +1251,51 @@ def cancel_billing_documents(sender, instance, **kwargs):
                     }
                 )
                 pass
+
+
+@receiver(post_save, sender=BillingLog)
+@receiver(post_delete, sender=BillingLog)
+def update_subscription_billing_state(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    instance.subscription.update_billing_state()
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_save, sender=Provider)
+def update_subscriptions_next_billing_dates(sender, instance, created=False,
+                                            update_fields=None, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    last_billing_values = instance._last_billing_values
+    billing_values = loaded_field_values(instance, instance.BILLING_FIELDS)
+    instance._last_billing_values = billing_values
+
+    if created:
+        return
+
+    saved_fields = instance.BILLING_FIELDS
+    if update_fields is not None:
+        saved_fields = set(saved_fields) & set(update_fields)
+
+    # The fields which were deferred when the instance was loaded are assumed
+    # to have changed
+    changed_fields = [field for field in saved_fields
+                      if field in billing_values and
+                      (field not in last_billing_values or
+                       last_billing_values[field] != billing_values[field])]
+    if not changed_fields:
+        return
+
+    # The billing related settings of plans can be overridden by their providers
+    plan_field = 'plan__provider' if sender is Provider else 'plan'
+
+    # Instead of being recomputed right away, the next billing dates are
+    # reset, making the subscriptions candidates for billing until the next
+    # billing run visits them and fills their dates back in
+    Subscription.objects.filter(
+        state__in=[Subscription.STATES.ACTIVE, Subscription.STATES.CANCELED],
+        **{plan_field: instance}
+    ).update(next_billing_date=None)
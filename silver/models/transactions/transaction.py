@@ -216,13 +216,15 @@ class Transaction(models.Model):
                               self.currency, self.payment_method.allowed_currencies
                           )
                 raise ValidationError(message)
+            # The document's transactions amounts are aggregated only once
+            amount_to_be_charged = self.document.amount_to_be_charged_in_transaction_currency
             if self.amount:
-                if self.amount > self.document.amount_to_be_charged_in_transaction_currency:
+                if self.amount > amount_to_be_charged:
                     message = "Amount is greater than the amount that should be charged in order " \
                               "to pay the billing document."
                     raise ValidationError(message)
             else:
-                self.amount = self.document.amount_to_be_charged_in_transaction_currency
+                self.amount = amount_to_be_charged
 
     def clean_with_previous_instance(self, previous_instance):
         if not previous_instance:
@@ -309,6 +311,13 @@ def post_transition_callback(sender, instance, name, source, target, **kwargs):
 def post_transaction_save(sender, instance, **kwargs):
     transaction = instance
 
+    # The transactions amounts of the loaded documents have changed
+    for field in ('invoice', 'proforma'):
+        if getattr(Transaction, field).is_cached(transaction):
+            document = getattr(transaction, field)
+            if document:
+                document.clear_transactions_amounts()
+
     if hasattr(transaction, '.recently_transitioned'):
         delattr(transaction, '.recently_transitioned')
         transaction.update_document_state()
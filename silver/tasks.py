@@ -1,17 +1,24 @@
-from itertools import chain
+import logging
+import sys
+from datetime import datetime, timedelta
 
-from celery import group, shared_task
+from celery import chord, group, shared_task
 from celery_once import QueueOnce
 from django.conf import settings
+from django.db import connection, transaction as db_transaction
 from django.utils import timezone
 from redis.exceptions import LockError
 
-from silver.documents_generator import DocumentsGenerator
-from silver.models import Invoice, Proforma, Transaction, BillingDocumentBase
+from silver.documents_generator import DocumentsGenerator, merge_billing_summaries
+from silver.models import BillingDocumentBase, BillingRun, QueuedPDF, Transaction
 from silver.payment_processors.mixins import PaymentProcessorTypes
+from silver.utils.pdf import get_pdf_renderer
 from silver.vendors.redis_server import redis
 
 
+logger = logging.getLogger(__name__)
+
+
 PDF_GENERATION_TIME_LIMIT = getattr(settings, 'PDF_GENERATION_TIME_LIMIT',
                                     60)  # default 60s
 
@@ -24,14 +31,110 @@ def generate_pdf(document_id, document_type):
     document.generate_pdf()
 
 
+PDF_GENERATION_BATCH_SIZE = getattr(settings, 'PDF_GENERATION_BATCH_SIZE',
+                                    20)  # default 20 PDFs
+
+PDF_BATCH_GENERATION_TIME_LIMIT = PDF_GENERATION_TIME_LIMIT * PDF_GENERATION_BATCH_SIZE
+
+
+@shared_task(time_limit=PDF_BATCH_GENERATION_TIME_LIMIT)
+def generate_pdfs_batch(document_ids):
+    """
+    Generates the dirty PDFs of the given documents within a single task,
+    resolving each template only once.
+
+    The PDFs which are left dirty (because they failed or were marked as
+    dirty meanwhile) are released from the lease taken by `generate_pdfs`.
+
+    :returns: a dict with the ids of the documents whose PDF was `generated`
+        and the errors of the `failed` ones, by document id.
+    """
+
+    documents = list(BillingDocumentBase.objects.filter(
+        id__in=document_ids, pdf__dirty__gt=0
+    ).select_related('pdf').order_by('id'))
+
+    try:
+        return _generate_pdfs(documents)
+    finally:
+        # The PDFs which were generated have been dequeued already
+        QueuedPDF.objects.filter(
+            pdf_id__in=[document.pdf_id for document in documents]
+        ).update(queued_at=timezone.now())
+
+
+def _generate_pdfs(documents):
+    renderer = get_pdf_renderer()
+    templates_cache = {}
+    result = {'generated': [], 'failed': {}}
+
+    def fail(document):
+        logger.exception('Encountered exception while generating PDF for document '
+                         'with id=%s.', document.id)
+        result['failed'][document.id] = repr(sys.exc_info()[1])
+
+    renderings = []
+    for document in documents:
+        try:
+            renderings.append((document, document.generate_pdf_async(
+                renderer=renderer, templates_cache=templates_cache
+            )))
+        except Exception:
+            fail(document)
+
+    for document, finish_rendering in renderings:
+        try:
+            finish_rendering()
+        except Exception:
+            fail(document)
+        else:
+            result['generated'].append(document.id)
+
+    return result
+
+
 @shared_task(ignore_result=True)
 def generate_pdfs():
-    dirty_documents = chain(Invoice.objects.filter(pdf__dirty__gt=0),
-                            Proforma.objects.filter(pdf__dirty__gt=0))
-
-    # Generate PDFs in parallel
-    group(generate_pdf.s(document.id, document.kind)
-          for document in dirty_documents)()
+    """
+    Drains the queue of dirty PDFs, in batches generated by `generate_pdfs_batch`
+    tasks. The dispatched PDFs are leased: they are held back in the queue
+    until their batch finishes or its time limit passes. Since the PDFs are
+    claimed under row locks, concurrent runs dispatch distinct PDFs. Where the
+    database backend supports it, the locked rows are skipped instead of being
+    waited on.
+    """
+
+    started_at = timezone.now()
+    queued_pdfs = QueuedPDF.objects.filter(queued_at__lt=started_at).order_by('queued_at')
+
+    if connection.features.has_select_for_update_skip_locked:
+        queued_pdfs = queued_pdfs.select_for_update(skip_locked=True)
+    else:
+        # The rows claimed by a concurrent run are waited on, then left out,
+        # since their lease no longer matches the filter
+        queued_pdfs = queued_pdfs.select_for_update()
+
+    while True:
+        with db_transaction.atomic():
+            pdf_ids = list(queued_pdfs.values_list('pdf_id', flat=True)
+                           [:PDF_GENERATION_BATCH_SIZE])
+            if not pdf_ids:
+                return
+
+            QueuedPDF.objects.filter(pdf_id__in=pdf_ids).update(
+                queued_at=timezone.now() + timedelta(seconds=PDF_BATCH_GENERATION_TIME_LIMIT)
+            )
+
+        documents = list(BillingDocumentBase.objects.filter(pdf_id__in=pdf_ids)
+                         .values_list('id', 'pdf_id'))
+
+        # Drop the PDFs left behind by deleted documents
+        orphaned_pdf_ids = set(pdf_ids) - set(pdf_id for _, pdf_id in documents)
+        if orphaned_pdf_ids:
+            QueuedPDF.objects.filter(pdf_id__in=orphaned_pdf_ids).delete()
+
+        if documents:
+            generate_pdfs_batch.delay([document_id for document_id, _ in documents])
 
 
 DOCS_GENERATION_TIME_LIMIT = getattr(settings, 'DOCS_GENERATION_TIME_LIMIT',
@@ -40,11 +143,134 @@ DOCS_GENERATION_TIME_LIMIT = getattr(settings, 'DOCS_GENERATION_TIME_LIMIT',
 
 @shared_task(base=QueueOnce, once={'graceful': True},
              time_limit=DOCS_GENERATION_TIME_LIMIT, ignore_result=True)
-def generate_billing_documents(billing_date=None):
-    if not billing_date:
-        billing_date = timezone.now().date()
+def generate_billing_documents(billing_date=None, billing_run_id=None):
+    """
+    Generates the billing documents within a billing run, which is checkpointed
+    after each customer. If `billing_run_id` is given, that billing run is
+    resumed. Otherwise, the unfinished billing run for the billing date, left
+    behind by an interrupted task, is resumed, if there is one.
+    """
+
+    docs_generator = DocumentsGenerator()
+
+    if billing_run_id:
+        billing_run = BillingRun.objects.get(pk=billing_run_id)
+        if billing_run.state == BillingRun.STATES.COMPLETED:
+            logger.info('Billing run with id=%s has already been completed.', billing_run_id)
+            return
+    else:
+        if not billing_date:
+            billing_date = timezone.now().date()
+
+        billing_run = docs_generator.get_billing_run(_parse_billing_date(billing_date))
+
+    docs_generator.generate_for_billing_run(billing_run)
+
+
+DOCS_GENERATION_SHARD_SIZE = getattr(settings, 'DOCS_GENERATION_SHARD_SIZE',
+                                     500)  # default 500 customers
+
+
+def _parse_billing_date(billing_date):
+    # Dates are sent as strings, since they don't survive all the serializers
+    if isinstance(billing_date, basestring):
+        return datetime.strptime(billing_date, '%Y-%m-%d').date()
+
+    return billing_date
+
+
+@shared_task(base=QueueOnce, once={'graceful': True},
+             time_limit=DOCS_GENERATION_TIME_LIMIT, ignore_result=True)
+def generate_billing_documents_sharded(billing_date=None, shard_size=None, billing_run_id=None):
+    """
+    Creates a sharded billing run, splitting the customers into shards of
+    `shard_size` customers, and generates the billing documents of each shard
+    in a separate task, so that a billing run is spread across all the
+    available workers. Each shard is a billing run, checkpointed after each
+    customer.
+
+    If `billing_run_id` is given, that sharded billing run is resumed: its
+    unfinished shards are dispatched again. Otherwise, no billing run is
+    started while a sharded run for the same billing date is unfinished, as
+    its shards may still be running (the task's lock is released as soon as
+    the shards are dispatched).
+
+    The sharded run is completed by `summarize_billing_documents_shards`,
+    which requires a Celery result backend to be configured.
+    """
+
+    docs_generator = DocumentsGenerator()
+
+    if billing_run_id:
+        billing_run = BillingRun.objects.get(pk=billing_run_id, sharded=True)
+        if billing_run.state == BillingRun.STATES.COMPLETED:
+            logger.info('Billing run with id=%s has already been completed.', billing_run_id)
+            return
+    else:
+        if not billing_date:
+            billing_date = timezone.now().date()
+        billing_date = _parse_billing_date(billing_date)
+
+        unfinished_billing_run = BillingRun.objects.filter(
+            billing_date=billing_date, sharded=True, state=BillingRun.STATES.RUNNING
+        ).first()
+        if unfinished_billing_run:
+            logger.warning('Sharded billing run with id=%s for billing_date=%s is unfinished. '
+                           'If it was interrupted, it can be resumed by its id.',
+                           unfinished_billing_run.id, billing_date)
+            return
+
+        billing_run = docs_generator.create_sharded_billing_run(
+            billing_date, shard_size or DOCS_GENERATION_SHARD_SIZE
+        )
+        if not billing_run:
+            return
+
+    shards = [
+        generate_billing_documents_shard.s(shard_id)
+        for shard_id in billing_run.shards.filter(
+            state=BillingRun.STATES.RUNNING
+        ).order_by('pk').values_list('pk', flat=True)
+    ]
+    if not shards:
+        summarize_billing_documents_shards([], billing_run.pk)
+        return
+
+    chord(shards)(summarize_billing_documents_shards.s(billing_run.pk))
+
+
+@shared_task(time_limit=DOCS_GENERATION_TIME_LIMIT)
+def generate_billing_documents_shard(billing_run_id):
+    """
+    Generates the billing documents of a shard of a sharded billing run,
+    resuming it if it was interrupted.
+    """
+
+    billing_run = BillingRun.objects.get(pk=billing_run_id)
+    if billing_run.state == BillingRun.STATES.COMPLETED:
+        return billing_run.summary
+
+    return DocumentsGenerator().generate_for_billing_run(billing_run)
+
+
+@shared_task
+def summarize_billing_documents_shards(shard_summaries, billing_run_id):
+    """
+    Completes a sharded billing run. Its summary is gathered from all of its
+    shards, including the ones completed before the run was resumed, rather
+    than from the `shard_summaries` of the dispatched shards.
+    """
+
+    billing_run = BillingRun.objects.get(pk=billing_run_id)
+    billing_run.complete_shards()
+
+    summary = merge_billing_summaries(shard.summary
+                                      for shard in billing_run.shards.order_by('pk'))
+
+    logger.info('Billing run summary: %s', dict(summary, billing_date=billing_run.billing_date,
+                                                billing_run=billing_run.pk))
 
-    DocumentsGenerator().generate(billing_date=billing_date)
+    return summary
 
 
 FETCH_TRANSACTION_STATUS_TIME_LIMIT = getattr(settings, 'FETCH_TRANSACTION_STATUS_TIME_LIMIT',
@@ -0,0 +1,57 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime as dt
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from silver.models import BillingLog, Subscription
+from silver.tests.factories import SubscriptionFactory
+
+
+class TestBackfillBillingStateCommand(TestCase):
+    def test_backfill_billing_state(self):
+        subscriptions = SubscriptionFactory.create_batch(size=3,
+                                                         start_date=dt.date(2017, 1, 1))
+        for month in (1, 2):
+            BillingLog.objects.create(subscription=subscriptions[0],
+                                      billing_date=dt.date(2017, month, 1),
+                                      plan_billed_up_to=dt.date(2017, month, 28),
+                                      metered_features_billed_up_to=dt.date(2017, month, 1))
+
+        Subscription.objects.exclude(pk=subscriptions[2].pk).update(
+            billing_logs_count=None, plan_billed_up_to=None,
+            metered_features_billed_up_to=None, latest_billing_date=None
+        )
+
+        output = StringIO()
+        call_command('backfill_billing_state', batch_size=1, stdout=output)
+
+        assert 'Populated the billing state of 2 subscriptions.' in output.getvalue()
+
+        billed_subscription, not_billed_subscription, _ = Subscription.objects.order_by('pk')
+        assert billed_subscription.billing_logs_count == 2
+        assert billed_subscription.latest_billing_date == dt.date(2017, 2, 1)
+        assert billed_subscription.plan_billed_up_to == dt.date(2017, 2, 28)
+        assert billed_subscription.metered_features_billed_up_to == dt.date(2017, 2, 1)
+
+        assert not_billed_subscription.billing_logs_count == 0
+        assert not_billed_subscription.plan_billed_up_to is None
+
+        output = StringIO()
+        call_command('backfill_billing_state', all=True, stdout=output)
+
+        assert 'Populated the billing state of 3 subscriptions.' in output.getvalue()
@@ -16,17 +16,19 @@
 from decimal import Decimal
 
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
 from django.utils.six import StringIO
 from mock import patch, PropertyMock, MagicMock
 from annoying.functions import get_object_or_None
 
 from silver.models import (Proforma, DocumentEntry, Invoice, Subscription,
-                           Customer, Plan)
+                           Customer, Plan, BillingRun)
 from silver.tests.factories import (SubscriptionFactory, PlanFactory,
                                     MeteredFeatureFactory,
                                     MeteredFeatureUnitsLogFactory,
                                     CustomerFactory, ProviderFactory)
+from silver.documents_generator import DocumentsGenerator
 from silver.management.commands.generate_docs import date as generate_docs_date
 
 
@@ -70,6 +72,93 @@ class TestGenerateDocsArguments(TestCase):
 
         assert self.output.getvalue() == self.good_output
 
+    def test_generate_docs_resume_argparser(self):
+        billing_run = BillingRun.objects.create(billing_date=self.date)
+
+        call_command('generate_docs', '--resume=%s' % billing_run.id,
+                     stdout=self.output)
+
+        assert self.output.getvalue() == self.good_output
+
+        billing_run.refresh_from_db()
+        assert billing_run.state == BillingRun.STATES.COMPLETED
+
+    def test_generate_docs_profile_argparser(self):
+        call_command('generate_docs', '--date=%s' % self.date_string, '--profile',
+                     stdout=self.output)
+
+        output = self.output.getvalue()
+        assert output.startswith(self.good_output)
+        assert 'subscriptions_selection' in output
+
+        assert BillingRun.objects.get().report['phases']
+
+    def test_generate_docs_workers_argparser(self):
+        failing_subscription = SubscriptionFactory.create(plan=self.plan, start_date=self.date)
+        failing_subscription.activate()
+        failing_subscription.save()
+        failing_customer = failing_subscription.customer
+
+        original_generate_for_customers = DocumentsGenerator.generate_for_customers
+
+        def generate_for_customers(generator, customer_ids, **kwargs):
+            if failing_customer.pk in customer_ids:
+                raise ValueError
+
+            return original_generate_for_customers(generator, customer_ids, **kwargs)
+
+        class InlinePool(object):
+            def __init__(self, processes, initializer):
+                assert processes == 2
+
+            def map(self, function, iterable):
+                return [function(item) for item in iterable]
+
+            def close(self):
+                pass
+
+            def join(self):
+                pass
+
+        with patch('silver.management.commands.generate_docs.Pool', InlinePool), \
+                patch('silver.management.commands.generate_docs.connections') as connections, \
+                patch('silver.management.commands.generate_docs.DOCS_GENERATION_BATCH_SIZE', 1), \
+                patch.object(DocumentsGenerator, 'generate_for_customers',
+                             generate_for_customers):
+            call_command('generate_docs', '--date=%s' % self.date_string, '--workers=2',
+                         stdout=self.output)
+
+        assert connections.close_all.called
+        assert self.output.getvalue() == (
+            self.good_output +
+            'Billed customers: 1, generated documents: 1, failed customers: [%s].\n' %
+            failing_customer.pk
+        )
+        assert Proforma.objects.get().customer == self.subscription.customer
+
+    def test_generate_docs_workers_must_be_positive(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_docs', '--workers=0', stdout=self.output)
+
+    def test_generate_docs_workers_with_profile(self):
+        with self.assertRaisesMessage(CommandError,
+                                      'The --profile option is not supported with --workers.'):
+            call_command('generate_docs', '--workers=2', '--profile', stdout=self.output)
+
+    def test_generate_docs_workers_with_resume(self):
+        billing_run = BillingRun.objects.create(billing_date=self.date)
+
+        with self.assertRaisesMessage(CommandError,
+                                      'The --resume option is not supported with --workers.'):
+            call_command('generate_docs', '--workers=2', '--resume=%s' % billing_run.id,
+                         stdout=self.output)
+
+    def test_generate_docs_resume_missing_billing_run(self):
+        call_command('generate_docs', '--resume=1', stdout=self.output)
+
+        assert self.output.getvalue() == \
+            'The billing run with the provided id does not exist.\n'
+
     def test_generate_docs_subscription_argparser(self):
 
         call_command(
@@ -0,0 +1,62 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+
+from mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from silver.models import Invoice, Proforma
+from silver.tests.factories import DocumentEntryFactory, InvoiceFactory, ProformaFactory
+
+
+class TestGeneratePDFsCommand(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.media_root)
+
+    def test_generate_pdfs_within_a_processes_pool(self):
+        invoice = InvoiceFactory.create()
+        proforma = ProformaFactory.create()
+        for document in (invoice, proforma):
+            DocumentEntryFactory.create(**{document.kind: document})
+            document.issue()
+
+        with override_settings(MEDIA_ROOT=self.media_root):
+            call_command('generate_pdfs', processes=2, timeout=30)
+
+            for document in (Invoice.objects.get(pk=invoice.pk),
+                             Proforma.objects.get(pk=proforma.pk)):
+                assert not document.pdf.dirty
+                assert document.pdf.pdf_file.read(5) == b'%PDF-'
+
+    def test_failed_renderings_are_logged_and_skipped(self):
+        invoices = InvoiceFactory.create_batch(size=2)
+        for invoice in invoices:
+            invoice.issue()
+
+        with override_settings(MEDIA_ROOT=self.media_root), \
+                patch('silver.management.commands.generate_pdfs.logger') as logger_mock, \
+                patch('silver.models.documents.base.BillingDocumentBase.get_template',
+                      side_effect=[ValueError, invoices[1].get_template()]):
+            call_command('generate_pdfs', processes=0)
+
+        assert logger_mock.exception.call_count == 1
+        assert Invoice.objects.get(pk=invoices[0].pk).pdf.dirty
+        assert not Invoice.objects.get(pk=invoices[1].pk).pdf.dirty
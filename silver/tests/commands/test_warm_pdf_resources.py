@@ -0,0 +1,50 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from django.core.management import call_command, CommandError
+from django.test import SimpleTestCase, override_settings
+from django.utils.six import StringIO
+
+from silver.utils.pdf import ResourcesCache
+
+
+class TestWarmPDFResourcesCommand(SimpleTestCase):
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+
+        with open(os.path.join(self.static_root, 'logo.png'), 'wb') as logo_file:
+            logo_file.write(b'\x89PNG logo')
+
+    def tearDown(self):
+        shutil.rmtree(self.static_root)
+
+    def test_warm_pdf_resources(self):
+        cache = ResourcesCache()
+        output = StringIO()
+
+        with override_settings(STATIC_ROOT=self.static_root, STATIC_URL='/static/'), \
+                patch('silver.utils.pdf.PDF_PRELOADED_RESOURCES', ['/static/logo.png']), \
+                patch('silver.management.commands.warm_pdf_resources.resources_cache', cache):
+            call_command('warm_pdf_resources', stdout=output)
+
+            assert '/static/logo.png' in cache
+            assert output.getvalue() == 'Cached 1 resources (34 bytes).\n'
+
+            with self.assertRaisesMessage(CommandError, 'Missing resources: /static/missing.png'):
+                call_command('warm_pdf_resources', '/static/missing.png', stdout=output)
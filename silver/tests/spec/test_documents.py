@@ -12,17 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
-
 from mock import patch
 from freezegun import freeze_time
 
+from django.db import connection
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
+from silver.models import BillingDocumentBase
 from silver.tests.factories import (ProformaFactory, AdminUserFactory,
                                     InvoiceFactory, TransactionFactory,
                                     PaymentMethodFactory, DocumentEntryFactory)
@@ -93,7 +94,13 @@ class TestDocumentEndpoints(APITestCase):
             u'pdf_url': build_absolute_test_url(document.pdf.url) if (document.pdf and
                                                                       document.pdf.url) else None,
             u'transactions': transactions,
-            u'total_in_transaction_currency': document.total_in_transaction_currency
+            u'total_in_transaction_currency': document.total_in_transaction_currency,
+            u'amount_paid_in_transaction_currency':
+                document.amount_paid_in_transaction_currency,
+            u'amount_pending_in_transaction_currency':
+                document.amount_pending_in_transaction_currency,
+            u'amount_to_be_charged_in_transaction_currency':
+                document.amount_to_be_charged_in_transaction_currency
         }
 
     def _jwt_token(self, *args, **kwargs):
@@ -143,7 +150,7 @@ class TestDocumentEndpoints(APITestCase):
         response = self.client.get(url)
 
         # ^ there's a bug where specifying format='json' doesn't work
-        response_data = json.loads(json.dumps(response.data))
+        response_data = response.data
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response_data), 2)
@@ -151,3 +158,65 @@ class TestDocumentEndpoints(APITestCase):
         self.assertIn(self._get_expected_data(invoice1), response_data)
 
         self.assertIn(self._get_expected_data(invoice2), response_data)
+
+    def test_documents_list_totals_are_computed_by_the_database(self):
+        def create_drafts(count):
+            for proforma in ProformaFactory.create_batch(size=count):
+                DocumentEntryFactory.create_batch(size=3, proforma=proforma)
+
+            # Drafts whose totals aren't persisted yet
+            BillingDocumentBase.objects.update(_total=None,
+                                               _total_in_transaction_currency=None)
+
+        url = reverse('document-list')
+
+        create_drafts(1)
+        with CaptureQueriesContext(connection) as few_documents_queries:
+            self.client.get(url)
+
+        create_drafts(5)
+        with CaptureQueriesContext(connection) as many_documents_queries:
+            response = self.client.get(url)
+
+        assert len(response.data) == 6
+
+        def entries_queries(queries):
+            return [query for query in queries
+                    if query['sql'].startswith('SELECT "silver_documententry"')]
+
+        # The totals are computed within the documents query
+        assert not entries_queries(few_documents_queries)
+        assert not entries_queries(many_documents_queries)
+
+        for document_data in response.data:
+            document = BillingDocumentBase.objects.get(pk=document_data['id'])
+            assert document_data['total'] == sum(entry.total for entry in document.entries)
+
+    def test_documents_list_transactions_amounts_are_computed_by_the_database(self):
+        invoices = InvoiceFactory.create_batch(size=3)
+        for invoice in invoices:
+            DocumentEntryFactory.create(invoice=invoice)
+            invoice.issue()
+
+            payment_method = PaymentMethodFactory.create(customer=invoice.customer)
+            TransactionFactory.create(payment_method=payment_method, invoice=invoice,
+                                      amount=invoice.total_in_transaction_currency / 2)
+
+        url = reverse('document-list')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        assert len(response.data) == 3
+
+        # The amounts are computed within the documents query
+        assert not [query for query in queries if 'AS "charged"' in query['sql']]
+
+        for document_data in response.data:
+            document = BillingDocumentBase.objects.get(pk=document_data['id'])
+            assert document_data['amount_pending_in_transaction_currency'] == \
+                document.amount_pending_in_transaction_currency
+            assert document_data['amount_to_be_charged_in_transaction_currency'] == \
+                document.amount_to_be_charged_in_transaction_currency
+            assert document.amount_to_be_charged_in_transaction_currency != \
+                document.total_in_transaction_currency
@@ -24,7 +24,9 @@ from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
+from django.db import connection
 from django.db.models.signals import pre_save
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.conf import settings
 
@@ -345,6 +347,49 @@ class TestInvoiceEndpoints(APITestCase):
         invoice_entries = response.data.get('invoice_entries', None)
         self.assertEqual(len(invoice_entries), entries_count)
 
+    def test_add_invoice_entries_in_bulk(self):
+        invoice = InvoiceFactory.create()
+
+        url = reverse('invoice-entry-create', kwargs={'document_pk': invoice.pk})
+        entries_data = [
+            {"description": "Page views", "unit_price": 10.0, "quantity": 20},
+            {"description": "Visitors", "unit_price": 0.5, "quantity": 3}
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data=json.dumps(entries_data),
+                                        content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        assert [entry['total_before_tax'] for entry in response.data] == [
+            Decimal('200.00'), Decimal('1.50')
+        ]
+
+        entries_inserts = [query for query in queries
+                           if query['sql'].startswith('INSERT INTO "silver_documententry"')]
+        assert len(entries_inserts) == 1
+
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        assert invoice.invoice_entries.count() == 2
+        assert invoice.total_before_tax == Decimal('201.50')
+        assert invoice.total == sum(entry.total for entry in invoice.entries)
+
+    def test_add_invoice_entries_in_bulk_validates_all_the_entries(self):
+        invoice = InvoiceFactory.create()
+
+        url = reverse('invoice-entry-create', kwargs={'document_pk': invoice.pk})
+        entries_data = [
+            {"description": "Page views", "unit_price": 10.0, "quantity": 20},
+            {"description": "Visitors", "unit_price": 0.5}
+        ]
+
+        response = self.client.post(url, data=json.dumps(entries_data),
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        assert response.data == [{}, {'quantity': ['This field is required.']}]
+        assert not invoice.invoice_entries.exists()
+
     def test_delete_invoice_entry(self):
         invoice = InvoiceFactory.create()
 
@@ -807,3 +852,61 @@ class TestInvoiceEndpoints(APITestCase):
 
         assert response.status_code == status.HTTP_403_FORBIDDEN
         assert response.data == {'detail': 'Illegal state value.'}
+
+    def test_bulk_issue_invoices(self):
+        provider = ProviderFactory.create()
+        customer = CustomerFactory.create()
+        invoices = InvoiceFactory.create_batch(size=3, provider=provider, customer=customer)
+        invoices[1].issue()
+
+        url = reverse('invoice-bulk-state')
+        data = {
+            'state': 'issued',
+            'ids': [invoice.pk for invoice in invoices] + [1000],
+            'issue_date': '2014-01-01'
+        }
+
+        with patch('silver.models.documents.base.DOCUMENTS_TRANSITION_BATCH_SIZE', 2):
+            response = self.client.put(url, data=json.dumps(data),
+                                       content_type='application/json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == [
+            {'id': invoices[0].pk, 'state': 'issued'},
+            {'id': invoices[1].pk,
+             'detail': 'An invoice can be issued only if it is in draft state.'},
+            {'id': invoices[2].pk, 'state': 'issued'},
+            {'id': 1000, 'detail': 'Invoice not found.'}
+        ]
+
+        for invoice in (invoices[0], invoices[2]):
+            invoice = Invoice.objects.get(pk=invoice.pk)
+            assert invoice.state == Invoice.STATES.ISSUED
+            assert str(invoice.issue_date) == '2014-01-01'
+            assert invoice.number
+
+    def test_bulk_state_change_requires_the_state_and_the_ids(self):
+        url = reverse('invoice-bulk-state')
+
+        response = self.client.put(url, data=json.dumps({'ids': [1]}),
+                                   content_type='application/json')
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+        assert response.data == {'detail': 'You have to provide a value for the state field.'}
+
+        response = self.client.put(url, data=json.dumps({'state': 'draft', 'ids': [1]}),
+                                   content_type='application/json')
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+        assert response.data == {'detail': 'Illegal state value.'}
+
+        response = self.client.put(url, data=json.dumps({'state': 'paid', 'ids': 'a'}),
+                                   content_type='application/json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data == {'detail': 'You have to provide a list of invoice ids.'}
+
+        response = self.client.put(url, data=json.dumps({'state': 'issued', 'ids': [1],
+                                                          'issue_date': '17/10/2026'}),
+                                   content_type='application/json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data == {
+            'detail': 'Invalid issue_date value, a YYYY-MM-DD date is expected.'
+        }
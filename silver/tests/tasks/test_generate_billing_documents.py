@@ -0,0 +1,256 @@
+import datetime as dt
+from decimal import Decimal
+
+import pytest
+from mock import patch, MagicMock
+
+from silver.documents_generator import DocumentsGenerator
+from silver.models import BillingRun, Proforma, Subscription
+from silver.tasks import (generate_billing_documents, generate_billing_documents_sharded,
+                          generate_billing_documents_shard, summarize_billing_documents_shards)
+from silver.tests.factories import CustomerFactory, PlanFactory, SubscriptionFactory
+
+
+def create_billable_customer(start_date):
+    customer = CustomerFactory.create()
+    plan = PlanFactory.create(interval='month', interval_count=1, generate_after=0,
+                              amount=Decimal('100.00'))
+
+    subscription = SubscriptionFactory.create(plan=plan, customer=customer,
+                                              start_date=start_date)
+    subscription.activate()
+    subscription.save()
+
+    return customer
+
+
+@pytest.mark.django_db
+def test_generate_billing_documents_task_checkpoints_billing_run():
+    customers = [create_billable_customer(dt.date(2017, 1, 1)) for _ in range(2)]
+
+    generate_billing_documents(billing_date=dt.date(2017, 1, 1))
+
+    billing_run = BillingRun.objects.get()
+    assert billing_run.state == BillingRun.STATES.COMPLETED
+    assert billing_run.finished_at
+    assert billing_run.last_customer_id == customers[-1].pk
+    assert billing_run.summary == {
+        'customers': 2,
+        'documents': 2,
+        'failed_customers': []
+    }
+    assert Proforma.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_generate_billing_documents_task_resumes_interrupted_billing_run():
+    billed_customer, interrupted_customer, not_billed_customer = [
+        create_billable_customer(dt.date(2017, 1, 1)) for _ in range(3)
+    ]
+
+    original_generate_for_customer = DocumentsGenerator._generate_for_customer
+
+    def generate_for_customer(self, customer, *args, **kwargs):
+        if customer == interrupted_customer:
+            raise SystemExit  # e.g. the task's time limit was hit
+
+        return original_generate_for_customer(self, customer, *args, **kwargs)
+
+    with patch.object(DocumentsGenerator, '_generate_for_customer', generate_for_customer):
+        with pytest.raises(SystemExit):
+            generate_billing_documents(billing_date='2017-01-01')
+
+    billing_run = BillingRun.objects.get()
+    assert billing_run.state == BillingRun.STATES.RUNNING
+    assert billing_run.last_customer_id == billed_customer.pk
+
+    with patch.object(DocumentsGenerator, '_generate_for_customer',
+                      autospec=True, side_effect=original_generate_for_customer) as generate_mock:
+        generate_billing_documents(billing_run_id=billing_run.id)
+
+    # The already billed customer was not visited again
+    assert [call[0][1] for call in generate_mock.call_args_list] == [
+        interrupted_customer, not_billed_customer
+    ]
+
+    billing_run.refresh_from_db()
+    assert billing_run.state == BillingRun.STATES.COMPLETED
+    assert billing_run.customers == 3
+    assert Proforma.objects.count() == 3
+
+    # Completed billing runs are not resumed
+    generate_billing_documents(billing_run_id=billing_run.id)
+    assert Proforma.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_generate_billing_documents_task_resumes_unfinished_billing_run_by_date():
+    customer = create_billable_customer(dt.date(2017, 1, 1))
+    billing_run = BillingRun.objects.create(billing_date=dt.date(2017, 1, 1),
+                                            last_customer_id=customer.pk)
+
+    generate_billing_documents(billing_date='2017-01-01')
+
+    assert BillingRun.objects.get() == billing_run
+    assert not Proforma.objects.exists()
+
+
+@pytest.mark.django_db
+def test_generate_billing_documents_sharded_task():
+    customers = [create_billable_customer(dt.date(2016, 12, 1)) for _ in range(5)]
+    # Customers without due subscriptions are not sharded
+    CustomerFactory.create()
+    create_billable_customer(dt.date(2017, 2, 1))
+
+    chord_mock = MagicMock()
+    with patch('silver.tasks.chord', chord_mock):
+        generate_billing_documents_sharded(billing_date=dt.date(2017, 1, 1),
+                                           shard_size=2)
+
+    billing_run = BillingRun.objects.get(sharded=True)
+    assert billing_run.state == BillingRun.STATES.RUNNING
+    assert billing_run.billing_date == dt.date(2017, 1, 1)
+
+    shard_runs = list(billing_run.shards.order_by('pk'))
+    assert [shard_run.customer_ids for shard_run in shard_runs] == [
+        [customers[0].pk, customers[1].pk],
+        [customers[2].pk, customers[3].pk],
+        [customers[4].pk],
+    ]
+
+    shards = chord_mock.call_args[0][0]
+    assert [shard.args for shard in shards] == [(shard_run.pk, ) for shard_run in shard_runs]
+
+    callback = chord_mock.return_value.call_args[0][0]
+    assert callback.args == (billing_run.pk, )
+
+    # No other run is started while the shards may still be running
+    chord_mock.reset_mock()
+    with patch('silver.tasks.chord', chord_mock):
+        generate_billing_documents_sharded(billing_date='2017-01-01', shard_size=2)
+
+    assert not chord_mock.called
+    assert BillingRun.objects.filter(sharded=True).count() == 1
+
+
+@pytest.mark.django_db
+def test_generate_billing_documents_sharded_task_resumes_billing_run():
+    customers = [create_billable_customer(dt.date(2016, 12, 1)) for _ in range(3)]
+
+    with patch('silver.tasks.chord'):
+        generate_billing_documents_sharded(billing_date=dt.date(2017, 1, 1), shard_size=2)
+
+    billing_run = BillingRun.objects.get(sharded=True)
+    completed_shard, interrupted_shard = billing_run.shards.order_by('pk')
+
+    generate_billing_documents_shard(completed_shard.pk)
+
+    chord_mock = MagicMock()
+    with patch('silver.tasks.chord', chord_mock):
+        generate_billing_documents_sharded(billing_run_id=billing_run.pk)
+
+    # Only the unfinished shard is dispatched again
+    shards = chord_mock.call_args[0][0]
+    assert [shard.args for shard in shards] == [(interrupted_shard.pk, )]
+
+    generate_billing_documents_shard(interrupted_shard.pk)
+    summary = summarize_billing_documents_shards([], billing_run.pk)
+
+    assert summary == {
+        'shards': 2,
+        'customers': 3,
+        'documents': 3,
+        'failed_customers': []
+    }
+
+    billing_run.refresh_from_db()
+    assert billing_run.state == BillingRun.STATES.COMPLETED
+    assert billing_run.summary == {
+        'customers': 3,
+        'documents': 3,
+        'failed_customers': []
+    }
+    assert Proforma.objects.filter(customer__in=customers).count() == 3
+
+    # Shards aren't resumed as regular billing runs
+    assert DocumentsGenerator().get_billing_run(dt.date(2017, 1, 1)) not in \
+        billing_run.shards.all()
+
+
+def create_shard(customers, billing_date=dt.date(2017, 1, 1)):
+    billing_run = BillingRun.objects.create(billing_date=billing_date, sharded=True)
+
+    return BillingRun.objects.create(billing_date=billing_date, parent=billing_run,
+                                     customer_ids=[customer.pk for customer in customers])
+
+
+@pytest.mark.django_db
+def test_generate_billing_documents_shard_task():
+    start_date = dt.date(2017, 1, 1)
+    billed_customer = create_billable_customer(start_date)
+    not_billed_customer = create_billable_customer(start_date)
+
+    shard = create_shard([billed_customer])
+    summary = generate_billing_documents_shard(shard.pk)
+
+    assert summary == {
+        'customers': 1,
+        'documents': 1,
+        'failed_customers': []
+    }
+    assert Proforma.objects.filter(customer=billed_customer).count() == 1
+    assert Proforma.objects.filter(customer=not_billed_customer).count() == 0
+
+    shard.refresh_from_db()
+    assert shard.state == BillingRun.STATES.COMPLETED
+    assert shard.last_customer_id == billed_customer.pk
+
+
+@pytest.mark.django_db
+def test_generate_billing_documents_shard_task_isolates_failing_customers():
+    start_date = dt.date(2017, 1, 1)
+    failing_customer = create_billable_customer(start_date)
+    billed_customer = create_billable_customer(start_date)
+
+    original_add_cycles = DocumentsGenerator.add_subscription_cycles_to_document
+
+    def add_cycles(self, subscription, **kwargs):
+        if subscription.customer == failing_customer:
+            raise ValueError
+
+        return original_add_cycles(self, subscription=subscription, **kwargs)
+
+    shard = create_shard([failing_customer, billed_customer])
+    with patch.object(DocumentsGenerator, 'add_subscription_cycles_to_document', add_cycles):
+        summary = generate_billing_documents_shard(shard.pk)
+
+    assert summary == {
+        'customers': 1,
+        'documents': 1,
+        'failed_customers': [failing_customer.pk]
+    }
+
+    # The documents of the failing customer were rolled back
+    assert Proforma.objects.filter(customer=failing_customer).count() == 0
+    assert Proforma.objects.filter(customer=billed_customer).count() == 1
+    assert not Subscription.objects.get(customer=failing_customer).billing_logs.exists()
+
+
+@pytest.mark.django_db
+def test_summarize_billing_documents_shards_task():
+    billing_run = BillingRun.objects.create(billing_date=dt.date(2017, 1, 1), sharded=True)
+    BillingRun.objects.create(billing_date=dt.date(2017, 1, 1), parent=billing_run,
+                              customer_ids=[1, 2], customers=2, documents=3)
+    BillingRun.objects.create(billing_date=dt.date(2017, 1, 1), parent=billing_run,
+                              customer_ids=[7], documents=1, customers=1, failed_customers=[7])
+
+    assert summarize_billing_documents_shards([], billing_run.pk) == {
+        'shards': 2,
+        'customers': 3,
+        'documents': 4,
+        'failed_customers': [7]
+    }
+
+    billing_run.refresh_from_db()
+    assert billing_run.state == BillingRun.STATES.COMPLETED
+    assert billing_run.documents == 4
@@ -1,7 +1,12 @@
 import pytest
-from mock import patch, call, MagicMock
+from mock import ANY, patch, call, MagicMock
 
-from silver.tasks import generate_pdfs, generate_pdf
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test.utils import CaptureQueriesContext
+
+from silver.models import QueuedPDF
+from silver.tasks import generate_pdfs, generate_pdf, generate_pdfs_batch
 from silver.tests.factories import InvoiceFactory, ProformaFactory
 
 from silver.utils.pdf import fetch_resources
@@ -22,16 +27,14 @@ def test_generate_pdfs_task(monkeypatch):
 
     issued_invoice_already_generated = InvoiceFactory.create()
     issued_invoice_already_generated.issue()
-    issued_invoice_already_generated.pdf.dirty = False
-    issued_invoice_already_generated.pdf.save()
+    issued_invoice_already_generated.pdf.mark_as_clean()
 
     issued_proforma = ProformaFactory.create()
     issued_proforma.issue()
 
     issued_proforma_already_generated = ProformaFactory.create()
     issued_proforma_already_generated.issue()
-    issued_proforma_already_generated.pdf.dirty = False
-    issued_proforma_already_generated.pdf.save()
+    issued_proforma_already_generated.pdf.mark_as_clean()
 
     documents_to_generate = [issued_invoice, canceled_invoice, paid_invoice,
                              issued_proforma]
@@ -42,17 +45,99 @@ def test_generate_pdfs_task(monkeypatch):
     lock_mock = MagicMock()
     monkeypatch.setattr('silver.tasks.redis.lock', lock_mock)
 
-    with patch('silver.tasks.group') as group_mock:
+    with patch('silver.tasks.generate_pdfs_batch.delay') as batch_mock:
+        generate_pdfs()
+
+        assert batch_mock.call_count
+
+        dispatched_documents = set(
+            document_id
+            for call_args in batch_mock.call_args_list
+            for document_id in call_args[0][0]
+        )
+        assert dispatched_documents == set(
+            document.id for document in documents_to_generate
+        )
+
+
+@pytest.mark.django_db
+def test_generate_pdfs_task_drains_the_queue_in_batches(monkeypatch):
+    monkeypatch.setattr('silver.tasks.PDF_GENERATION_BATCH_SIZE', 2)
+
+    invoices = InvoiceFactory.create_batch(5)
+    for invoice in invoices:
+        invoice.issue()
+
+    assert QueuedPDF.objects.count() == 5
+
+    with patch('silver.tasks.generate_pdfs_batch.delay') as batch_mock:
+        generate_pdfs()
+
+        assert batch_mock.call_count == 3
+
+        # The dispatched PDFs stay queued until they are generated, but they
+        # aren't dispatched again until their batch's time limit passes
+        assert QueuedPDF.objects.count() == 5
+
         generate_pdfs()
 
-        assert group_mock.call_count
+        assert batch_mock.call_count == 3
+
+    for invoice in invoices[:3]:
+        invoice.pdf.mark_as_clean()
+
+    assert set(QueuedPDF.objects.values_list('pdf_id', flat=True)) == set(
+        invoice.pdf_id for invoice in invoices[3:]
+    )
+
+    QueuedPDF.objects.all().delete()
+
+    with patch('silver.tasks.generate_pdfs_batch.delay') as batch_mock, \
+            CaptureQueriesContext(connection) as queries:
+        generate_pdfs()
+
+        assert not batch_mock.called
+        # Besides the claiming transaction's savepoint
+        assert len([query for query in queries if 'SAVEPOINT' not in query['sql']]) == 1
+
+
+@pytest.mark.django_db
+def test_generate_pdfs_task_without_skip_locked_support(monkeypatch):
+    monkeypatch.setattr(connection.features, 'has_select_for_update_skip_locked', False)
+
+    invoices = InvoiceFactory.create_batch(2)
+    for invoice in invoices:
+        invoice.issue()
+
+    claiming_querysets = []
+    select_for_update = QuerySet.select_for_update
+
+    def claim(queryset, *args, **kwargs):
+        claiming_querysets.append(select_for_update(queryset, *args, **kwargs))
+        return claiming_querysets[-1]
+
+    with patch('silver.tasks.generate_pdfs_batch.delay') as batch_mock, \
+            patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=claim):
+        generate_pdfs()
+
+        assert set(batch_mock.call_args[0][0]) == set(invoice.id for invoice in invoices)
+
+        # The claimed PDFs are leased
+        generate_pdfs()
+
+        assert batch_mock.call_count == 1
+
+    # On a backend locking rows, but not skipping the locked ones, such as
+    # MySQL, the claiming query is still valid
+    monkeypatch.setattr(connection.features, 'has_select_for_update', True)
+
+    for queryset in claiming_querysets:
+        assert 'FOR UPDATE' in str(queryset.query)
 
 
 @pytest.mark.django_db
 @patch('silver.models.documents.base.BillingDocumentBase.get_template')
-@patch('silver.models.documents.pdf.HttpResponse')
-def test_generate_pdf_task(mock_http_response, mock_get_template, settings,
-                           tmpdir, monkeypatch):
+def test_generate_pdf_task(mock_get_template, settings, tmpdir, monkeypatch):
     settings.MEDIA_ROOT = tmpdir.strpath
 
     invoice = InvoiceFactory.create()
@@ -62,7 +147,7 @@ def test_generate_pdf_task(mock_http_response, mock_get_template, settings,
 
     pisa_document_mock = MagicMock()
 
-    monkeypatch.setattr('silver.models.documents.pdf.pisa.pisaDocument',
+    monkeypatch.setattr('silver.utils.pdf.pisa.pisaDocument',
                         pisa_document_mock)
 
     generate_pdf(invoice.id, invoice.kind)
@@ -77,6 +162,107 @@ def test_generate_pdf_task(mock_http_response, mock_get_template, settings,
 
     assert pisa_document_mock.call_count == 1
     pisa_document_mock.assert_called_once_with(src=mock_get_template().render().encode('UTF-8'),
-                                               dest=mock_http_response(),
+                                               dest=ANY,
                                                encoding='UTF-8',
                                                link_callback=fetch_resources)
+
+
+@pytest.mark.django_db
+@patch('silver.models.documents.base.BillingDocumentBase.get_template')
+def test_generate_pdf_task_skips_unchanged_content(mock_get_template, settings, tmpdir,
+                                                   monkeypatch):
+    settings.MEDIA_ROOT = tmpdir.strpath
+    mock_get_template.return_value.render.return_value = u'<html>issued</html>'
+
+    invoice = InvoiceFactory.create()
+    invoice.issue()
+
+    pisa_document_mock = MagicMock()
+    monkeypatch.setattr('silver.utils.pdf.pisa.pisaDocument',
+                        pisa_document_mock)
+
+    generate_pdf(invoice.id, invoice.kind)
+    assert pisa_document_mock.call_count == 1
+
+    invoice.pay()
+    invoice.pdf.refresh_from_db()
+    assert invoice.pdf.dirty
+
+    with patch('silver.models.documents.pdf.PDF.upload') as upload_mock:
+        generate_pdf(invoice.id, invoice.kind)
+
+        assert not upload_mock.called
+
+    invoice.pdf.refresh_from_db()
+    assert not invoice.pdf.dirty
+    assert pisa_document_mock.call_count == 1
+
+    mock_get_template.return_value.render.return_value = u'<html>paid</html>'
+    invoice.pdf.mark_as_dirty()
+
+    generate_pdf(invoice.id, invoice.kind)
+
+    invoice.pdf.refresh_from_db()
+    assert not invoice.pdf.dirty
+    assert pisa_document_mock.call_count == 2
+
+
+@pytest.mark.django_db
+def test_generate_pdfs_batch_task(settings, tmpdir, monkeypatch):
+    settings.MEDIA_ROOT = tmpdir.strpath
+
+    invoices = InvoiceFactory.create_batch(3)
+    for invoice in invoices:
+        invoice.provider = invoices[0].provider
+        invoice.issue()
+        invoice.save()
+
+    already_generated_invoice = invoices[2]
+    already_generated_invoice.pdf.mark_as_clean()
+
+    monkeypatch.setattr('silver.utils.pdf.pisa.pisaDocument', MagicMock())
+
+    with patch('silver.models.documents.base.select_template') as select_template_mock, \
+            patch('silver.models.documents.pdf.PDF.upload',
+                  side_effect=[None, IOError('Storage unavailable.')]):
+        result = generate_pdfs_batch([invoice.id for invoice in invoices])
+
+        # The invoices share the same templates
+        assert select_template_mock.call_count == 1
+
+    assert result == {
+        'generated': [invoices[0].id],
+        'failed': {invoices[1].id: repr(IOError('Storage unavailable.'))}
+    }
+
+    for invoice in invoices:
+        invoice.pdf.refresh_from_db()
+
+    assert not invoices[0].pdf.dirty
+    assert invoices[1].pdf.dirty
+    assert QueuedPDF.objects.filter(pdf_id=invoices[1].pdf_id).exists()
+
+
+@pytest.mark.django_db
+def test_generate_pdfs_batch_task_releases_the_failed_pdfs(monkeypatch):
+    invoices = InvoiceFactory.create_batch(2)
+    for invoice in invoices:
+        invoice.issue()
+
+    with patch('silver.tasks.generate_pdfs_batch.delay') as batch_mock:
+        generate_pdfs()
+
+    document_ids = batch_mock.call_args[0][0]
+
+    with patch('silver.models.documents.base.BillingDocumentBase.generate_pdf_async',
+               side_effect=IOError('Storage unavailable.')):
+        result = generate_pdfs_batch(document_ids)
+
+    assert set(result['failed']) == set(document_ids)
+
+    # The failed PDFs are dispatched again by the next run, without waiting
+    # for the batch's time limit to pass
+    with patch('silver.tasks.generate_pdfs_batch.delay') as batch_mock:
+        generate_pdfs()
+
+    assert batch_mock.call_args[0][0] == document_ids
@@ -0,0 +1,102 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime as dt
+
+from dateutil import rrule
+from django.test import TestCase
+from mock import patch
+
+from silver.models import Plan
+from silver.tests.factories import PlanFactory, SubscriptionFactory
+from silver.utils.dates import first_aligned_date, last_cycle_start_date
+
+
+RRULE_RULES = {
+    'day': {'freq': rrule.DAILY},
+    'week': {'freq': rrule.WEEKLY, 'byweekday': 0},
+    'month': {'freq': rrule.MONTHLY, 'bymonthday': 1},
+    'year': {'freq': rrule.YEARLY, 'bymonth': 1, 'bymonthday': 1},
+}
+
+
+def rrule_last_cycle_start_date(range_start, range_end, interval, interval_count):
+    """
+    The rrule based implementation the cycle dates used to be computed with.
+    """
+
+    rules = RRULE_RULES[interval]
+    aligned_start_date = list(
+        rrule.rrule(count=1, dtstart=range_start, **rules)
+    )[-1].date()
+
+    relative_start_date = range_start if aligned_start_date > range_end else aligned_start_date
+
+    dates = list(
+        rrule.rrule(rules['freq'], dtstart=relative_start_date, interval=interval_count,
+                    until=range_end)
+    )
+
+    return aligned_start_date if not dates else dates[-1].date()
+
+
+def dates_range(start_date, days, step=1):
+    return [start_date + dt.timedelta(days=day) for day in range(0, days, step)]
+
+
+class TestCycleDates(TestCase):
+    def test_first_aligned_date(self):
+        assert first_aligned_date(dt.date(2017, 1, 1), 'month') == dt.date(2017, 1, 1)
+        assert first_aligned_date(dt.date(2017, 1, 2), 'month') == dt.date(2017, 2, 1)
+        assert first_aligned_date(dt.date(2017, 12, 31), 'month') == dt.date(2018, 1, 1)
+        assert first_aligned_date(dt.date(2018, 1, 1), 'week') == dt.date(2018, 1, 1)
+        assert first_aligned_date(dt.date(2018, 1, 2), 'week') == dt.date(2018, 1, 8)
+        assert first_aligned_date(dt.date(2016, 2, 29), 'year') == dt.date(2017, 1, 1)
+        assert first_aligned_date(dt.date(2016, 2, 29), 'day') == dt.date(2016, 2, 29)
+
+    def test_last_cycle_start_date_matches_rrule(self):
+        range_starts = dates_range(dt.date(2015, 12, 25), 70, step=3)
+
+        for interval in ('day', 'week', 'month', 'year'):
+            for interval_count in (1, 2, 3, 5):
+                for range_start in range_starts:
+                    range_ends = dates_range(range_start, 3 * 366, step=37)
+
+                    for range_end in range_ends:
+                        expected = rrule_last_cycle_start_date(range_start, range_end,
+                                                               interval, interval_count)
+                        assert last_cycle_start_date(
+                            range_start, range_end, interval, interval_count
+                        ) == expected, (range_start, range_end, interval, interval_count)
+
+    def test_cycle_dates_are_memoized(self):
+        plan = PlanFactory.create(interval=Plan.INTERVALS.MONTH, interval_count=1)
+        subscription = SubscriptionFactory.create(plan=plan, start_date=dt.date(2015, 1, 1))
+        reference_date = dt.date(2017, 3, 15)
+
+        with patch('silver.models.subscriptions.last_cycle_start_date',
+                   wraps=last_cycle_start_date) as last_cycle_start_date_mock:
+            assert subscription.cycle_start_date(reference_date) == dt.date(2017, 3, 1)
+            assert subscription.cycle_start_date(reference_date) == dt.date(2017, 3, 1)
+            assert last_cycle_start_date_mock.call_count == 1
+
+            # Changing the subscription invalidates the memoized dates
+            subscription.start_date = dt.date(2017, 3, 10)
+            assert subscription.cycle_start_date(reference_date) == dt.date(2017, 3, 10)
+            assert last_cycle_start_date_mock.call_count == 2
+
+            plan.interval = Plan.INTERVALS.YEAR
+            assert subscription.cycle_start_date(reference_date) == dt.date(2017, 3, 10)
+            assert last_cycle_start_date_mock.call_count == 3
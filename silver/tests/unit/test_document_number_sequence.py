@@ -0,0 +1,150 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import patch
+
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from silver.models import BillingDocumentBase, DocumentNumberSequence, Invoice, Proforma
+from silver.tests.factories import InvoiceFactory, ProformaFactory, ProviderFactory
+
+
+class TestDocumentNumberSequence(TestCase):
+    def test_numbers_respect_the_starting_numbers(self):
+        provider = ProviderFactory.create(invoice_starting_number=10,
+                                          proforma_starting_number=20)
+
+        invoices = InvoiceFactory.create_batch(size=2, provider=provider)
+        proforma = ProformaFactory.create(provider=provider)
+        for document in invoices + [proforma]:
+            document.issue()
+            document.save()
+
+        assert [invoice.number for invoice in invoices] == [10, 11]
+        assert proforma.number == 20
+
+        provider.invoice_starting_number = 100
+        provider.save()
+
+        invoice = InvoiceFactory.create(provider=provider)
+        invoice.issue()
+        invoice.save()
+        assert invoice.number == 100
+
+        other_series_invoice = InvoiceFactory.create(provider=provider, series='Other')
+        other_series_invoice.issue()
+        other_series_invoice.save()
+        assert other_series_invoice.number == 1
+
+    def test_sequences_are_initialized_from_the_existing_documents(self):
+        provider = ProviderFactory.create()
+        InvoiceFactory.create(provider=provider, number=41, state=Invoice.STATES.ISSUED)
+        DocumentNumberSequence.objects.all().delete()
+
+        invoice = InvoiceFactory.create(provider=provider)
+        invoice.issue()
+        invoice.save()
+        assert invoice.number == 42
+
+        with CaptureQueriesContext(connection) as queries:
+            invoice = InvoiceFactory.create(provider=provider)
+            invoice.issue()
+            invoice.save()
+
+        assert invoice.number == 43
+        assert not [query for query in queries if 'MAX(' in query['sql']]
+
+    def test_explicit_numbers_are_not_reserved_again(self):
+        provider = ProviderFactory.create()
+
+        invoice = InvoiceFactory.create(provider=provider)
+        invoice.issue()
+        invoice.save()
+        assert invoice.number == 1
+
+        invoice = InvoiceFactory.create(provider=provider, number=7)
+        invoice.issue()
+        invoice.save()
+
+        invoice = InvoiceFactory.create(provider=provider)
+        invoice.issue()
+        invoice.save()
+        assert invoice.number == 8
+
+    def test_numbers_are_given_back_when_the_save_fails(self):
+        provider = ProviderFactory.create()
+        invoice = InvoiceFactory.create(provider=provider)
+
+        # The PDF is created after the number is reserved
+        with patch('silver.models.documents.base.PDF.objects.create',
+                   side_effect=DatabaseError('The save failed.')):
+            with self.assertRaises(DatabaseError):
+                invoice.issue()
+
+        assert invoice.number is None
+
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        invoice.issue()
+        invoice.save()
+        assert invoice.number == 1
+
+    def test_reserve_numbers(self):
+        provider = ProviderFactory.create(invoice_starting_number=5)
+        invoices = InvoiceFactory.create_batch(size=3, provider=provider)
+        proformas = ProformaFactory.create_batch(size=2, provider=provider)
+        numbered_proforma = ProformaFactory.create(provider=provider, number=50)
+
+        with CaptureQueriesContext(connection) as queries:
+            BillingDocumentBase.reserve_numbers(invoices + proformas + [numbered_proforma])
+
+        # A single reservation for each sequence
+        assert len([query for query in queries
+                    if query['sql'].startswith('UPDATE')]) == 2
+
+        assert [invoice.number for invoice in invoices] == [5, 6, 7]
+        # The proformas sequence starts after the already numbered proforma
+        assert [proforma.number for proforma in proformas] == [51, 52]
+        assert numbered_proforma.number == 50
+        assert DocumentNumberSequence.objects.get(
+            kind='invoice', provider=provider
+        ).next_number == 8
+
+        for document in invoices + proformas:
+            document.issue()
+            document.save()
+
+        assert sorted(Proforma.objects.filter(provider=provider).values_list(
+            'number', flat=True
+        )) == [50, 51, 52]
+        assert sorted(Invoice.objects.filter(provider=provider).values_list(
+            'number', flat=True
+        )) == [5, 6, 7]
+
+    def test_reserved_numbers_are_given_back_on_rollback(self):
+        provider = ProviderFactory.create(invoice_starting_number=5)
+        invoices = InvoiceFactory.create_batch(size=2, provider=provider)
+
+        try:
+            with transaction.atomic():
+                BillingDocumentBase.reserve_numbers(invoices)
+                raise ValueError
+        except ValueError:
+            pass
+
+        invoice = InvoiceFactory.create(provider=provider)
+        invoice.issue()
+        invoice.save()
+        assert invoice.number == 5
@@ -0,0 +1,227 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from silver.models import BillingDocumentBase, DocumentEntry, Invoice, Proforma
+from silver.tests.factories import DocumentEntryFactory, InvoiceFactory, ProformaFactory
+
+
+class TestDocumentTotals(TestCase):
+    def create_entry(self, document, quantity, unit_price):
+        return DocumentEntryFactory.create(proforma=document, quantity=Decimal(quantity),
+                                           unit_price=Decimal(unit_price))
+
+    def test_draft_totals_are_maintained_incrementally(self):
+        proforma = ProformaFactory.create(sales_tax_percent=Decimal('10.00'),
+                                          transaction_xe_rate=Decimal('2.0000'))
+        assert proforma.total == Decimal('0.00')
+
+        self.create_entry(proforma, '2.00', '10.00')
+        entry = self.create_entry(Proforma.objects.get(pk=proforma.pk), '1.00', '5.00')
+
+        proforma = Proforma.objects.select_related('customer', 'provider').get(pk=proforma.pk)
+        with self.assertNumQueries(0):
+            assert proforma.total_before_tax == Decimal('25.00')
+            assert proforma.tax_value == Decimal('2.50')
+            assert proforma.total == Decimal('27.50')
+            assert proforma.total_in_transaction_currency == Decimal('55.00')
+            assert unicode(proforma)
+
+        entry.quantity = Decimal('3.00')
+        entry.save()
+        assert Proforma.objects.get(pk=proforma.pk).total == Decimal('38.50')
+
+        entry.delete()
+        assert Proforma.objects.get(pk=proforma.pk).total == Decimal('22.00')
+
+        # Saving a stale instance doesn't overwrite the totals
+        proforma.sales_tax_name = 'VAT'
+        proforma.save()
+        assert Proforma.objects.get(pk=proforma.pk).total == Decimal('22.00')
+
+    def test_totals_are_recomputed_when_the_rates_change(self):
+        proforma = ProformaFactory.create(sales_tax_percent=Decimal('10.00'))
+        self.create_entry(proforma, '1.00', '100.00')
+
+        proforma = Proforma.objects.get(pk=proforma.pk)
+        proforma.sales_tax_percent = Decimal('20.00')
+        proforma.save()
+
+        assert Proforma.objects.get(pk=proforma.pk).total == Decimal('120.00')
+
+    def test_moved_entries_update_both_documents(self):
+        proforma = ProformaFactory.create(customer__sales_tax_percent=Decimal('0.00'))
+        invoice = InvoiceFactory.create(customer__sales_tax_percent=Decimal('0.00'))
+        entry = self.create_entry(proforma, '1.00', '10.00')
+
+        entry.proforma = None
+        entry.invoice = invoice
+        entry.save()
+
+        assert Proforma.objects.get(pk=proforma.pk).total == Decimal('0.00')
+        assert Invoice.objects.get(pk=invoice.pk).total == Decimal('10.00')
+
+    def test_moved_entries_dont_update_the_issued_documents(self):
+        proforma = ProformaFactory.create(customer__sales_tax_percent=Decimal('0.00'))
+        invoice = InvoiceFactory.create(customer__sales_tax_percent=Decimal('0.00'))
+        entry = self.create_entry(proforma, '1.00', '10.00')
+
+        proforma = Proforma.objects.get(pk=proforma.pk)
+        proforma.issue()
+        proforma.save()
+
+        entry = DocumentEntry.objects.get(pk=entry.pk)
+        entry.proforma = None
+        entry.invoice = invoice
+        entry.save()
+
+        assert Proforma.objects.get(pk=proforma.pk).total == Decimal('10.00')
+        assert Invoice.objects.get(pk=invoice.pk).total == Decimal('10.00')
+
+    def test_entries_loaded_with_deferred_fields(self):
+        proforma = ProformaFactory.create(customer__sales_tax_percent=Decimal('0.00'))
+        invoice = InvoiceFactory.create(customer__sales_tax_percent=Decimal('0.00'))
+        self.create_entry(proforma, '1.00', '10.00')
+        self.create_entry(proforma, '2.00', '10.00')
+
+        assert len(DocumentEntry.objects.defer('unit_price')) == 2
+        assert len(DocumentEntry.objects.only('pk')) == 2
+
+        entry = DocumentEntry.objects.defer('quantity').filter(proforma=proforma).first()
+        entry.quantity = Decimal('3.00')
+        entry.save()
+        assert Proforma.objects.get(pk=proforma.pk).total == Decimal('50.00')
+
+        entry = DocumentEntry.objects.only('pk').get(pk=entry.pk)
+        entry.proforma = None
+        entry.invoice = invoice
+        entry.save()
+        assert Proforma.objects.get(pk=proforma.pk).total == Decimal('20.00')
+        assert Invoice.objects.get(pk=invoice.pk).total == Decimal('30.00')
+
+    def test_issued_totals_are_frozen(self):
+        proforma = ProformaFactory.create(customer__sales_tax_percent=Decimal('0.00'))
+        entry = self.create_entry(proforma, '1.00', '10.00')
+
+        proforma = Proforma.objects.get(pk=proforma.pk)
+        proforma.issue()
+        proforma.save()
+
+        DocumentEntry.objects.filter(pk=entry.pk).update(unit_price=Decimal('20.00'))
+        self.create_entry(proforma, '1.00', '10.00')
+
+        assert Proforma.objects.get(pk=proforma.pk).total == Decimal('10.00')
+
+    def test_backfill_document_totals(self):
+        proforma = ProformaFactory.create(sales_tax_percent=Decimal('10.00'))
+        self.create_entry(proforma, '1.00', '10.00')
+        BillingDocumentBase.objects.update(_total_before_tax=None, _tax_value=None, _total=None)
+
+        output = StringIO()
+        call_command('backfill_document_totals', stdout=output)
+
+        assert 'Populated the totals of 1 documents.' in output.getvalue()
+
+        proforma = Proforma.objects.get(pk=proforma.pk)
+        assert proforma._total_before_tax == Decimal('10.00')
+        assert proforma._tax_value == Decimal('1.00')
+        assert proforma._total == Decimal('11.00')
+
+    def test_annotated_totals_match_the_entries_totals(self):
+        amounts = [('1.0000', '0.0050'), ('1.0000', '0.0150'), ('1.0000', '-0.0050'),
+                   ('1.0000', '-0.0150'), ('3.3333', '7.7777'), ('0.5000', '-12.3450'),
+                   ('12.5000', '0.1000'), ('2.0000', '99.9950')]
+
+        proformas = []
+        for sales_tax_percent, xe_rate in [('0.00', '1.0000'), ('19.00', '4.5678'),
+                                           ('12.50', '0.0050'), ('5.55', '1.2345')]:
+            proforma = ProformaFactory.create(sales_tax_percent=Decimal(sales_tax_percent),
+                                              transaction_xe_rate=Decimal(xe_rate))
+            for quantity, unit_price in amounts:
+                self.create_entry(proforma, quantity, unit_price)
+            proformas.append(proforma)
+
+        invoice = InvoiceFactory.create(sales_tax_percent=Decimal('24.00'),
+                                        transaction_xe_rate=Decimal('0.2222'))
+        for quantity, unit_price in amounts:
+            DocumentEntryFactory.create(invoice=invoice, quantity=Decimal(quantity),
+                                        unit_price=Decimal(unit_price))
+
+        expected_totals = {
+            document.pk: (document.total, document.total_in_transaction_currency)
+            for document in BillingDocumentBase.objects.all()
+        }
+
+        BillingDocumentBase.objects.update(_total=None, _total_in_transaction_currency=None)
+
+        with self.assertNumQueries(1):
+            documents = list(BillingDocumentBase.objects.with_totals())
+
+            totals = {document.pk: (document.total, document.total_in_transaction_currency)
+                      for document in documents}
+
+        assert totals == expected_totals
+
+        # The annotated totals match the totals computed from the entries
+        for document in BillingDocumentBase.objects.all():
+            assert totals[document.pk] == (
+                sum([entry.total for entry in document.entries]),
+                sum([entry.total_in_transaction_currency for entry in document.entries])
+            )
+
+    def test_entries_are_evaluated_against_the_loaded_document(self):
+        proforma = ProformaFactory.create(sales_tax_percent=Decimal('10.00'),
+                                          transaction_xe_rate=Decimal('2.0000'))
+        for _ in range(3):
+            self.create_entry(proforma, '2.00', '10.00')
+        proforma.issue()
+        invoice = proforma.create_invoice()
+
+        proforma = BillingDocumentBase.objects.get(pk=proforma.pk)
+        entries = DocumentEntry.objects.filter(proforma=proforma)
+
+        # The proforma's invoice is already selected, so only the entries are fetched
+        with self.assertNumQueries(1):
+            evaluated_entries = proforma.evaluate_entries(entries)
+
+            for entry, amounts in evaluated_entries:
+                assert entry.document.pk == invoice.pk
+                assert entry.total == amounts['total'] == Decimal('22.00')
+                assert entry.total_in_transaction_currency == Decimal('44.00')
+                assert amounts['unit_price_in_transaction_currency'] == Decimal('20.0000')
+
+        with self.assertNumQueries(1):
+            assert proforma.compute_total() == Decimal('66.00')
+            assert proforma.compute_total_in_transaction_currency() == Decimal('132.00')
+
+    def test_entry_amounts_are_memoized_until_the_rates_change(self):
+        proforma = ProformaFactory.create(sales_tax_percent=Decimal('10.00'),
+                                          transaction_xe_rate=None)
+        entry = self.create_entry(proforma, '2.00', '10.00')
+
+        amounts = entry.get_amounts(proforma)
+        assert entry.get_amounts(proforma) is amounts
+        assert amounts['tax_value'] == Decimal('2.00')
+        assert amounts['total_in_transaction_currency'] is None
+        assert '_total_in_transaction_currency' not in entry.get_totals(proforma)
+
+        proforma.sales_tax_percent = Decimal('20.00')
+        proforma.transaction_xe_rate = Decimal('2.0000')
+        assert entry.get_amounts(proforma)['tax_value'] == Decimal('4.00')
+        assert entry.get_totals(proforma)['_total_in_transaction_currency'] == Decimal('48.00')
@@ -0,0 +1,239 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime as dt
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from mock import patch
+
+from silver.documents_generator import DocumentsGenerator, summarize_billing_preview
+from silver.models import BillingLog, Customer, DocumentEntry, Plan, Proforma, Subscription
+from silver.models.documents import DocumentEntryAccumulator
+from silver.tests.factories import (CustomerFactory, MeteredFeatureFactory, PlanFactory,
+                                    ProformaFactory, ProviderFactory, SubscriptionFactory)
+from silver.utils.iterables import queryset_chunks
+
+
+class TestDocumentsGenerator(TestCase):
+    def create_customers(self, count, subscriptions_per_customer=2):
+        customers = CustomerFactory.create_batch(size=count)
+
+        for customer in customers:
+            for _ in range(subscriptions_per_customer):
+                plan = PlanFactory.create(
+                    interval='month', interval_count=1, generate_after=0,
+                    amount=Decimal('10.00'),
+                    metered_features=MeteredFeatureFactory.create_batch(size=2)
+                )
+                subscription = SubscriptionFactory.create(plan=plan, customer=customer,
+                                                          start_date=dt.date(2017, 1, 1))
+                subscription.activate()
+                subscription.save()
+
+                for month in (1, 2):
+                    BillingLog.objects.create(
+                        subscription=subscription,
+                        billing_date=dt.date(2017, month, 1),
+                        plan_billed_up_to=dt.date(2017, month + 1, 1) - dt.timedelta(days=1),
+                        metered_features_billed_up_to=dt.date(2017, month, 1) - dt.timedelta(days=1)
+                    )
+
+        return customers
+
+    def test_prefetch_subscriptions_uses_a_fixed_number_of_queries(self):
+        generator = DocumentsGenerator()
+
+        customers = self.create_customers(1)
+        with CaptureQueriesContext(connection) as few_customers_queries:
+            generator.prefetch_subscriptions(customers)
+
+        customers = self.create_customers(5)
+        with CaptureQueriesContext(connection) as many_customers_queries:
+            subscriptions = generator.prefetch_subscriptions(customers)
+
+        assert len(few_customers_queries) == len(many_customers_queries)
+        assert sorted(subscriptions.keys()) == sorted(customer.pk for customer in customers)
+
+        billing_date = dt.date(2017, 3, 1)
+        with self.assertNumQueries(0):
+            for customer_subscriptions in subscriptions.values():
+                assert len(customer_subscriptions) == 2
+
+                for subscription in customer_subscriptions:
+                    assert subscription.should_be_billed(billing_date)
+                    assert len(subscription.plan.metered_features.all()) == 2
+                    assert subscription.last_billing_date == dt.date(2017, 2, 1)
+                    assert subscription.billed_up_to_dates == {
+                        'plan_billed_up_to': dt.date(2017, 2, 28),
+                        'metered_features_billed_up_to': dt.date(2017, 1, 31)
+                    }
+
+    def test_prefetch_subscriptions_skips_not_billable_subscriptions(self):
+        customer = CustomerFactory.create()
+        SubscriptionFactory.create(customer=customer, state=Subscription.STATES.INACTIVE)
+        SubscriptionFactory.create(customer=customer, state=Subscription.STATES.ENDED)
+
+        subscriptions = DocumentsGenerator().prefetch_subscriptions([customer])
+
+        assert subscriptions == {customer.pk: []}
+
+    def test_prefetch_subscriptions_loads_only_due_subscriptions(self):
+        customer = self.create_customers(1)[0]
+        not_due_subscription = customer.subscriptions.first()
+        Subscription.objects.filter(pk=not_due_subscription.pk).update(
+            next_billing_date=dt.date(2017, 4, 1)
+        )
+
+        subscriptions = DocumentsGenerator().prefetch_subscriptions(
+            [customer], billing_date=dt.date(2017, 3, 1)
+        )[customer.pk]
+
+        assert not_due_subscription not in subscriptions
+        assert len(subscriptions) == 1
+
+    def test_generate_visits_only_customers_with_due_subscriptions(self):
+        due_customer, not_due_customer = self.create_customers(2, subscriptions_per_customer=1)
+        Subscription.objects.filter(customer=not_due_customer).update(
+            next_billing_date=dt.date(2017, 4, 1)
+        )
+
+        generator = DocumentsGenerator()
+        assert list(generator.get_customers_due_for_billing(dt.date(2017, 3, 1))) == [
+            due_customer
+        ]
+
+        with patch.object(DocumentsGenerator, '_generate_for_customer') as generate_mock:
+            generator.generate(billing_date=dt.date(2017, 3, 1))
+
+        assert [call[0][0] for call in generate_mock.call_args_list] == [due_customer]
+
+    def test_customers_querysets_are_walked_in_keyset_chunks(self):
+        customers = CustomerFactory.create_batch(size=5)
+        queryset = Customer.objects.all()
+
+        with patch('silver.documents_generator.DOCS_GENERATION_BATCH_SIZE', 2):
+            batches = list(DocumentsGenerator()._customers_batches(queryset))
+
+        assert batches == [customers[:2], customers[2:4], customers[4:]]
+        # The queryset's result cache doesn't keep the customers alive
+        assert queryset._result_cache is None
+
+        with CaptureQueriesContext(connection) as queries:
+            list(queryset_chunks(queryset, 3))
+
+        assert len(queries) == 2
+        assert queries[1]['sql'].endswith(
+            '"silver_customer"."id" > %s) ORDER BY "silver_customer"."id" ASC LIMIT 3' %
+            customers[2].pk
+        )
+
+    def test_billing_log_creation_clears_prefetched_billing_logs(self):
+        customer = self.create_customers(1, subscriptions_per_customer=1)[0]
+
+        generator = DocumentsGenerator()
+        subscription = generator.prefetch_subscriptions([customer])[customer.pk][0]
+
+        assert subscription.last_billing_date == dt.date(2017, 2, 1)
+
+        generator._bill_subscription_into_document(subscription, dt.date(2017, 3, 1))
+
+        assert subscription.last_billing_date == dt.date(2017, 3, 1)
+
+    def test_document_entries_are_inserted_at_once(self):
+        customer = self.create_customers(1, subscriptions_per_customer=3)[0]
+        provider = ProviderFactory.create()
+        Plan.objects.update(provider=provider)
+
+        with CaptureQueriesContext(connection) as queries:
+            DocumentsGenerator().generate(billing_date=dt.date(2017, 3, 1),
+                                          customers=[customer])
+
+        entries_inserts = [query for query in queries
+                           if query['sql'].startswith('INSERT INTO "silver_documententry"')]
+        assert len(entries_inserts) == 1
+
+        proforma = Proforma.objects.get()
+        # The plan value and 2 metered features for each subscription
+        assert proforma.proforma_entries.count() == 9
+
+        billing_logs = BillingLog.objects.filter(billing_date=dt.date(2017, 3, 1))
+        assert sum(billing_log.total for billing_log in billing_logs) == proforma.total
+
+    def test_preview_writes_nothing_and_matches_the_generated_documents(self):
+        customers = self.create_customers(2, subscriptions_per_customer=2)
+        customers[0].consolidated_billing = False
+        customers[0].save()
+        customers[1].consolidated_billing = True
+        customers[1].save()
+
+        provider = ProviderFactory.create()
+        Plan.objects.update(provider=provider)
+        billing_date = dt.date(2017, 3, 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            document_previews = list(DocumentsGenerator().preview(billing_date=billing_date))
+
+        assert all(query['sql'].startswith('SELECT') for query in queries)
+        assert not Proforma.objects.exists()
+
+        # 2 documents for the customer without consolidated billing, 1 otherwise
+        assert len(document_previews) == 3
+        for document_preview in document_previews:
+            assert document_preview['document'].pk is None
+            assert all(entry.pk is None for entry in document_preview['entries'])
+
+        DocumentsGenerator().generate(billing_date=billing_date)
+
+        proformas = Proforma.objects.all()
+        assert len(proformas) == 3
+        assert sorted(document_preview['total'] for document_preview in document_previews) == \
+            sorted(proforma.total for proforma in proformas)
+
+        assert summarize_billing_preview(document_previews) == {
+            provider.pk: {
+                proformas[0].currency: {
+                    'documents': 3,
+                    'total': sum(proforma.total for proforma in proformas)
+                }
+            }
+        }
+
+
+class TestDocumentEntryAccumulator(TestCase):
+    def test_accumulator(self):
+        proforma = ProformaFactory.create(sales_tax_percent=Decimal('10.00'))
+
+        entries = DocumentEntryAccumulator()
+        entries.add(proforma=proforma, description='first', quantity=Decimal('2.00'),
+                    unit_price=Decimal('10.00'))
+        entries.add(proforma=proforma, description='second', quantity=Decimal('1.00'),
+                    unit_price=Decimal('5.00'))
+
+        assert not DocumentEntry.objects.exists()
+        assert entries.total == Decimal('27.50')
+
+        # The entries are inserted and the proforma's totals are incremented
+        with self.assertNumQueries(2):
+            entries.flush()
+
+        assert entries.entries == []
+        assert proforma.total == Decimal('27.50')
+        assert Proforma.objects.get(pk=proforma.pk).total == Decimal('27.50')
+        assert [entry.description for entry in proforma.proforma_entries.order_by('pk')] == [
+            'first', 'second'
+        ]
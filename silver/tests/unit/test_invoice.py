@@ -18,11 +18,14 @@ from decimal import Decimal
 from datetime import date
 
 from datetime import timedelta
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-from silver.models import DocumentEntry, Proforma, Invoice
+from silver.models import BillingDocumentBase, DocumentEntry, Proforma, Invoice, Transaction
 from silver.tests.factories import (ProformaFactory, InvoiceFactory,
-                                    DocumentEntryFactory, CustomerFactory)
+                                    DocumentEntryFactory, CustomerFactory,
+                                    PaymentMethodFactory, TransactionFactory)
 
 
 class TestInvoice(TestCase):
@@ -234,3 +237,79 @@ class TestInvoice(TestCase):
                                         transaction_currency=None)
 
         self.assertEqual(invoice.transaction_currency, 'EUR')
+
+    def test_invoice_transactions_amounts(self):
+        payment_method = PaymentMethodFactory.create(
+            customer__sales_tax_percent=Decimal('0.00')
+        )
+        invoice, other_invoice = InvoiceFactory.create_batch(
+            size=2, customer=payment_method.customer, transaction_xe_rate=Decimal('1')
+        )
+        for document in (invoice, other_invoice):
+            DocumentEntryFactory.create(invoice=document, quantity=Decimal('1.00'),
+                                        unit_price=Decimal('100.00'))
+            document.issue()
+
+        for state, amount in ((Transaction.States.Initial, Decimal('10.00')),
+                              (Transaction.States.Pending, Decimal('20.00')),
+                              (Transaction.States.Settled, Decimal('30.00')),
+                              (Transaction.States.Settled, Decimal('5.50')),
+                              (Transaction.States.Failed, Decimal('7.00'))):
+            TransactionFactory.create(invoice=invoice, proforma=None, state=state,
+                                      amount=amount, payment_method=payment_method)
+
+        TransactionFactory.create(invoice=other_invoice, proforma=None,
+                                  state=Transaction.States.Settled, amount=Decimal('1.00'),
+                                  payment_method=payment_method)
+        ProformaFactory.create()
+
+        expected_amounts = {
+            'paid': Decimal('35.50'),
+            'pending': Decimal('20.00'),
+            'charged': Decimal('65.50')
+        }
+
+        with self.assertNumQueries(1):
+            assert invoice.get_transactions_amounts() == expected_amounts
+
+        # The amounts are memoized
+        with self.assertNumQueries(0):
+            assert invoice.amount_paid_in_transaction_currency == Decimal('35.50')
+            assert invoice.amount_pending_in_transaction_currency == Decimal('20.00')
+            assert invoice.amount_to_be_charged_in_transaction_currency == Decimal('34.50')
+
+        documents = BillingDocumentBase.objects.with_transactions_amounts()
+        with self.assertNumQueries(1):
+            amounts = {document.pk: document.get_transactions_amounts()
+                       for document in documents}
+
+        assert amounts == {
+            invoice.pk: expected_amounts,
+            other_invoice.pk: {
+                'paid': Decimal('1.00'), 'pending': Decimal('0.00'), 'charged': Decimal('1.00')
+            },
+            Proforma.objects.get().pk: {
+                'paid': Decimal('0.00'), 'pending': Decimal('0.00'), 'charged': Decimal('0.00')
+            }
+        }
+
+        # Validating a new transaction aggregates the transactions amounts once
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        transaction = Transaction(invoice=invoice, payment_method=payment_method,
+                                  amount=Decimal('34.50'))
+        with CaptureQueriesContext(connection) as queries:
+            transaction.clean()
+
+        assert len([query for query in queries if 'SUM(' in query['sql']]) == 1
+
+        # Saving the transaction discards the memoized amounts, which are then
+        # aggregated once more, for the invoice to be paid
+        transaction.save()
+        assert invoice.amount_to_be_charged_in_transaction_currency == Decimal('0.00')
+
+        transaction.settle()
+        with CaptureQueriesContext(connection) as queries:
+            transaction.save()
+
+        assert len([query for query in queries if 'SUM(' in query['sql']]) == 1
+        assert invoice.state == Invoice.STATES.PAID
@@ -0,0 +1,132 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import time
+
+from mock import patch
+
+from django.test import SimpleTestCase, override_settings
+
+from silver.utils.pdf import (
+    PDF_RENDERING_TIMEOUT, PDFRenderer, PDFRenderingTimeout, ResourcesCache, fetch_resources
+)
+
+
+def _uninterruptible_rendering(html, timeout):
+    # e.g. a rendering stuck in C code, which isn't interrupted by the timeout
+    time.sleep(5)
+
+
+class TestPDFRenderer(SimpleTestCase):
+    def test_render_within_a_processes_pool(self):
+        html = u'<html><body><p>Invoice</p></body></html>'
+
+        with PDFRenderer(processes=2, timeout=30) as renderer:
+            renderings = [renderer.render_async(html) for _ in range(3)]
+            pdfs = [get_pdf() for get_pdf in renderings]
+
+        assert all(pdf.startswith(b'%PDF-') for pdf in pdfs)
+        assert PDFRenderer(processes=0).render(html).startswith(b'%PDF-')
+
+    def test_renderings_exceeding_the_timeout_are_interrupted(self):
+        slow_html = u'<table>%s</table>' % u''.join(
+            u'<tr><td>%d</td></tr>' % row for row in range(20000)
+        )
+
+        with PDFRenderer(processes=1, timeout=0.1) as renderer:
+            slow_rendering = renderer.render_async(slow_html)
+            rendering = renderer.render_async(u'<p>Invoice</p>')
+
+            with self.assertRaises(PDFRenderingTimeout):
+                slow_rendering()
+
+            # The worker is still usable
+            assert rendering().startswith(b'%PDF-')
+
+    @patch('silver.utils.pdf.PDF_RENDERING_TIMEOUT_MARGIN', 0.1)
+    @patch('silver.utils.pdf._html_to_pdf_within_timeout', _uninterruptible_rendering)
+    def test_renderings_which_cannot_be_interrupted_are_not_waited_for(self):
+        started_at = time.time()
+
+        with PDFRenderer(processes=1, timeout=0.1) as renderer:
+            with self.assertRaises(PDFRenderingTimeout):
+                renderer.render(u'<p>Invoice</p>')
+
+        # The stuck worker has been terminated
+        assert time.time() - started_at < 5
+
+    def test_the_timeout_can_be_disabled(self):
+        assert PDFRenderer(timeout=0).timeout == 0
+        assert PDFRenderer().timeout == PDF_RENDERING_TIMEOUT
+
+
+class TestResourcesCache(SimpleTestCase):
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+
+        for name, content in (('logo.png', b'\x89PNG logo'), ('banner.png', b'\x89PNG banner'),
+                              ('stamp.png', b'\x89PNG stamp'), ('badge.png', b'\x89PNG badge'),
+                              ('font.ttf', b'font')):
+            with open(os.path.join(self.static_root, name), 'wb') as resource_file:
+                resource_file.write(content)
+
+        settings_override = override_settings(STATIC_ROOT=self.static_root,
+                                              STATIC_URL='/static/')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_resources_are_loaded_once(self):
+        cache = ResourcesCache()
+
+        with patch('silver.utils.pdf.open', create=True, side_effect=open) as open_mock:
+            logo = cache.get('/static/logo.png')
+
+            assert cache.get('/static/logo.png') == logo
+            assert open_mock.call_count == 1
+
+        assert logo == 'data:image/png;base64,iVBORyBsb2dv'
+
+        # Fonts are loaded by xhtml2pdf from files
+        assert cache.get('/static/font.ttf') == os.path.join(self.static_root, 'font.ttf')
+
+    def test_least_recently_used_resources_are_evicted(self):
+        # Each of the images takes up 38 bytes
+        cache = ResourcesCache(max_size=80)
+
+        cache.get('/static/banner.png')
+        cache.get('/static/stamp.png')
+        cache.get('/static/banner.png')
+        cache.get('/static/badge.png')
+
+        assert '/static/stamp.png' not in cache
+        assert '/static/banner.png' in cache
+        assert '/static/badge.png' in cache
+        assert cache.size == 76
+
+    def test_missing_resources_are_not_cached(self):
+        cache = ResourcesCache()
+
+        assert cache.warm_up(['/static/logo.png', '/static/missing.png']) == [
+            '/static/missing.png'
+        ]
+        assert len(cache) == 1
+
+    def test_fetch_resources_uses_the_cache(self):
+        with patch('silver.utils.pdf.resources_cache', ResourcesCache()) as cache:
+            assert fetch_resources('/static/logo.png', None).startswith('data:image/png')
+            assert '/static/logo.png' in cache
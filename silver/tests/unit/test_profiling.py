@@ -0,0 +1,84 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import datetime as dt
+from decimal import Decimal
+
+from django.test import TestCase
+
+from silver.documents_generator import DocumentsGenerator
+from silver.models import BillingRun, Customer
+from silver.tests.factories import CustomerFactory, PlanFactory, SubscriptionFactory
+from silver.utils.profiling import (BillingProfiler, format_report, get_active_profiler,
+                                    percentile, profile_phase, profiled)
+
+
+class TestBillingProfiler(TestCase):
+    def test_percentile(self):
+        values = range(1, 101)
+
+        assert percentile(values, 50) == 50
+        assert percentile(values, 90) == 90
+        assert percentile(values, 99) == 99
+        assert percentile([3], 99) == 3
+        assert percentile([], 50) is None
+
+    def test_phases_are_measured_only_within_an_active_profiler(self):
+        @profiled('counting')
+        def count_customers():
+            return Customer.objects.count()
+
+        with profile_phase('ignored'):
+            count_customers()
+
+        with BillingProfiler() as profiler:
+            assert get_active_profiler() is profiler
+
+            with profile_phase('customer', key=1):
+                count_customers()
+                # Nested phases of the same kind are measured once
+                with profile_phase('customer', key=2):
+                    count_customers()
+
+        assert get_active_profiler() is None
+
+        report = profiler.report()
+        assert set(report['phases']) == {'customer', 'counting'}
+        assert report['phases']['customer']['count'] == 1
+        assert report['phases']['customer']['queries'] == 2
+        assert report['phases']['counting']['count'] == 2
+        assert report['queries'] == 2
+        assert [customer['customer'] for customer in report['slowest_customers']] == [1]
+
+    def test_profiled_billing_run_stores_the_report(self):
+        customer = CustomerFactory.create()
+        plan = PlanFactory.create(interval='month', interval_count=1, generate_after=0,
+                                  amount=Decimal('10.00'))
+        subscription = SubscriptionFactory.create(plan=plan, customer=customer,
+                                                  start_date=dt.date(2017, 1, 1))
+        subscription.activate()
+        subscription.save()
+
+        billing_run = BillingRun.objects.create(billing_date=dt.date(2017, 1, 1))
+        DocumentsGenerator().generate_for_billing_run(billing_run, profile=True)
+
+        report = BillingRun.objects.get(pk=billing_run.pk).report
+
+        assert {'customer', 'subscriptions_selection', 'cycle_computation',
+                'entries_creation', 'template_rendering'} <= set(report['phases'])
+        assert report['slowest_customers'][0]['customer'] == customer.pk
+        assert report['phases']['customer']['queries'] > 0
+
+        assert 'Slowest customers:' in format_report(report)
@@ -15,6 +15,8 @@
 
 from decimal import Decimal
 
+from mock import patch
+
 from django.test import TestCase
 
 from silver.models import DocumentEntry, Invoice, Proforma
@@ -151,3 +153,41 @@ class TestProforma(TestCase):
                                           transaction_currency=None)
 
         self.assertEqual(proforma.transaction_currency, 'EUR')
+
+    def test_bulk_transition_rolls_back_only_the_failed_documents(self):
+        proformas = ProformaFactory.create_batch(size=3)
+        # No exchange rate can be obtained for this proforma
+        Proforma.objects.filter(pk=proformas[1].pk).update(currency='USD',
+                                                           transaction_xe_rate=None)
+
+        results = Proforma.bulk_transition([proforma.pk for proforma in proformas],
+                                           Proforma.STATES.ISSUED, batch_size=2)
+
+        assert list(results) == [proforma.pk for proforma in proformas]
+        assert results[proformas[0].pk]['document'].state == Proforma.STATES.ISSUED
+        assert results[proformas[1].pk] == {
+            'error': "Couldn't automatically obtain an exchange rate."
+        }
+        assert results[proformas[2].pk]['document'].state == Proforma.STATES.ISSUED
+
+        failed_proforma = Proforma.objects.get(pk=proformas[1].pk)
+        assert failed_proforma.state == Proforma.STATES.DRAFT
+        assert failed_proforma.number is None
+
+        results = Proforma.bulk_transition([proformas[0].pk], Proforma.STATES.PAID)
+
+        paid_proforma = results[proformas[0].pk]['document']
+        assert Proforma.objects.get(pk=paid_proforma.pk).state == Proforma.STATES.PAID
+        assert Invoice.objects.get(related_document=paid_proforma).state == Invoice.STATES.PAID
+
+    def test_bulk_transition_reports_the_unexpected_errors(self):
+        proformas = ProformaFactory.create_batch(size=2)
+
+        with patch('silver.models.documents.base.DocumentNumberSequence.objects.reserve',
+                   side_effect=[1, ValueError('Unexpected.')]):
+            results = Proforma.bulk_transition([proforma.pk for proforma in proformas],
+                                               Proforma.STATES.ISSUED)
+
+        assert results[proformas[0].pk]['document'].state == Proforma.STATES.ISSUED
+        assert results[proformas[1].pk] == {'error': 'The proforma could not be issued.'}
+        assert Proforma.objects.get(pk=proformas[1].pk).state == Proforma.STATES.DRAFT
@@ -14,14 +14,19 @@
 
 
 import datetime
+from decimal import Decimal
 
-from django.test import TestCase
+from django.template.loader import select_template
+from django.test import TestCase, override_settings
 from freezegun import freeze_time
 from mock import patch, PropertyMock, MagicMock
 
-from silver.models import Plan, Subscription, BillingLog
+from silver.models import Plan, Provider, Subscription, BillingLog, MeteredFeatureUnitsLog
+from silver.models.documents import DocumentEntryAccumulator
+from silver.models.subscriptions import clear_field_templates_cache, render_field_template
 from silver.tests.factories import (SubscriptionFactory, MeteredFeatureFactory,
-                                    PlanFactory)
+                                    PlanFactory, MeteredFeatureUnitsLogFactory,
+                                    ProformaFactory)
 
 
 class TestSubscription(TestCase):
@@ -794,3 +799,268 @@ class TestSubscriptionShouldBeBilled(TestCase):
             cancel_date=datetime.date(2014, 12, 31)
         )
         assert subscription.updateable_buckets() == []
+
+    def test_consumed_units_per_metered_feature_are_summed_up_in_database(self):
+        metered_features = MeteredFeatureFactory.create_batch(size=2)
+        plan = PlanFactory.create(metered_features=metered_features)
+        subscriptions = SubscriptionFactory.create_batch(size=2, plan=plan)
+
+        for subscription in subscriptions:
+            for metered_feature in metered_features:
+                for day in (1, 15):
+                    MeteredFeatureUnitsLogFactory.create(
+                        subscription=subscription, metered_feature=metered_feature,
+                        consumed_units=Decimal('1.5'),
+                        start_date=datetime.date(2017, 1, day),
+                        end_date=datetime.date(2017, 1, day + 10)
+                    )
+
+            # Outside of the interval
+            MeteredFeatureUnitsLogFactory.create(
+                subscription=subscription, metered_feature=metered_features[0],
+                consumed_units=Decimal('100'),
+                start_date=datetime.date(2017, 2, 1),
+                end_date=datetime.date(2017, 2, 10)
+            )
+
+        with self.assertNumQueries(1):
+            consumed_units = MeteredFeatureUnitsLog.objects.filter(
+                subscription__in=subscriptions
+            ).consumed_units_per_metered_feature(datetime.date(2017, 1, 1),
+                                                 datetime.date(2017, 1, 31))
+
+        assert consumed_units == {
+            (subscription.pk, metered_feature.pk): Decimal('3.0')
+            for subscription in subscriptions
+            for metered_feature in metered_features
+        }
+
+        with self.assertNumQueries(1):
+            consumed_units = subscriptions[0]._get_consumed_units_per_metered_feature(
+                datetime.date(2017, 1, 1), datetime.date(2017, 2, 28)
+            )
+
+        assert consumed_units == {
+            metered_features[0].pk: Decimal('103.0'),
+            metered_features[1].pk: Decimal('3.0'),
+        }
+
+    def test_add_mfs_queries_consumed_units_once(self):
+        metered_features = MeteredFeatureFactory.create_batch(
+            size=5, included_units=Decimal('1.00'), price_per_unit=Decimal('2.00')
+        )
+        plan = PlanFactory.create(metered_features=metered_features,
+                                  interval=Plan.INTERVALS.MONTH, interval_count=1)
+        subscription = SubscriptionFactory.create(plan=plan)
+
+        for metered_feature in metered_features:
+            MeteredFeatureUnitsLogFactory.create(
+                subscription=subscription, metered_feature=metered_feature,
+                consumed_units=Decimal('3.00'),
+                start_date=datetime.date(2017, 1, 1),
+                end_date=datetime.date(2017, 1, 31)
+            )
+
+        proforma = ProformaFactory.create(sales_tax_percent=Decimal('10.00'))
+        subscription = Subscription.objects.prefetch_related(
+            'plan__metered_features__product_code'
+        ).select_related('plan__provider', 'plan__product_code', 'customer').get(
+            pk=subscription.pk
+        )
+        entries = DocumentEntryAccumulator()
+
+        with patch('silver.models.subscriptions.Subscription._entry_description',
+                   return_value='description'), \
+                patch('silver.models.subscriptions.Subscription._entry_unit',
+                      return_value='unit'), \
+                self.assertNumQueries(1):
+            total = subscription._add_mfs(datetime.date(2017, 1, 1),
+                                          datetime.date(2017, 1, 31),
+                                          proforma=proforma, entries=entries)
+
+        # 2 extra units for each of the 5 metered features, plus taxes
+        assert total == Decimal('22.00')
+        assert [entry.quantity for entry in entries.entries] == [Decimal('2.00')] * 5
+
+    def test_next_billing_date_is_kept_up_to_date(self):
+        plan = PlanFactory.create(interval=Plan.INTERVALS.MONTH, interval_count=1,
+                                  prebill_plan=False)
+        subscription = SubscriptionFactory.create(plan=plan, start_date=datetime.date(2017, 1, 1))
+        assert subscription.next_billing_date is None
+
+        subscription.activate()
+        subscription.save()
+
+        # The first cycle is billed once it ends
+        assert subscription.next_billing_date == datetime.date(2017, 2, 1)
+
+        billing_log = BillingLog.objects.create(
+            subscription=subscription, billing_date=datetime.date(2017, 2, 1),
+            plan_billed_up_to=datetime.date(2017, 1, 31),
+            metered_features_billed_up_to=datetime.date(2017, 1, 31)
+        )
+        assert subscription.next_billing_date == datetime.date(2017, 3, 1)
+        assert Subscription.objects.get(pk=subscription.pk).next_billing_date == \
+            datetime.date(2017, 3, 1)
+
+        plan.prebill_plan = True
+        with self.assertNumQueries(2):
+            plan.save()
+        assert Subscription.objects.get(pk=subscription.pk).next_billing_date is None
+
+        subscription = Subscription.objects.get(pk=subscription.pk)
+        subscription.update_next_billing_date()
+        assert Subscription.objects.get(pk=subscription.pk).next_billing_date == \
+            datetime.date(2017, 2, 1)
+
+        billing_log.delete()
+        assert Subscription.objects.get(pk=subscription.pk).next_billing_date == \
+            datetime.date(2017, 1, 1)
+
+        Subscription.objects.filter(pk=subscription.pk).update(
+            state=Subscription.STATES.CANCELED, cancel_date=datetime.date(2017, 1, 15)
+        )
+        subscription = Subscription.objects.get(pk=subscription.pk)
+        subscription.save()
+        assert subscription.next_billing_date == datetime.date(2017, 1, 16)
+
+        subscription.end()
+        subscription.save(update_fields=['state', 'ended_at'])
+        assert Subscription.objects.get(pk=subscription.pk).next_billing_date is None
+
+    def test_next_billing_date_is_kept_on_unrelated_saves(self):
+        plan = PlanFactory.create(interval=Plan.INTERVALS.MONTH, interval_count=1,
+                                  prebill_plan=False)
+        subscription = SubscriptionFactory.create(plan=plan, start_date=datetime.date(2017, 1, 1))
+        subscription.activate()
+        subscription.save()
+        assert subscription.next_billing_date == datetime.date(2017, 2, 1)
+
+        provider = Provider.objects.get(pk=plan.provider_id)
+        provider.address_1 = 'Another street'
+        provider.meta = {'key': 'value'}
+        provider.invoice_starting_number += 1
+        provider.save()
+
+        plan = Plan.objects.get(pk=plan.pk)
+        plan.name = 'Another name'
+        plan.save()
+
+        # Assigning the same values isn't a change either
+        plan.interval_count = 1
+        plan.save()
+
+        plan = Plan.objects.defer('interval', 'trial_period_days').get(pk=plan.pk)
+        plan.save(update_fields=['name'])
+
+        assert Subscription.objects.get(pk=subscription.pk).next_billing_date == \
+            datetime.date(2017, 2, 1)
+
+        # A deferred field which is assigned is assumed to have changed
+        provider = Provider.objects.defer('prebill_plan').get(pk=provider.pk)
+        provider.prebill_plan = False
+        provider.save()
+
+        assert Subscription.objects.get(pk=subscription.pk).next_billing_date is None
+
+    def test_subscriptions_due_for_billing(self):
+        plan = PlanFactory.create(interval=Plan.INTERVALS.MONTH, interval_count=1,
+                                  prebill_plan=True)
+        due = SubscriptionFactory.create(plan=plan, start_date=datetime.date(2017, 1, 1),
+                                         state=Subscription.STATES.ACTIVE)
+        not_due = SubscriptionFactory.create(plan=plan, start_date=datetime.date(2017, 1, 2),
+                                             state=Subscription.STATES.ACTIVE)
+        unknown = SubscriptionFactory.create(plan=plan, start_date=datetime.date(2017, 1, 2),
+                                             state=Subscription.STATES.ACTIVE)
+        Subscription.objects.filter(pk=unknown.pk).update(next_billing_date=None)
+        SubscriptionFactory.create(plan=plan, start_date=datetime.date(2017, 1, 1))
+
+        due_subscriptions = Subscription.objects.due_for_billing(datetime.date(2017, 1, 1))
+
+        assert set(due_subscriptions) == {due, unknown}
+        assert not_due not in due_subscriptions
+
+    @override_settings(TEMPLATES=[{
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'APP_DIRS': False,
+        'OPTIONS': {
+            'loaders': [
+                ('django.template.loaders.locmem.Loader', {
+                    'billing_documents/entry_unit.html': 'default {{ unit }}',
+                    'billing_documents/custom/entry_unit.html': 'custom {{ unit }}',
+                }),
+            ],
+        },
+    }])
+    def test_field_templates_are_cached(self):
+        with patch('silver.models.subscriptions.select_template',
+                   wraps=select_template) as select_template_mock:
+            for _ in range(3):
+                assert render_field_template('entry_unit', {'unit': 'GB'},
+                                             provider='custom') == 'custom GB'
+                assert render_field_template('entry_unit', {'unit': 'GB'},
+                                             provider='other') == 'default GB'
+
+            assert select_template_mock.call_count == 2
+
+            clear_field_templates_cache()
+            render_field_template('entry_unit', {'unit': 'GB'}, provider='custom')
+
+            assert select_template_mock.call_count == 3
+
+    def test_billing_state_is_kept_in_sync_with_the_billing_logs(self):
+        subscription = SubscriptionFactory.create(start_date=datetime.date(2017, 1, 1))
+        subscription.activate()
+        subscription.save()
+
+        assert subscription.billing_logs_count == 0
+
+        stale_subscription = Subscription.objects.get(pk=subscription.pk)
+
+        BillingLog.objects.create(subscription=subscription,
+                                  billing_date=datetime.date(2017, 2, 1),
+                                  plan_billed_up_to=datetime.date(2017, 2, 28),
+                                  metered_features_billed_up_to=datetime.date(2017, 1, 31))
+        last_billing_log = BillingLog.objects.create(
+            subscription=subscription, billing_date=datetime.date(2017, 3, 1),
+            plan_billed_up_to=datetime.date(2017, 3, 31),
+            metered_features_billed_up_to=datetime.date(2017, 2, 28)
+        )
+
+        # Saving a stale instance doesn't overwrite the billing state
+        stale_subscription.description = 'stale'
+        stale_subscription.save()
+
+        subscription = Subscription.objects.select_related('plan__provider').get(
+            pk=subscription.pk
+        )
+        with self.assertNumQueries(0):
+            assert subscription.billing_logs_count == 2
+            assert not subscription.is_billed_first_time
+            assert subscription.last_billing_date == datetime.date(2017, 3, 1)
+            assert subscription.billed_up_to_dates == {
+                'plan_billed_up_to': datetime.date(2017, 3, 31),
+                'metered_features_billed_up_to': datetime.date(2017, 2, 28)
+            }
+            subscription.should_be_billed(datetime.date(2017, 4, 1))
+
+        last_billing_log.delete()
+
+        subscription = Subscription.objects.get(pk=subscription.pk)
+        assert subscription.billing_logs_count == 1
+        assert subscription.last_billing_date == datetime.date(2017, 2, 1)
+        assert subscription.plan_billed_up_to == datetime.date(2017, 2, 28)
+
+    def test_billing_state_falls_back_to_the_billing_logs(self):
+        subscription = SubscriptionFactory.create(start_date=datetime.date(2017, 1, 1))
+        BillingLog.objects.create(subscription=subscription,
+                                  billing_date=datetime.date(2017, 2, 1),
+                                  plan_billed_up_to=datetime.date(2017, 2, 28),
+                                  metered_features_billed_up_to=datetime.date(2017, 1, 31))
+        Subscription.objects.filter(pk=subscription.pk).update(billing_logs_count=None)
+
+        subscription = Subscription.objects.get(pk=subscription.pk)
+        assert not subscription.has_billing_state
+        assert subscription.last_billing_date == datetime.date(2017, 2, 1)
+        assert subscription.billed_up_to_dates['plan_billed_up_to'] == \
+            datetime.date(2017, 2, 28)
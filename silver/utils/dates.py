@@ -33,3 +33,56 @@ def last_day_of_month(date):
 
 def prev_month(date):
     return date - ONE_MONTH
+
+
+def first_aligned_date(date, interval):
+    """
+    Returns the first date, starting with the given one, that a cycle of the
+    given interval can be aligned to: the 1st of the month for monthly cycles,
+    Monday for weekly cycles and the 1st of January for yearly cycles.
+    """
+
+    if interval == 'month':
+        if date.day == 1:
+            return date
+        return first_day_of_month(next_month(date))
+    elif interval == 'week':
+        return date + timedelta(days=(7 - date.weekday()) % 7)
+    elif interval == 'year':
+        if date.month == 1 and date.day == 1:
+            return date
+        return date.replace(year=date.year + 1, month=1, day=1)
+
+    return date
+
+
+def last_cycle_start_date(range_start, range_end, interval, interval_count):
+    """
+    Returns the start date of the last cycle of `interval_count` intervals that
+    starts within [range_start, range_end], the cycles being aligned to the
+    first aligned date following range_start (see `first_aligned_date`).
+
+    If no aligned date exists within the range, range_start is returned.
+    """
+
+    aligned_start_date = first_aligned_date(range_start, interval)
+    if aligned_start_date > range_end:
+        return range_start
+
+    if interval == 'month':
+        elapsed = ((range_end.year - aligned_start_date.year) * 12 +
+                   range_end.month - aligned_start_date.month)
+        return aligned_start_date + relativedelta(
+            months=elapsed - elapsed % interval_count
+        )
+    elif interval == 'year':
+        elapsed = range_end.year - aligned_start_date.year
+        return aligned_start_date + relativedelta(
+            years=elapsed - elapsed % interval_count
+        )
+
+    days = 7 if interval == 'week' else 1
+    elapsed = (range_end - aligned_start_date).days // days
+    return aligned_start_date + timedelta(
+        days=(elapsed - elapsed % interval_count) * days
+    )
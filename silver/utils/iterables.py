@@ -0,0 +1,58 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from itertools import islice
+
+
+def chunks(iterable, size):
+    """
+    Splits an iterable into lists of at most `size` items, without
+    materializing the whole iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+
+        yield chunk
+
+
+def queryset_chunks(queryset, size):
+    """
+    Splits a queryset into lists of at most `size` objects, ordered by their
+    primary keys. Each chunk is fetched using a separate keyset paginated query
+    (`pk > last_pk LIMIT size`), so that only one chunk is kept in memory at a
+    time, regardless of the size of the queryset.
+
+    .. note:: The existing ordering of the queryset is ignored.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+
+    while True:
+        chunk_queryset = queryset
+        if last_pk is not None:
+            chunk_queryset = chunk_queryset.filter(pk__gt=last_pk)
+
+        chunk = list(chunk_queryset[:size])
+        if not chunk:
+            return
+
+        yield chunk
+
+        if len(chunk) < size:
+            return
+
+        last_pk = chunk[-1].pk
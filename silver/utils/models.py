@@ -13,9 +13,20 @@
 # limitations under the License.
 
 from django.db import models
+from django.db.models import BigIntegerField, Func, Value
+from django.db.models.functions import Cast, Coalesce
 from django.utils import timezone
 
 
+def loaded_field_values(instance, fields):
+    """
+    :returns: a dict containing the values of the given fields of a model
+        instance, except for the deferred ones, which aren't loaded.
+    """
+
+    return {field: instance.__dict__[field] for field in fields if field in instance.__dict__}
+
+
 class UnsavedForeignKey(models.ForeignKey):
     allow_unsaved_instance_assignment = True
 
@@ -23,3 +34,59 @@ class UnsavedForeignKey(models.ForeignKey):
 class AutoDateTimeField(models.DateTimeField):
     def pre_save(self, model_instance, add):
         return timezone.now()
+
+
+def scaled_integer(expression, decimal_places):
+    """
+    :returns: an SQL expression of the given decimal expression, scaled to an
+        integer (e.g. 12.3456 with 4 decimal places is 123456). NULL is 0.
+    """
+
+    return Cast(
+        Func(Coalesce(expression, Value(0)) * Value(10 ** decimal_places), function='ROUND'),
+        BigIntegerField()
+    )
+
+
+class RoundedDivision(Func):
+    """
+    The division of an integer expression by a positive even integer, rounded
+    half to even, which is how `Decimal.quantize` rounds by default.
+
+    The dividend is shifted by a large multiple of twice the divisor, so that
+    the truncating integer division of the databases works with negative
+    dividends too, and is used only twice, so that nesting divisions doesn't
+    blow up the size of the query.
+    """
+
+    output_field = BigIntegerField()
+
+    # The shifted dividends must fit into 64 bit integers
+    SHIFT = 10 ** 17
+
+    def __init__(self, dividend, divisor, **extra):
+        self.divisor = int(divisor)
+        if self.divisor <= 0 or self.divisor % 2:
+            raise ValueError('The divisor must be a positive even integer.')
+
+        super(RoundedDivision, self).__init__(dividend, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        dividend_sql, dividend_params = compiler.compile(self.source_expressions[0])
+
+        # The shift is a multiple of twice the divisor, meaning that the
+        # result is shifted by an even number
+        shift_quotient = 2 * (self.SHIFT // self.divisor)
+        shifted_dividend = '(({dividend}) + {shift})'.format(
+            dividend=dividend_sql, shift=shift_quotient * self.divisor + self.divisor // 2
+        )
+        integer_division = 'DIV' if connection.vendor == 'mysql' else '/'
+
+        # Rounding half up, unless a tie would be rounded to an odd number
+        sql = (
+            '({shifted} {div} {divisor} - {shift_quotient} - '
+            'CASE WHEN {shifted} %% {double_divisor} = {divisor} THEN 1 ELSE 0 END)'
+        ).format(shifted=shifted_dividend, div=integer_division, divisor=self.divisor,
+                 shift_quotient=shift_quotient, double_divisor=2 * self.divisor)
+
+        return sql, dividend_params * 2
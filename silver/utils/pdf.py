@@ -1,18 +1,48 @@
+import base64
+import mimetypes
+import multiprocessing
 import os
+import signal
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from xhtml2pdf import pisa
 
 from django.conf import settings
 
 
+PDF_RENDERING_PROCESSES = getattr(settings, 'SILVER_PDF_RENDERING_PROCESSES', 0)
+PDF_RENDERING_TIMEOUT = getattr(settings, 'SILVER_PDF_RENDERING_TIMEOUT', 60)  # default 60s
+PDF_RENDERING_TIMEOUT_MARGIN = 5  # seconds
+PDF_RESOURCES_CACHE_SIZE = getattr(settings, 'SILVER_PDF_RESOURCES_CACHE_SIZE',
+                                   16 * 1024 * 1024)  # default 16MB
+PDF_PRELOADED_RESOURCES = getattr(settings, 'SILVER_PDF_PRELOADED_RESOURCES', ())
+
+
 class UnsupportedMediaPathException(Exception):
     pass
 
 
+class PDFRenderingTimeout(Exception):
+    pass
+
+
 def fetch_resources(uri, rel):
     """
     Callback to allow xhtml2pdf/reportlab to retrieve Images,Stylesheets, etc.
     `uri` is the href attribute from the html link element.
     `rel` gives a relative path, but it's not used here.
+
+    The static resources are served from the process wide resources cache.
     """
+    if settings.STATIC_URL and uri.startswith(settings.STATIC_URL):
+        return resources_cache.get(uri)
+
+    return get_resource_path(uri)
+
+
+def get_resource_path(uri):
     if settings.MEDIA_URL and uri.startswith(settings.MEDIA_URL):
         path = os.path.join(settings.MEDIA_ROOT,
                             uri.replace(settings.MEDIA_URL, ""))
@@ -31,3 +61,229 @@ def fetch_resources(uri, rel):
             settings.MEDIA_URL, settings.STATIC_URL))
 
     return path
+
+
+class ResourcesCache(object):
+    """
+    A LRU cache of the static resources used by the PDFs, keyed by URI and
+    bounded by the total size of the cached values, in bytes.
+
+    The images are kept inlined, as data URIs, so that they aren't read again
+    for each PDF. The rest of the resources (stylesheets, which may reference
+    other resources relative to their path, and fonts, which are loaded from
+    files) are kept as paths, sparing the lookup through STATICFILES_DIRS.
+    The resources which are not found aren't cached.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = PDF_RESOURCES_CACHE_SIZE if max_size is None else max_size
+        self.size = 0
+
+        self._resources = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, uri):
+        return uri in self._resources
+
+    def __len__(self):
+        return len(self._resources)
+
+    def get(self, uri):
+        with self._lock:
+            resource = self._resources.pop(uri, None)
+            if resource is not None:
+                # Mark the resource as the most recently used one
+                self._resources[uri] = resource
+                return resource
+
+        resource = self.load(uri)
+        if resource is None:
+            return get_resource_path(uri)
+
+        with self._lock:
+            if uri not in self._resources:
+                self._resources[uri] = resource
+                self.size += len(resource)
+
+            while self.size > self.max_size:
+                _, evicted_resource = self._resources.popitem(last=False)
+                self.size -= len(evicted_resource)
+
+        return resource
+
+    def load(self, uri):
+        """
+        :returns: the value to be cached for the given URI, or None if the
+            resource shouldn't be cached.
+        """
+
+        path = get_resource_path(uri)
+        if not os.path.isfile(path):
+            return None
+
+        mimetype, _ = mimetypes.guess_type(path)
+        if not mimetype or not mimetype.startswith('image/'):
+            return path
+
+        with open(path, 'rb') as resource_file:
+            return 'data:{mimetype};base64,{data}'.format(
+                mimetype=mimetype, data=base64.b64encode(resource_file.read())
+            )
+
+    def warm_up(self, uris=None):
+        """
+        Loads the given resources (by default, the SILVER_PDF_PRELOADED_RESOURCES)
+        into the cache.
+
+        :returns: the URIs of the resources which couldn't be loaded.
+        """
+
+        missing_uris = []
+        for uri in PDF_PRELOADED_RESOURCES if uris is None else uris:
+            self.get(uri)
+
+            if uri not in self:
+                missing_uris.append(uri)
+
+        return missing_uris
+
+    def clear(self):
+        with self._lock:
+            self._resources.clear()
+            self.size = 0
+
+
+resources_cache = ResourcesCache()
+
+
+def html_to_pdf(html):
+    """
+    :returns: the PDF rendered from the given HTML, as bytes.
+    """
+
+    pdf_file = BytesIO()
+    pisa.pisaDocument(src=html.encode('UTF-8'),
+                      dest=pdf_file,
+                      encoding='UTF-8',
+                      link_callback=fetch_resources)
+
+    return pdf_file.getvalue()
+
+
+def _raise_rendering_timeout(signum, frame):
+    raise PDFRenderingTimeout('The PDF rendering exceeded its timeout.')
+
+
+def _html_to_pdf_within_timeout(html, timeout):
+    # Runs within the pool's workers, which are interrupted (instead of being
+    # killed, along with the jobs they might have taken) once the timeout expires
+    previous_handler = signal.signal(signal.SIGALRM, _raise_rendering_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        return html_to_pdf(html)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+class PDFRenderer(object):
+    """
+    Renders HTML to PDF.
+
+    xhtml2pdf is CPU bound pure Python, so the renderings can be sent to a
+    pool of `processes` worker processes. A rendering taking longer than
+    `timeout` seconds (unless it is 0) is interrupted and raises
+    PDFRenderingTimeout.
+
+    Without processes, the renderings run within the calling process, which
+    is what Celery workers should do, being pool processes themselves (the
+    tasks' time limit applying instead of the timeout).
+    """
+
+    def __init__(self, processes=None, timeout=None):
+        self.processes = PDF_RENDERING_PROCESSES if processes is None else processes
+        self.timeout = PDF_RENDERING_TIMEOUT if timeout is None else timeout
+
+        self._pool = None
+        self._stuck = False
+
+        # Before the pool is started, so that its processes inherit the cache
+        resources_cache.warm_up()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+
+        return self._pool
+
+    def render_async(self, html):
+        """
+        Starts rendering the given HTML.
+
+        :returns: a callable which waits for the rendering to finish and
+            returns the PDF, as bytes.
+        """
+
+        if not self.processes:
+            pdf = html_to_pdf(html)
+            return lambda: pdf
+
+        result = self.pool.apply_async(_html_to_pdf_within_timeout, (html, self.timeout))
+
+        def get_pdf():
+            if not self.timeout:
+                return result.get()
+
+            # In case the worker can't be interrupted (e.g. it's stuck in C code),
+            # the result is waited for only a little longer than the timeout
+            try:
+                return result.get(self.timeout + PDF_RENDERING_TIMEOUT_MARGIN)
+            except multiprocessing.TimeoutError:
+                self._stuck = True
+                raise PDFRenderingTimeout('The PDF rendering exceeded its timeout.')
+
+        return get_pdf
+
+    def render(self, html):
+        """
+        :returns: the PDF rendered from the given HTML, as bytes.
+        """
+
+        return self.render_async(html)()
+
+    def close(self):
+        if self._pool is not None:
+            if self._stuck:
+                # Joining a stuck worker would wait forever
+                self._pool.terminate()
+            else:
+                self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self._stuck = False
+
+
+_default_renderer = None
+
+
+def get_pdf_renderer():
+    """
+    :returns: the process wide renderer, configured through the
+        SILVER_PDF_RENDERING_PROCESSES and SILVER_PDF_RENDERING_TIMEOUT
+        settings.
+    """
+
+    global _default_renderer
+
+    if _default_renderer is None:
+        _default_renderer = PDFRenderer()
+
+    return _default_renderer
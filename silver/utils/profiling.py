@@ -0,0 +1,218 @@
+# Copyright (c) 2018 Presslabs SRL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from timeit import default_timer
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+CUSTOMER_PHASE = 'customer'
+
+_local = threading.local()
+
+
+def get_active_profiler():
+    return getattr(_local, 'profiler', None)
+
+
+@contextmanager
+def profile_phase(name, key=None):
+    """
+    Measures the enclosed block as a `name` phase of the active profiler, if
+    there is one.
+    """
+
+    profiler = get_active_profiler()
+    if profiler is None:
+        yield
+        return
+
+    with profiler.phase(name, key):
+        yield
+
+
+def profiled(name):
+    """
+    Decorator that measures each call of the decorated function as a `name`
+    phase of the active profiler, if there is one.
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = get_active_profiler()
+            if profiler is None:
+                return function(*args, **kwargs)
+
+            with profiler.phase(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def percentile(sorted_values, percent):
+    """
+    :returns: the nearest-rank percentile of the given (sorted) values.
+    """
+
+    if not sorted_values:
+        return None
+
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+class BillingProfiler(object):
+    """
+    Collects the time spent and the number of queries executed within each of
+    the phases of a billing run.
+
+    The profiler is active in the thread that entered it, meaning that the
+    phases don't have to be passed around explicitly (see `profile_phase` and
+    `profiled`). Nested phases of the same kind are measured only once.
+
+    .. note:: The queries are counted using the connection's queries log, which
+        is cleared while the profiler is active.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, slowest_customers_count=10):
+        self.connection = connections[using]
+        self.slowest_customers_count = slowest_customers_count
+
+        self.samples = defaultdict(list)
+        self.duration = None
+
+        self._active_phases = set()
+        self._queries_count = 0
+
+    def __enter__(self):
+        self._previous_profiler = get_active_profiler()
+        _local.profiler = self
+
+        self._force_debug_cursor = self.connection.force_debug_cursor
+        self.connection.force_debug_cursor = True
+        self.connection.queries_log.clear()
+
+        self._start_time = default_timer()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = default_timer() - self._start_time
+
+        self._count_queries()
+        self.connection.force_debug_cursor = self._force_debug_cursor
+
+        _local.profiler = self._previous_profiler
+
+    def _count_queries(self):
+        # The queries log has a limited length, so it's emptied on each read
+        queries_log = self.connection.queries_log
+        self._queries_count += len(queries_log)
+        queries_log.clear()
+
+        return self._queries_count
+
+    @contextmanager
+    def phase(self, name, key=None):
+        if name in self._active_phases:
+            yield
+            return
+
+        self._active_phases.add(name)
+        start_time = default_timer()
+        start_queries_count = self._count_queries()
+
+        try:
+            yield
+        finally:
+            self._active_phases.discard(name)
+            self.samples[name].append((
+                default_timer() - start_time,
+                self._count_queries() - start_queries_count,
+                key
+            ))
+
+    def report(self):
+        """
+        :returns: a JSON serializable dict, containing the duration percentiles
+            and the number of queries of each phase, as well as the slowest
+            customers.
+        """
+
+        phases = {}
+        for name, samples in self.samples.items():
+            durations = sorted(duration for duration, _, _ in samples)
+
+            phases[name] = {
+                'count': len(samples),
+                'total': round(sum(durations), 6),
+                'p50': round(percentile(durations, 50), 6),
+                'p90': round(percentile(durations, 90), 6),
+                'p99': round(percentile(durations, 99), 6),
+                'max': round(durations[-1], 6),
+                'queries': sum(queries for _, queries, _ in samples)
+            }
+
+        slowest_customers = sorted(self.samples.get(CUSTOMER_PHASE, []),
+                                   key=lambda sample: sample[0], reverse=True)
+
+        return {
+            'duration': round(self.duration or 0, 6),
+            'queries': self._queries_count,
+            'phases': phases,
+            'slowest_customers': [
+                {'customer': customer_id, 'duration': round(duration, 6),
+                 'queries': queries}
+                for duration, queries, customer_id
+                in slowest_customers[:self.slowest_customers_count]
+            ]
+        }
+
+
+def format_report(report):
+    """
+    :returns: the given profiling report, as a human readable text.
+    """
+
+    lines = [
+        'Duration: {duration:.3f}s, queries: {queries}'.format(**report),
+        '',
+        '{:<24}{:>8}{:>12}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+            'Phase', 'Count', 'Total (s)', 'p50', 'p90', 'p99', 'Max', 'Queries'
+        )
+    ]
+
+    for name, phase in sorted(report['phases'].items(),
+                              key=lambda item: item[1]['total'], reverse=True):
+        lines.append(
+            '{name:<24}{count:>8}{total:>12.3f}{p50:>10.4f}{p90:>10.4f}'
+            '{p99:>10.4f}{max:>10.4f}{queries:>10}'.format(name=name, **phase)
+        )
+
+    if report['slowest_customers']:
+        lines.extend(['', 'Slowest customers:'])
+        for customer in report['slowest_customers']:
+            lines.append(
+                '  customer {customer}: {duration:.4f}s, {queries} queries'.format(**customer)
+            )
+
+    return '\n'.join(lines)